@@ -0,0 +1,314 @@
+"""
+Benchmark cloudsecrets against local stand-ins (moto, an in-process GCP client and
+temp files). Run from the repository root:
+
+    python -m benchmarks --output results.json
+    python -m benchmarks --quick --compare results.json
+
+Every result is the time per operation in seconds, so lower is better.
+"""
+
+import argparse
+import collections
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.fakes import BACKENDS
+
+KEY_COUNTS = [10, 100, 1000, 10000]
+VALUE_SIZES = [1, 1024, 1024 * 1024]
+SECRET_CASES = ["cold_load", "get_first", "get", "set", "poll"]
+CASES = SECRET_CASES + ["cli_startup", "agent"]
+
+
+def measure(run, repeat) -> dict:
+    """
+    Call run() repeat times; run returns how many operations it performed
+    """
+    per_op = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        ops = run()
+        per_op.append((time.perf_counter() - start) / ops)
+    return {
+        "min": min(per_op),
+        "median": statistics.median(per_op),
+        "mean": statistics.mean(per_op),
+        "repeat": repeat,
+    }
+
+
+def bench_secret(factory, backend, cases, keys, size, args) -> dict:
+    name = f"bench-{keys}-{size}"
+    value = "x" * size
+    factory(name).set_many({f"KEY_{i}": value for i in range(keys)})
+    results = {}
+    if "cold_load" in cases:
+        results["cold_load"] = measure(lambda: factory(name) and 1, args.repeat)
+    if "get_first" in cases:
+        # first access to each key, which pays for decoding it
+        loaded = [factory(name) for _ in range(args.repeat)]
+
+        def get_first():
+            s = loaded.pop()
+            for i in range(keys):
+                s[f"KEY_{i}"]
+            return keys
+
+        results["get_first"] = measure(get_first, args.repeat)
+    if "get" in cases:
+        s = factory(name)
+        for i in range(keys):
+            s[f"KEY_{i}"]
+
+        def get():
+            for i in range(keys):
+                s[f"KEY_{i}"]
+            return keys
+
+        results["get"] = measure(get, args.repeat)
+    if "set" in cases:
+        s = factory(name)
+        n = min(keys, args.sets)
+        counter = iter(range(sys.maxsize))
+
+        def set_():
+            for i in range(n):
+                s.set(f"KEY_{i}", f"{next(counter)}".ljust(size, "x"))
+            return n
+
+        results["set"] = measure(set_, args.repeat)
+    if "poll" in cases and backend != "file":
+        # an unchanged poll tick, which is what nearly every tick is
+        s = factory(name)
+        results["poll"] = measure(lambda: s._poll_secrets() or 1, args.repeat)
+    return results
+
+
+def bench_cli(args) -> dict:
+    commands = {
+        "import": [sys.executable, "-c", "import cloudsecrets"],
+        "help": [
+            sys.executable,
+            "-c",
+            "from cloudsecrets.cli import main; main()",
+            "--help",
+        ],
+    }
+    results = {}
+    for label, command in commands.items():
+
+        def run():
+            subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+            return 1
+
+        results[label] = measure(run, args.repeat)
+    return results
+
+
+def bench_agent(args) -> dict:
+    """
+    args.clients clients of one AWS secret, each loading it and polling once,
+    through a local agent and directly. Besides latencies this reports the
+    upstream calls per client (as "seconds" per op, so lower is still better).
+    """
+    from cloudsecrets import agent
+
+    results = {}
+    with BACKENDS["aws"]() as factory, tempfile.TemporaryDirectory() as tmp:
+        calls = collections.Counter()
+        factory.connection.meta.events.register(
+            "before-call", lambda model, **kw: calls.update([model.name])
+        )
+        name = "bench-agent"
+        factory(name).set_many({f"KEY_{i}": "x" * 64 for i in range(100)})
+
+        calls.clear()
+        for _ in range(args.clients):
+            factory(name)._poll_secrets()
+        direct = sum(calls.values()) / args.clients
+
+        path = os.path.join(tmp, "agent.sock")
+        server = agent.Server(
+            path,
+            polling_interval=0,
+            defaults={"connection": factory.connection, "is_binary": True},
+        )
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            calls.clear()
+            clients = []
+            results["open"] = measure(
+                lambda: clients.append(
+                    agent.Secrets(name, provider="aws", socket_path=path)
+                )
+                or 1,
+                args.clients,
+            )
+            for s in clients:
+                s._poll_secrets()
+            # the agent's own poll tick, shared by every client
+            server.entries[0].secrets._poll_secrets()
+            through_agent = sum(calls.values()) / args.clients
+
+            s = clients[0]
+            results["poll"] = measure(
+                lambda: [s._latest_version() for _ in range(1000)] and 1000,
+                args.repeat,
+            )
+            results["get"] = measure(
+                lambda: [s[f"KEY_{i}"] for i in range(100)] and 100, args.repeat
+            )
+        finally:
+            server.shutdown()
+            server.server_close()
+    for label, value in (("direct", direct), ("agent", through_agent)):
+        results[f"upstream_calls_{label}"] = {
+            "min": value,
+            "median": value,
+            "mean": value,
+            "repeat": 1,
+        }
+    return results
+
+
+def run(args) -> list:
+    records = []
+    backends = args.backends if set(args.cases) & set(SECRET_CASES) else []
+    for backend in backends:
+        with BACKENDS[backend]() as factory:
+            for keys in args.keys:
+                for size in args.sizes:
+                    if keys * size > args.max_payload:
+                        continue
+                    results = bench_secret(
+                        factory, backend, args.cases, keys, size, args
+                    )
+                    for case, result in results.items():
+                        records.append(
+                            dict(
+                                result,
+                                case=case,
+                                backend=backend,
+                                keys=keys,
+                                value_size=size,
+                            )
+                        )
+                        report(records[-1])
+    if "cli_startup" in args.cases:
+        for label, result in bench_cli(args).items():
+            records.append(dict(result, case="cli_startup", backend=label))
+            report(records[-1])
+    if "agent" in args.cases:
+        for label, result in bench_agent(args).items():
+            records.append(dict(result, case=f"agent_{label}", backend="agent"))
+            report(records[-1])
+    return records
+
+
+def report(record) -> None:
+    where = f"{record['backend']}"
+    if "keys" in record:
+        where += f" keys={record['keys']} value_size={record['value_size']}"
+    if "upstream_calls" in record["case"]:
+        value = f"{record['median']:12.1f} calls/client"
+    else:
+        value = f"{record['median'] * 1e6:12.1f} us/op"
+    print(f"{record['case']:<28} {where:<40} {value}", file=sys.stderr)
+
+
+def _key(record) -> tuple:
+    return (
+        record["case"],
+        record["backend"],
+        record.get("keys"),
+        record.get("value_size"),
+    )
+
+
+def compare(records, baseline, threshold) -> list:
+    """
+    Return (record, baseline median) for every result slower than threshold times the baseline
+    """
+    before = {_key(r): r["median"] for r in baseline["results"]}
+    return [
+        (r, before[_key(r)])
+        for r in records
+        if _key(r) in before and r["median"] > before[_key(r)] * threshold
+    ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="cloudsecrets benchmarks")
+    parser.add_argument(
+        "--backends", nargs="+", choices=list(BACKENDS), default=list(BACKENDS)
+    )
+    parser.add_argument("--cases", nargs="+", choices=CASES, default=CASES)
+    parser.add_argument("--keys", nargs="+", type=int, default=KEY_COUNTS)
+    parser.add_argument("--sizes", nargs="+", type=int, default=VALUE_SIZES)
+    parser.add_argument(
+        "--max-payload",
+        type=int,
+        default=32 * 1024 * 1024,
+        help="skip combinations of keys and value size larger than this many bytes",
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--sets", type=int, default=20, help="writes per set round")
+    parser.add_argument(
+        "--clients", type=int, default=20, help="clients sharing the agent"
+    )
+    parser.add_argument(
+        "--quick", action="store_true", help="a small matrix for a fast check"
+    )
+    parser.add_argument("--output", help="write JSON results here instead of stdout")
+    parser.add_argument("--compare", help="JSON results of an earlier run")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.25,
+        help="slowdown against --compare which counts as a regression",
+    )
+    args = parser.parse_args(argv)
+    # every benchmarked set() overwrites a key, which would log a warning each time
+    logging.disable(logging.WARNING)
+    if args.quick:
+        args.keys, args.sizes, args.repeat = [10, 1000], [1, 1024], 3
+
+    records = run(args)
+    out = {
+        "meta": {
+            "timestamp": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "results": records,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(out, f, indent=2)
+    else:
+        json.dump(out, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(records, json.load(f), args.threshold)
+        for record, before in regressions:
+            print(
+                f"REGRESSION {_key(record)}: {before * 1e6:.1f} -> {record['median'] * 1e6:.1f} us/op",
+                file=sys.stderr,
+            )
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,61 @@
+"""
+Offline stand-ins for the upstream providers used by the benchmarks
+"""
+
+import contextlib
+import os
+import shutil
+import tempfile
+
+from tests.unit.test_gcp_library import InMemoryClient
+
+
+@contextlib.contextmanager
+def aws():
+    """
+    Yield a factory for AWS Secrets backed by moto
+    """
+    import boto3
+    from moto import mock_secretsmanager
+
+    from cloudsecrets.aws import Secrets
+
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "fake")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "fake")
+    with mock_secretsmanager():
+        connection = boto3.client("secretsmanager", region_name="us-east-1")
+
+        def factory(name, **kw):
+            return Secrets(name, connection=connection, is_binary=True, **kw)
+
+        factory.connection = connection
+        yield factory
+
+
+@contextlib.contextmanager
+def gcp():
+    """
+    Yield a factory for GCP Secrets backed by the tests' in-memory client
+    """
+    from cloudsecrets.gcp import Secrets
+
+    os.environ.setdefault("GOOGLE_APPLICATION_CREDENTIALS", os.devnull)
+    client = InMemoryClient()
+    yield lambda name, **kw: Secrets(name, project="bench", client=client, **kw)
+
+
+@contextlib.contextmanager
+def file():
+    """
+    Yield a factory for file Secrets kept in a temporary directory
+    """
+    from cloudsecrets.file import Secrets
+
+    directory = tempfile.mkdtemp(prefix="cloudsecrets-bench-")
+    try:
+        yield lambda name, **kw: Secrets(os.path.join(directory, name), **kw)
+    finally:
+        shutil.rmtree(directory)
+
+
+BACKENDS = {"aws": aws, "gcp": gcp, "file": file}
@@ -1,16 +1,52 @@
-import base64
+import importlib
 import json
 import logging
 import os
+import random
 import threading
+import time
+from contextlib import contextmanager
+
+from cloudsecrets import cache, metrics, retry
+from cloudsecrets.versions import VersionIndex
+from cloudsecrets.lazy import LazySecrets
+
+
+class WriteConflict(Exception):
+    """
+    A conditional write lost the race: upstream moved past the version it was based on
+    """
 
 
 class SecretsBase:
     def __init__(self, secret, **kwargs) -> None:
         logging.getLogger(__name__)
-        self._secrets = {}
-        self._encoded_secrets = {}
-        self._timer = None
+        self._secrets = LazySecrets()
+        self._poll_job = None
+        self._scheduler = kwargs.get("scheduler", None)
+        self._cache = kwargs.get("cache", None)
+        if self._cache is True:
+            self._cache = cache.get_cache()
+        self._disk_cache = kwargs.get("disk_cache", None)
+        self._metrics = kwargs.get("metrics", metrics.get_default())
+        self._compare_and_swap = kwargs.get("compare_and_swap", False)
+        self._max_conflict_retries = kwargs.get("max_conflict_retries", 5)
+        # opt-in packed storage format (see cloudsecrets.storage)
+        self._compression = kwargs.get("compression", None)
+        self._max_payload = kwargs.get("max_payload", None)
+        # companion secrets holding the chunks of the current payload
+        self._chunks = []
+        # the version whose values are currently held, once anything was loaded
+        self._loaded_version = None
+        # None until a backend learns whether the upstream resource exists
+        self._exists = None
+        self._batching = False
+        self._batch_pending = False
+        # held while local changes are staged or flushed, so a poll tick can't
+        # replace the store underneath them
+        self._state_lock = threading.RLock()
+        self._change_callbacks = []
+        self._versions = VersionIndex()
         self.secret = secret
         self.create_if_not_present = kwargs.get("create_if_not_present", True)
         self._version = kwargs.get("version", None)
@@ -20,13 +56,44 @@ class SecretsBase:
             self._polling_interval <= 0 or not self._version
         ), "Cannot use a non-latest secret version with polling"
 
-    def __del__(self):
-        self._timer = None
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """
+        Stop polling this secret
+        """
+        job = getattr(self, "_poll_job", None)
+        if job is not None:
+            self._poll_job = None
+            self._scheduler.unregister(job)
+
+    @classmethod
+    def _prefetch(cls, secrets, deadline=None, **kwargs) -> tuple:
+        """
+        Hook for load_many: fetch many secrets upstream at once and return the
+        keyword arguments to construct each of them with, and the cache passed in
+        them only to hand the fetched payloads over (None if there is none), which
+        load_many detaches from the loaded secrets. Nothing new should be started
+        after deadline (a time.monotonic() value), if there is one.
+        """
+        return kwargs, None
 
     @property
     def secrets(self) -> dict:
         return self._secrets
 
+    @property
+    def _encoded_secrets(self) -> dict:
+        return self._secrets.encoded
+
+    @_encoded_secrets.setter
+    def _encoded_secrets(self, encoded) -> None:
+        self._secrets = LazySecrets(encoded)
+
     @property
     def version(self) -> str:
         return self._version
@@ -35,31 +102,76 @@ class SecretsBase:
     def project(self) -> str:
         return self._project
 
-    @property
-    def _secret_exists(self) -> bool:
-        return True
-
     def __iter__(self) -> iter:
         return iter(self._secrets.items())
 
+    def __getitem__(self, key) -> str:
+        return self._secrets[key]
+
+    def __contains__(self, key) -> bool:
+        return key in self._secrets
+
+    def __len__(self) -> int:
+        return len(self._secrets)
+
+    def keys(self):
+        return self._secrets.keys()
+
+    def values(self):
+        return self._secrets.values()
+
+    def items(self):
+        return self._secrets.items()
+
     def _init_secrets(self) -> None:
-        if self._polling_interval > 0:
-            self._poll_secrets()
-        else:
+        if not self._load_from_disk():
             self._load_secrets()
+        if self._polling_interval > 0:
+            if self._scheduler is None:
+                from cloudsecrets import scheduler
+
+                self._scheduler = scheduler.get_scheduler()
+            self._poll_job = self._scheduler.register(self, self._polling_interval)
 
-    def get(self,*args,**kwargs):
-        return dict(self).get(*args,**kwargs)
+    def get(self, key, default=None):
+        return self._secrets.get(key, default)
 
     def _keys(self):
-        return dict(self).keys()
+        return self._secrets.keys()
 
     def _list_versions(self) -> list:
         return [self._version]
 
-    def _load_latest(self) -> None:
-        self._version = str(self._list_versions()[-1])
-        self._load_secrets()
+    def _scan_versions(self, after=None) -> list:
+        """
+        List (version, enabled) pairs newer than version after (all of them if after
+        is None), oldest to newest. Backends should override this to page through
+        their versions and stop as soon as they reach after.
+        """
+        return [(v, True) for v in self._list_versions()]
+
+    def _refresh_versions(self, full=False) -> VersionIndex:
+        """
+        Bring the version index up to date. Normally only versions newer than the
+        newest indexed one are listed; full re-lists everything, which also picks up
+        older versions disabled or destroyed since.
+        """
+        with self._versions.lock:
+            if full:
+                self._versions.replace(self._scan_versions())
+            else:
+                self._versions.extend(self._scan_versions(self._versions.newest))
+        return self._versions
+
+    def _indexed_versions(self, enabled_only=False) -> list:
+        return self._refresh_versions().ids(enabled_only)
+
+    def _latest_version(self) -> str:
+        """
+        Return the id of the newest upstream version. Backends should override this
+        with a metadata-only call so polling doesn't download the payload.
+        """
+        return str(self._list_versions()[-1])
 
     def _load_secrets(self) -> None:
         self._version = "1"
@@ -67,50 +179,433 @@ class SecretsBase:
     def _create_secret_resource(self) -> None:
         pass
 
+    @property
+    def _cache_scope(self) -> tuple:
+        """
+        (provider, scope) identifying where this secret lives, for the payload cache
+        """
+        return (type(self).__module__, None)
+
+    def _call(self, fn, *args, **kwargs):
+        """
+        Make a provider call through the shared retry/rate-limit/circuit-breaker layer
+        """
+        return self._call_in(self._cache_scope, fn, *args, **kwargs)
+
+    def _call_write(self, fn, *args, **kwargs):
+        """
+        _call for a write which isn't idempotent, so isn't retried once it may have landed
+        """
+        call = retry.requests.call_write
+        return self._observed_call(call, self._cache_scope, fn, args, kwargs)
+
+    def _call_in(self, scope, fn, *args, **kwargs):
+        """
+        _call, for a provider scope (e.g. another region) other than this secret's own
+        """
+        return self._observed_call(retry.requests.call, scope, fn, args, kwargs)
+
+    def _observed_call(self, call, scope, fn, args, kwargs):
+        if self._metrics is None:
+            return call(scope, fn, *args, **kwargs)
+        start = time.perf_counter()
+        error = None
+        try:
+            return call(scope, fn, *args, **kwargs)
+        except Exception as e:
+            error = retry.classify(e)
+            raise
+        finally:
+            self._metrics.observe_call(
+                scope[0],
+                getattr(fn, "__name__", "call"),
+                time.perf_counter() - start,
+                error,
+            )
+
+    def _observe_poll(self, lag) -> None:
+        if self._metrics is not None:
+            self._metrics.observe_poll(self._cache_scope[0], self.secret, lag)
+
+    def _load_failed(self, e) -> None:
+        """
+        An upstream load failed even after retries. Serve the last known value
+        (from disk, or what this instance already holds) rather than an empty
+        secret; with nothing to fall back on, raise.
+        """
+        if self._load_stale():
+            return
+        if self._loaded_version is None:
+            raise e
+        logging.warning(
+            f"Failed to load {self.secret}, keeping version {self._loaded_version}: {e}"
+        )
+        self._version = self._loaded_version
+
+    def _cached_fetch(self, fetch, version_of, size=len):
+        """
+        Fetch the payload for self._version through the payload cache, if one is configured.
+        A "latest" fetch is also cached under the version it resolved to.
+        """
+        if self._metrics is not None:
+            fetch = self._observed_fetch(fetch, size)
+        if self._cache is None:
+            return fetch()
+        key = self._cache_scope + (self.secret, self._version)
+        x = self._cache.get_or_load(key, fetch, size)
+        if not self._cache.pinned(self._version):
+            self._cache.put(key[:3] + (version_of(x),), x, size(x))
+        return x
+
+    def _observed_fetch(self, fetch, size):
+        def observed():
+            x = fetch()
+            self._metrics.observe_payload(self._cache_scope[0], self.secret, size(x))
+            return x
+
+        return observed
+
+    def _serialize(self) -> bytes:
+        """
+        The payload to write upstream: legacy JSON, or with compression set the packed
+        format, chunked across companion secrets if it's still over max_payload
+        """
+        data = self._secrets.dumps().encode("utf-8")
+        if self._compression is None:
+            return data
+        from cloudsecrets import storage
+
+        blob = storage.pack(data, self._compression)
+        limit = self._max_payload or storage.MAX_PAYLOAD
+        if len(blob) <= limit:
+            self._chunks = []
+            return blob
+        parts = storage.split(blob, limit)
+        chunks = []
+        for i, part in enumerate(parts):
+            name = f"{self.secret}--chunk-{i}"
+            chunks.append((name, self._write_chunk(name, part)))
+        self._chunks = [name for name, _ in chunks]
+        return storage.manifest(chunks, blob)
+
+    def _deserialize(self, blob) -> LazySecrets:
+        """
+        Parse a payload read from upstream, whichever format it was written in
+        """
+        from cloudsecrets import storage
+
+        if not storage.is_packed(blob):
+            self._chunks = []
+            return LazySecrets(json.loads(blob))
+        if storage.is_chunked(blob):
+            chunks = storage.chunks(blob)
+            blob = storage.join(blob, self._read_chunks(chunks))
+            self._chunks = [name for name, _ in chunks]
+        else:
+            self._chunks = []
+        return LazySecrets(json.loads(storage.unpack(blob)))
+
+    def _read_chunks(self, chunks) -> list:
+        """
+        Fetch the (secret, version) chunks of a payload in parallel
+        """
+        if len(chunks) == 1:
+            return [self._read_chunk(*chunks[0])]
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=min(len(chunks), 8)) as pool:
+            return list(pool.map(lambda c: self._read_chunk(*c), chunks))
+
+    def _write_chunk(self, name, data) -> str:
+        """
+        Store data as a new version of the companion secret name, returning its version
+        """
+        raise NotImplementedError(f"{type(self).__module__} can't chunk payloads")
+
+    def _read_chunk(self, name, version) -> bytes:
+        raise NotImplementedError(f"{type(self).__module__} can't chunk payloads")
+
+    def _apply_disk_state(self, state) -> None:
+        self._version = self._loaded_version = state["version"]
+        self._secrets = LazySecrets(state["encoded_secrets"])
+        self._chunks = state.get("chunks", [])
+        self._exists = True
+
+    def _load_from_disk(self) -> bool:
+        """
+        Try to initialise from the on-disk cache. Returns False if upstream has to be asked.
+        """
+        if self._disk_cache is None:
+            return False
+        key = self._cache_scope + (self.secret, self._version)
+        entry = self._disk_cache.get(key)
+        if self._metrics is not None:
+            self._metrics.observe_cache("disk", entry is not None)
+        if entry is None:
+            return False
+        state, age = entry
+        if cache.PayloadCache.pinned(self._version) or age < self._disk_cache.max_age:
+            self._apply_disk_state(state)
+            return True
+        if self._disk_cache.background_refresh:
+            self._apply_disk_state(state)
+            threading.Thread(target=self._refresh_from_disk_entry, daemon=True).start()
+            return True
+        try:
+            latest = self._latest_version()
+        except Exception as e:
+            logging.warning(f"Serving cached secret, upstream unavailable: {e}")
+            self._apply_disk_state(state)
+            return True
+        if latest != state["version"]:
+            return False
+        self._apply_disk_state(state)
+        self._disk_cache.touch(key)
+        return True
+
+    def _refresh_from_disk_entry(self) -> None:
+        try:
+            self._poll_secrets()
+            self._disk_cache.touch(self._cache_scope + (self.secret, None))
+        except Exception as e:
+            logging.warning(f"Failed to refresh cached secret: {e}")
+
+    def _load_stale(self) -> bool:
+        """
+        After a failed upstream load, fall back to the last known value on disk
+        """
+        if self._disk_cache is None:
+            return False
+        entry = self._disk_cache.get(self._cache_scope + (self.secret, self._version))
+        if entry is None:
+            return False
+        logging.warning(f"Serving cached secret {self.secret}, upstream load failed")
+        self._apply_disk_state(entry[0])
+        return True
+
+    def _store_on_disk(self, latest=False) -> None:
+        """
+        Record the state just loaded from (or written to) upstream, also as the
+        latest state if that's what it is
+        """
+        if self._disk_cache is None:
+            return
+        state = {
+            "version": self._version,
+            "encoded_secrets": self._encoded_secrets,
+            "chunks": self._chunks,
+        }
+        for version in (None, self._version) if latest else (self._version,):
+            self._disk_cache.put(self._cache_scope + (self.secret, version), state)
+
+    def _invalidate_cache(self) -> None:
+        if self._cache is not None:
+            self._cache.invalidate(*self._cache_scope, self.secret)
+
     def update(self) -> None:
         pass
 
     def _poll_secrets(self):
-        self._load_latest()
-        if self._polling_interval > 0:
-            self._timer = threading.Timer(self._polling_interval, self._poll_secrets)
-            self._timer.daemon = True
-            self._timer.start()
+        """
+        One polling tick: reload only if the newest upstream version has moved
+        """
+        latest = self._latest_version()
+        if latest is None or latest == self._version:
+            return
+        # a batch or a write in another thread holds the lock for as long as it
+        # runs; rather than wait, leave the new version to the next tick
+        if not self._state_lock.acquire(blocking=False):
+            logging.debug(f"Changes to {self.secret} in progress, not reloading")
+            return
+        try:
+            if self._batching or self._secrets.changed_keys():
+                # local changes not written yet; the next tick picks the version up
+                logging.debug(f"Changes to {self.secret} pending, not reloading")
+                return
+            old = self._secrets
+            self._version = latest
+            self._load_secrets()
+            self._store_on_disk(latest=True)
+        finally:
+            self._state_lock.release()
+        self._notify_change(old, self._secrets)
 
-    def set(self, key, val) -> None:
+    def on_change(self, callback):
         """
-        The key/val here aren't the key/val of secretmanager, they're a key/val within a given secret val.
+        Register callback(old, new, changed_keys), called after polling loads a new version.
+        Returns the callback so this can be used as a decorator.
         """
+        self._change_callbacks.append(callback)
+        return callback
+
+    def _notify_change(self, old, new) -> None:
+        old_encoded, new_encoded = old.encoded, new.encoded
+        changed_keys = {
+            k
+            for k in old_encoded.keys() | new_encoded.keys()
+            if old_encoded.get(k) != new_encoded.get(k)
+        }
+        if not changed_keys:
+            return
+        for callback in list(self._change_callbacks):
+            try:
+                callback(old, new, changed_keys)
+            except Exception as e:
+                logging.error(f"Secret change callback failed: {e}")
+
+    def _stage_set(self, key, val) -> None:
         if type(val) != str:
             logging.warning("Warning, value is not a string so serializing as json")
             val = json.dumps(val)
         if key in self._secrets:
             logging.warning("Warning, you are overwriting an existing key")
         self._secrets[key] = val
-        self._encoded_secrets[key] = base64.b64encode(bytes(val, "utf-8")).decode(
-            "ascii"
-        )
+
+    def _stage_unset(self, key) -> None:
+        self._secrets.pop(key, None)
+
+    def _commit(self) -> None:
+        """
+        Push local state upstream, or defer it to the end of the current batch.
+        """
+        if self._batching:
+            self._batch_pending = True
+        else:
+            self._flush()
+
+    def _flush(self) -> None:
+        """
+        Send staged changes upstream, unless they add up to no change at all
+        """
+        if not self._secrets.changed_keys():
+            logging.debug(f"No effective change to {self.secret}, skipping write")
+            self._secrets.mark_clean()
+            return
+        try:
+            if self._compare_and_swap:
+                self._update_with_retries()
+            else:
+                self.update()
+        except BaseException:
+            # left staged, the changes would keep polling from reloading
+            self._secrets.revert()
+            raise
+        self._secrets.mark_clean()
+
+    def _update_if_unchanged(self, base_version) -> None:
+        """
+        Write local state only if upstream is still at base_version, raising
+        WriteConflict otherwise. Backends without conditional writes just write.
+        """
         self.update()
 
+    def _reload_for_merge(self) -> None:
+        """
+        Load the upstream state a conflicting write should be merged onto
+        """
+        self._version = None
+        self._load_secrets()
+
+    def _update_with_retries(self) -> None:
+        """
+        Conditional write; on conflict reload the latest version, replay the local
+        key-level changes on top of it and try again, with jittered backoff.
+        """
+        for attempt in range(self._max_conflict_retries + 1):
+            try:
+                return self._update_if_unchanged(self._version)
+            except WriteConflict:
+                if attempt == self._max_conflict_retries:
+                    raise
+                logging.info(f"Write conflict on {self.secret}, merging and retrying")
+            time.sleep(random.uniform(0, min(2.0, 0.05 * 2**attempt)))
+            changes = self._secrets.changes()
+            self._invalidate_cache()
+            self._reload_for_merge()
+            self._secrets.apply(changes)
+
+    @contextmanager
+    def batch(self):
+        """
+        Stage any number of set/unset calls and send them upstream as a single write
+        when the block exits. If the block or the write raises, local state is restored.
+        Writes from other threads wait for the batch to finish rather than join it.
+
+        >>> with s.batch():
+        ...     s.set("A", "1")
+        ...     s.unset("B")
+        """
+        with self._state_lock:
+            if self._batching:
+                # nested batches join the outer one
+                yield self
+                return
+            secrets = self._secrets.copy()
+            self._batching = True
+            self._batch_pending = False
+            try:
+                yield self
+                self._batching = False
+                if self._batch_pending:
+                    self._flush()
+            except BaseException:
+                self._secrets = secrets
+                raise
+            finally:
+                self._batching = False
+                self._batch_pending = False
+
+    def set(self, key, val) -> None:
+        """
+        The key/val here aren't the key/val of secretmanager, they're a key/val within a given secret val.
+        """
+        with self._state_lock:
+            self._stage_set(key, val)
+            self._commit()
+
+    def set_many(self, items) -> None:
+        """
+        Set several keys with a single upstream write
+        """
+        with self.batch():
+            for key, val in dict(items).items():
+                self.set(key, val)
+
     def unset(self, key) -> None:
         """
         Unset (delete) a secret key
         """
-        if key in self._secrets:
-            del self._secrets[key]
-        if key in self._encoded_secrets:
-            del self._encoded_secrets[key]
-        self.update()
+        with self._state_lock:
+            self._stage_unset(key)
+            self._commit()
+
+    def unset_many(self, keys) -> None:
+        """
+        Unset (delete) several keys with a single upstream write
+        """
+        with self.batch():
+            for key in keys:
+                self.unset(key)
 
     def rollback(self, version="-1") -> None:
+        """
+        Load another version: relative to the current one if version is 0 or
+        negative, by position (oldest first) if it's positive, or by id otherwise.
+        Versions which can't be loaded are skipped. The version index is only
+        listed again when it doesn't know the version it has to count from.
+        """
         try:
             ver = int(version)
-            all_versions = self._list_versions()
-            cur_idx = all_versions.index(self._version)
+            index = self._versions
             if ver <= 0:
-                self._version = all_versions[cur_idx + ver]
+                if self._version not in index:
+                    index = self._refresh_versions()
+                self._version = index.step(self._version, ver, enabled_only=True)
             else:
-                self._version = all_versions[ver]
+                try:
+                    self._version = index.at(ver, enabled_only=True)
+                except IndexError:
+                    self._version = self._refresh_versions().at(ver, enabled_only=True)
         except:
             # what was provided wasn't a number, so just attempt to use it.
             self._version = version
@@ -118,3 +613,68 @@ class SecretsBase:
 
     def delete(self) -> None:
         pass
+
+
+class LoadResult(dict):
+    """
+    The secrets load_many managed to load, keyed by name. Secrets which failed
+    (or didn't finish before the deadline) are in .errors instead.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.errors = {}
+
+
+def load_many(provider, secrets, max_workers=8, timeout=None, **kwargs) -> LoadResult:
+    """
+    Load many secrets of one provider concurrently on a bounded thread pool.
+    Extra keyword arguments are passed to every Secrets constructor.
+
+    >>> result = load_many("aws", ["db", "api"], region="us-east-1", timeout=10)
+    >>> result["db"].get("PASSWORD")
+    >>> result.errors
+    {}
+    """
+    from concurrent.futures import ThreadPoolExecutor, TimeoutError, wait
+
+    deadline = None if timeout is None else time.monotonic() + timeout
+    module = importlib.import_module(f".{provider}", "cloudsecrets")
+    Secrets = getattr(module, "Secrets")
+    secrets = list(dict.fromkeys(secrets))
+    result = LoadResult()
+    pool = ThreadPoolExecutor(max_workers=max_workers)
+
+    def remaining():
+        return None if deadline is None else max(0, deadline - time.monotonic())
+
+    try:
+        prefetch = pool.submit(Secrets._prefetch, secrets, deadline=deadline, **kwargs)
+        handover = None
+        try:
+            kwargs, handover = prefetch.result(timeout=remaining())
+        except TimeoutError:
+            logging.warning(f"Prefetching {provider} secrets ran past the deadline")
+        futures = {}
+        if remaining() != 0:
+            futures = {pool.submit(Secrets, name, **kwargs): name for name in secrets}
+        done, not_done = wait(futures, timeout=remaining())
+        for future in done:
+            name = futures[future]
+            try:
+                result[name] = future.result()
+                if handover is not None and result[name]._cache is handover:
+                    result[name]._cache = None
+            except Exception as e:
+                logging.error(f"Failed to load secret {name}: {e}")
+                result.errors[name] = e
+        for future in not_done:
+            future.cancel()
+        for name in secrets:
+            if name not in result and name not in result.errors:
+                result.errors[name] = TimeoutError(
+                    f"Secret {name} did not load within {timeout}s"
+                )
+    finally:
+        pool.shutdown(wait=False)
+    return result
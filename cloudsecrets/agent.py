@@ -0,0 +1,393 @@
+"""
+A node-local secrets agent. One `cloud-secrets serve` process fetches and polls
+each secret once through the regular provider classes, and local processes read
+it over a Unix domain socket with agent.Secrets instead of talking to the
+provider themselves.
+
+Protocol: every message is a frame of a 4 byte big-endian length, then one byte
+(the op for a request, the status for a reply) and any number of fields, each a
+4 byte big-endian length followed by that many bytes.
+
+    OPEN     provider, secret, options (JSON)  ->  handle, version
+    VERSION  handle, identity                  ->  version
+    SNAPSHOT handle, identity                  ->  version, encoded secrets (JSON)
+    WRITE    handle, identity, changes (JSON)  ->  version
+
+Handles are small integers which stay valid for the lifetime of the agent, so
+clients open their secrets again whenever they reconnect. identity is the JSON
+[provider, secret, options] the handle was opened with, and the agent refuses a
+handle which doesn't match it rather than serve another secret.
+Clients may only pass the options in OPTIONS, and the agent serves at most
+max_secrets distinct secrets.
+"""
+
+import importlib
+import json
+import logging
+import os
+import socket
+import socketserver
+import stat
+import struct
+import threading
+
+from cloudsecrets import SecretsBase
+from cloudsecrets.lazy import LazySecrets, decode
+
+DEFAULT_SOCKET = "/run/cloudsecrets.sock"
+PROVIDERS = ["gcp", "aws"]
+# constructor options a client may choose, per provider
+OPTIONS = {
+    "gcp": {"project", "compression"},
+    "aws": {"region", "regions", "hedge_delay", "is_binary", "compression"},
+}
+
+OPEN, VERSION, SNAPSHOT, WRITE = 1, 2, 3, 4
+OK, ERROR = 0, 1
+
+_HEADER = struct.Struct(">IB")
+_LENGTH = struct.Struct(">I")
+
+
+class AgentError(Exception):
+    """
+    The agent couldn't carry out a request
+    """
+
+
+def _pack(code, *fields) -> bytes:
+    body = b"".join(_LENGTH.pack(len(f)) + f for f in fields)
+    return _HEADER.pack(len(body) + 1, code) + body
+
+
+def _recv_exact(sock, n) -> bytes:
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise ConnectionError("agent connection closed")
+        buf += chunk
+    return bytes(buf)
+
+
+def _recv(sock) -> tuple:
+    """
+    Read one frame and return (op or status, [fields])
+    """
+    size, code = _HEADER.unpack(_recv_exact(sock, _HEADER.size))
+    body = _recv_exact(sock, size - 1)
+    fields, i = [], 0
+    while i < len(body):
+        (n,) = _LENGTH.unpack_from(body, i)
+        fields.append(body[i + 4 : i + 4 + n])
+        i += 4 + n
+    return code, fields
+
+
+def _identity(provider, secret, options) -> bytes:
+    return json.dumps([provider, secret, options], sort_keys=True).encode()
+
+
+class _Entry:
+    def __init__(self, identity) -> None:
+        self.identity = identity
+        self.lock = threading.Lock()
+        self.secrets = None
+        # (version, encoded secrets as JSON), replaced as a whole so readers
+        # never see a version paired with another version's payload
+        self.state = (b"", b"{}")
+
+    def refresh(self, *args) -> None:
+        s = self.secrets
+        self.state = (
+            (s.version or "").encode(),
+            json.dumps(s._encoded_secrets).encode(),
+        )
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Serve secrets to local clients. Each distinct (provider, secret, options) is
+    loaded once, with polling_interval, and shared by every client asking for it.
+    defaults are passed to every provider constructor (e.g. project, region).
+    Refuses to start if another agent is already answering on path, or if
+    path is anything other than a socket.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self, path, polling_interval=60, defaults=None, mode=0o600, max_secrets=256
+    ) -> None:
+        if os.path.lexists(path):
+            if not stat.S_ISSOCK(os.lstat(path).st_mode):
+                raise AgentError(f"{path} exists and is not a socket")
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(path)
+            except OSError:
+                # nothing listening: left behind by an agent which died
+                os.unlink(path)
+            else:
+                raise AgentError(f"an agent is already listening on {path}")
+            finally:
+                probe.close()
+        self.polling_interval = polling_interval
+        self.max_secrets = max_secrets
+        self.defaults = dict(defaults or {})
+        self.lock = threading.Lock()
+        self.entries = []
+        self.index = {}
+        self.requests = 0
+        super().__init__(path, _Handler)
+        os.chmod(path, mode)
+
+    def server_close(self) -> None:
+        super().server_close()
+        for entry in self.entries:
+            if entry.secrets is not None:
+                entry.secrets.close()
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+    def _entry(self, handle, identity) -> _Entry:
+        try:
+            entry = self.entries[int(handle)]
+        except (IndexError, ValueError):
+            raise AgentError(f"unknown handle {handle!r}")
+        if entry.identity != identity:
+            raise AgentError(f"handle {handle!r} is not {identity.decode()}")
+        if entry.secrets is None:
+            raise AgentError(f"handle {handle!r} was never loaded")
+        return entry
+
+    def open(self, provider, secret, options) -> tuple:
+        if provider not in PROVIDERS:
+            raise AgentError(f"unsupported provider {provider!r}")
+        unknown = set(options) - OPTIONS[provider]
+        if unknown:
+            raise AgentError(f"unsupported {provider} options {sorted(unknown)}")
+        identity = _identity(provider, secret, options)
+        with self.lock:
+            handle = self.index.get(identity)
+            if handle is None:
+                if len(self.entries) >= self.max_secrets:
+                    raise AgentError(f"already serving {self.max_secrets} secrets")
+                handle = self.index[identity] = len(self.entries)
+                self.entries.append(_Entry(identity))
+        entry = self.entries[handle]
+        with entry.lock:
+            if entry.secrets is None:
+                module = importlib.import_module(f".{provider}", "cloudsecrets")
+                kwargs = dict(self.defaults, **options)
+                kwargs["polling_interval"] = self.polling_interval
+                s = module.Secrets(secret, **kwargs)
+                s.on_change(entry.refresh)
+                entry.secrets = s
+                entry.refresh()
+        return handle, entry.state[0]
+
+    def write(self, handle, identity, changes) -> bytes:
+        entry = self._entry(handle, identity)
+        with entry.lock:
+            s = entry.secrets
+            with s.batch():
+                for key, encoded in changes.items():
+                    if encoded is None:
+                        s.unset(key)
+                    else:
+                        s.set(key, decode(encoded))
+            entry.refresh()
+        return entry.state[0]
+
+    def handle_request_frame(self, op, fields) -> list:
+        self.requests += 1
+        if op == VERSION:
+            return [self._entry(fields[0].decode(), fields[1]).state[0]]
+        if op == SNAPSHOT:
+            return list(self._entry(fields[0].decode(), fields[1]).state)
+        if op == OPEN:
+            provider, secret, options = (f.decode() for f in fields)
+            handle, version = self.open(provider, secret, json.loads(options))
+            return [str(handle).encode(), version]
+        if op == WRITE:
+            return [self.write(fields[0].decode(), fields[1], json.loads(fields[2]))]
+        raise AgentError(f"unknown op {op}")
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self) -> None:
+        while True:
+            try:
+                op, fields = _recv(self.request)
+            except ConnectionError:
+                return
+            try:
+                reply = _pack(OK, *self.server.handle_request_frame(op, fields))
+            except Exception as e:
+                logging.error(f"agent request {op} failed: {e}")
+                reply = _pack(ERROR, str(e).encode())
+            self.request.sendall(reply)
+
+
+class _StaleHandle(ConnectionError):
+    """
+    The connection a handle was opened on has since been replaced
+    """
+
+
+class _Connection:
+    """
+    One persistent socket to the agent, shared by the threads of a process.
+    generation counts the sockets opened, so handles opened on an earlier one
+    can be told apart.
+    """
+
+    def __init__(self, path) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        self.sock = None
+        self.generation = 0
+
+    def request(self, op, *fields, generation=None) -> list:
+        return self.exchange(op, *fields, generation=generation)[1]
+
+    def exchange(self, op, *fields, generation=None) -> tuple:
+        """
+        Send one request and return (generation of the socket used, reply). With
+        generation, raise _StaleHandle instead of using a newer socket.
+        """
+        with self.lock:
+            if self.sock is None:
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                try:
+                    sock.connect(self.path)
+                except OSError:
+                    sock.close()
+                    raise
+                self.sock = sock
+                self.generation += 1
+            if generation is not None and generation != self.generation:
+                raise _StaleHandle(f"reconnected to the agent at {self.path}")
+            current = self.generation
+            try:
+                self.sock.sendall(_pack(op, *fields))
+                status, reply = _recv(self.sock)
+            except OSError:
+                self.close()
+                raise
+        if status != OK:
+            raise AgentError(reply[0].decode() if reply else "agent error")
+        return current, reply
+
+    def close(self) -> None:
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def _after_fork(self) -> None:
+        # closing the child's copy leaves the parent's connection alone
+        self.lock = threading.Lock()
+        self.close()
+
+
+_connections = {}
+_connections_lock = threading.Lock()
+
+
+def _after_fork() -> None:
+    """
+    A forked child must not share its parent's sockets, nor wait on locks held
+    by threads which don't exist in it. Connections are reset rather than
+    forgotten, as Secrets created before the fork still hold them.
+    """
+    global _connections_lock
+    _connections_lock = threading.Lock()
+    for connection in _connections.values():
+        connection._after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def _connection(path) -> _Connection:
+    with _connections_lock:
+        if path not in _connections:
+            _connections[path] = _Connection(path)
+        return _connections[path]
+
+
+class Secrets(SecretsBase):
+    """
+    Secrets served by a local `cloud-secrets serve` agent instead of the provider.
+
+    >>> s = Secrets("my-secrets", provider="gcp", options={"project": "my-project"})
+    >>> s.get("MYSECRET")
+    'VALUE'
+
+    The whole secret is fetched from the agent when loaded, so reads are local.
+    Polling only asks the agent for its version, and writes are sent to the
+    agent, which applies them upstream as a single write. Only the latest
+    version is served.
+    """
+
+    def __init__(
+        self, secret, provider="aws", options=None, socket_path=None, **kwargs
+    ):
+        super().__init__(secret, **kwargs)
+        assert not self._version, "The agent only serves the latest version"
+        self.provider = provider
+        self.options = dict(options or {})
+        self.socket_path = socket_path or os.environ.get(
+            "CLOUDSECRETS_SOCKET", DEFAULT_SOCKET
+        )
+        self._connection = _connection(self.socket_path)
+        self._identity = _identity(self.provider, self.secret, self.options)
+        # the handle and the generation of the connection it was opened on
+        self._handle = None
+        self._generation = None
+        self._init_secrets()
+
+    def _request(self, op, *fields) -> list:
+        """
+        Send a request about this secret, opening it first (again, if the
+        connection to the agent was replaced since, by this or another instance)
+        """
+        for attempt in (1, 2):
+            try:
+                if self._handle is None:
+                    generation, (handle, _) = self._connection.exchange(
+                        OPEN,
+                        self.provider.encode(),
+                        self.secret.encode(),
+                        json.dumps(self.options).encode(),
+                    )
+                    self._handle, self._generation = handle, generation
+                return self._connection.request(
+                    op,
+                    self._handle,
+                    self._identity,
+                    *fields,
+                    generation=self._generation,
+                )
+            except OSError:
+                self._handle = None
+                if attempt == 2:
+                    raise
+
+    def _latest_version(self) -> str:
+        return self._request(VERSION)[0].decode()
+
+    def _load_secrets(self) -> None:
+        version, payload = self._request(SNAPSHOT)
+        self._version = self._loaded_version = version.decode()
+        self._secrets = LazySecrets(json.loads(payload))
+
+    def update(self) -> None:
+        changes = json.dumps(self._secrets.changes()).encode()
+        version = self._request(WRITE, changes)[0].decode()
+        self._version = self._loaded_version = version
+
+    def delete(self) -> None:
+        raise AgentError("delete the secret through its provider")
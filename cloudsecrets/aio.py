@@ -0,0 +1,143 @@
+import asyncio
+import functools
+import importlib
+import logging
+import random
+
+
+class Secrets:
+    """
+    asyncio front end for the cloudsecrets backends
+
+    Reads are served from the loaded secret map and never block. Anything that
+    talks to the provider (opening, set/unset, refresh, rollback, delete) runs on
+    an executor so the event loop is never blocked, and polling is an asyncio task
+    rather than a scheduler thread.
+
+    >>> s = await Secrets.open("aws", "my-secrets", region="us-east-1")
+    >>> s.get("MYSECRET")
+    'VALUE'
+    >>> await s.set("MYSECRET", "NEW VALUE")
+    >>> await s.close()
+    """
+
+    def __init__(self, secrets, executor=None) -> None:
+        self._backend = secrets
+        self._executor = executor
+        self._lock = asyncio.Lock()
+        self._poll_task = None
+
+    @classmethod
+    async def open(cls, provider, secret, polling_interval=0, executor=None, **kwargs):
+        """
+        Construct a provider backend ("aws", "gcp", "file", "env") off the event loop
+        """
+        module = importlib.import_module(f".{provider}", "cloudsecrets")
+        loop = asyncio.get_running_loop()
+        backend = await loop.run_in_executor(
+            executor, functools.partial(module.Secrets, secret, **kwargs)
+        )
+        self = cls(backend, executor=executor)
+        if polling_interval > 0:
+            self._poll_task = asyncio.ensure_future(self._poll(polling_interval))
+        return self
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        async with self._lock:
+            return await loop.run_in_executor(
+                self._executor, functools.partial(fn, *args)
+            )
+
+    async def _poll(self, interval) -> None:
+        while True:
+            await asyncio.sleep(interval * random.uniform(0.9, 1.1))
+            try:
+                await self.refresh()
+            except Exception as e:
+                logging.error(f"Failed to poll secret: {e}")
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        """
+        Stop polling this secret
+        """
+        if self._poll_task is not None:
+            self._poll_task.cancel()
+            try:
+                await self._poll_task
+            except asyncio.CancelledError:
+                pass
+            self._poll_task = None
+        self._backend.close()
+
+    @property
+    def backend(self):
+        return self._backend
+
+    @property
+    def secrets(self) -> dict:
+        return self._backend.secrets
+
+    @property
+    def version(self) -> str:
+        return self._backend.version
+
+    def __iter__(self) -> iter:
+        return iter(self._backend)
+
+    def __getitem__(self, key) -> str:
+        return self._backend[key]
+
+    def __contains__(self, key) -> bool:
+        return key in self._backend
+
+    def __len__(self) -> int:
+        return len(self._backend)
+
+    def get(self, key, default=None):
+        return self._backend.get(key, default)
+
+    def keys(self):
+        return self._backend.keys()
+
+    def values(self):
+        return self._backend.values()
+
+    def items(self):
+        return self._backend.items()
+
+    def on_change(self, callback):
+        return self._backend.on_change(callback)
+
+    async def set(self, key, val) -> None:
+        await self._run(self._backend.set, key, val)
+
+    async def set_many(self, items) -> None:
+        await self._run(self._backend.set_many, items)
+
+    async def unset(self, key) -> None:
+        await self._run(self._backend.unset, key)
+
+    async def unset_many(self, keys) -> None:
+        await self._run(self._backend.unset_many, keys)
+
+    async def update(self) -> None:
+        await self._run(self._backend.update)
+
+    async def refresh(self) -> None:
+        """
+        Reload the secret if a newer upstream version exists
+        """
+        await self._run(self._backend._poll_secrets)
+
+    async def rollback(self, version="-1") -> None:
+        await self._run(self._backend.rollback, version)
+
+    async def delete(self) -> None:
+        await self._run(self._backend.delete)
@@ -1,11 +1,86 @@
 import base64
+import collections
+import json
 import logging
+import os
+import sys
+import threading
+import time
+import uuid
 
-import boto3
-import simplejson as json
-from six import b
+from cloudsecrets import SecretsBase, WriteConflict, cache, clients, retry
+from cloudsecrets.lazy import LazySecrets
 
-from cloudsecrets import SecretsBase
+# stage label carried by a conditional write until it is promoted to AWSCURRENT
+PENDING_STAGE = "CLOUDSECRETS_PENDING"
+# hedge delay used until a region has enough latency samples for a p95
+DEFAULT_HEDGE_DELAY = 0.1
+
+
+class _Latency:
+    """
+    Recent read latencies of one region, for the adaptive hedge delay
+    """
+
+    def __init__(self, size=100, min_samples=20) -> None:
+        self.samples = collections.deque(maxlen=size)
+        self.min_samples = min_samples
+        self.lock = threading.Lock()
+
+    def add(self, seconds) -> None:
+        with self.lock:
+            self.samples.append(seconds)
+
+    def p95(self, default=DEFAULT_HEDGE_DELAY) -> float:
+        with self.lock:
+            samples = sorted(self.samples)
+        if len(samples) < self.min_samples:
+            return default
+        return samples[int(0.95 * (len(samples) - 1))]
+
+
+_latencies = collections.defaultdict(_Latency)
+_hedge_pool = None
+_hedge_pool_lock = threading.Lock()
+
+
+def _pool():
+    global _hedge_pool
+    with _hedge_pool_lock:
+        if _hedge_pool is None:
+            from concurrent.futures import ThreadPoolExecutor
+
+            _hedge_pool = ThreadPoolExecutor(
+                max_workers=32, thread_name_prefix="cloudsecrets-hedge"
+            )
+        return _hedge_pool
+
+
+def _reset_pool() -> None:
+    # the pool's threads don't exist in a forked child
+    global _hedge_pool, _hedge_pool_lock
+    _hedge_pool = None
+    _hedge_pool_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_pool)
+
+
+def _new_client(region=None):
+    """
+    Create a secretsmanager client. boto3 is only needed for its default session,
+    so unless the application already uses boto3 the lighter botocore is used.
+    """
+    if "boto3" in sys.modules:
+        import boto3
+
+        return boto3.client("secretsmanager", region_name=region)
+    import botocore.session
+
+    return botocore.session.get_session().create_client(
+        "secretsmanager", region_name=region
+    )
 
 
 class Secrets(SecretsBase):
@@ -19,6 +94,12 @@ class Secrets(SecretsBase):
 
     By default, "latest" version is used.
 
+    A secret replicated to other regions can be read from them too. Reads go to the
+    primary region (the first one) and, if it hasn't answered within hedge_delay
+    seconds (by default the p95 of its recent reads), to the replicas as well; the
+    first answer wins. Writes and version checks only go to the primary.
+    >>> s = Secrets("my-secrets", regions=["us-east-1", "us-west-2"])
+
     Value (json string):
     {
       "MYSECRET": "VkFMVUU=",
@@ -42,95 +123,324 @@ class Secrets(SecretsBase):
         logging.debug(f"AWS __init__ ({secret, region})")
         super().__init__(secret, **kwargs)
         self.is_binary = kwargs.get("is_binary", False)
+        regions = list(kwargs.get("regions", None) or [])
+        if region is None and regions:
+            region = regions[0]
+        self._regions = regions
+        self._region = region
+        # the pid the registry clients were looked up in, None for an injected client
+        self._clients_pid = None
         if connection is None:
-            self.connection = boto3.client("secretsmanager", region_name=region)
-        else:
-            self.connection = connection
+            self._clients_pid = os.getpid()
+            connection = Secrets._client(region)
+        self._connection = connection
+        primary = connection.meta.region_name
+        self._replicas = [Secrets._client(r) for r in regions if r != primary]
+        self._hedge_delay = kwargs.get("hedge_delay", None)
         self._init_secrets()
 
-    def __del__(self):
-        self._secrets = {}
-        self._encoded_secrets = {}
-        self._timer = None
-        self.secret = None
+    @property
+    def connection(self):
+        """
+        The primary region's client. Clients from the registry are looked up again
+        in a forked child, as the parent's can't be used there.
+        """
+        if self._clients_pid not in (None, os.getpid()):
+            self._clients_pid = os.getpid()
+            self._connection = Secrets._client(self._region)
+            primary = self._connection.meta.region_name
+            self._replicas = [Secrets._client(r) for r in self._regions if r != primary]
+        return self._connection
+
+    @staticmethod
+    def _client(region=None):
+        """
+        The shared secretsmanager client for this region and set of credentials
+        """
+        return clients.registry.get(
+            clients.aws_key(region), lambda: _new_client(region)
+        )
+
+    @classmethod
+    def _prefetch(
+        cls, secrets, connection=None, region=None, deadline=None, **kwargs
+    ) -> tuple:
+        """
+        Fetch the latest version of many secrets with batch_get_secret_value and seed
+        the payload cache with them, so constructing each Secrets costs no further call.
+        Falls back to one fetch per secret wherever the batch call isn't available,
+        or once deadline has passed.
+        """
+        if region is None and kwargs.get("regions"):
+            region = kwargs["regions"][0]
+        if connection is None:
+            connection = Secrets._client(region)
+        kwargs.update(connection=connection, region=region)
+        if kwargs.get("version"):
+            return kwargs, None
+        handover = None
+        if not kwargs.get("cache"):
+            # only used to hand the batch results over to the constructors
+            handover = kwargs["cache"] = cache.PayloadCache()
+        elif kwargs["cache"] is True:
+            kwargs["cache"] = cache.get_cache()
+        scope = ("aws", connection.meta.region_name)
+        for i in range(0, len(secrets), 20):
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            try:
+                resp = retry.requests.call(
+                    scope,
+                    connection.batch_get_secret_value,
+                    SecretIdList=secrets[i : i + 20],
+                )
+            except Exception as e:
+                logging.debug(f"AWS batch_get_secret_value unavailable: {e}")
+                break
+            for x in resp.get("SecretValues", []):
+                for key in (x["Name"], x["ARN"]):
+                    kwargs["cache"].put(
+                        scope + (key, None), x, Secrets._payload_size(x)
+                    )
+        return kwargs, handover
 
     def update(self) -> None:
         """
         Upsert a secret to AWS SecretsManager.
         """
         logging.debug(f"AWS update ({self.secret})")
-        secret_json_blob = b(json.dumps(self._encoded_secrets))
-        if self._secret_exists:
+        payload = self._payload()
+        # one token per logical write: retries of a write which did land are no-ops
+        payload["ClientRequestToken"] = str(uuid.uuid4())
+        secret = None
+        if self._exists is not False:
             logging.debug(f"AWS update({self.secret}), updating an existing value")
-            if self.is_binary:
-                secret = self.connection.put_secret_value(
-                    SecretId=self.secret, SecretBinary=secret_json_blob
-                )
-            else:
-                secret = self.connection.put_secret_value(
-                    SecretId=self.secret, SecretString=secret_json_blob
+            try:
+                secret = self._call(
+                    self.connection.put_secret_value, SecretId=self.secret, **payload
                 )
-        else:
+            except self.connection.exceptions.ResourceNotFoundException:
+                self._exists = False
+        if secret is None:
             logging.debug(f"AWS update ({self.secret}), creating a new secret")
-            if self.is_binary:
-                secret = self.connection.create_secret(
-                    Name=self.secret, SecretBinary=secret_json_blob
-                )
-            else:
-                secret = self.connection.create_secret(
-                    Name=self.secret, SecretString=secret_json_blob
+            secret = self._call(
+                self.connection.create_secret, Name=self.secret, **payload
+            )
+        self._exists = True
+        self._version = self._loaded_version = secret["VersionId"]
+        self._invalidate_cache()
+        self._store_on_disk(latest=True)
+
+    def _payload(self) -> dict:
+        """
+        The local state as the payload argument of put_secret_value/create_secret.
+        The packed storage format is binary, so it always goes in SecretBinary.
+        """
+        blob = self._serialize()
+        if self.is_binary or self._compression is not None:
+            return {"SecretBinary": blob}
+        return {"SecretString": blob}
+
+    def _write_chunk(self, name, data) -> str:
+        payload = {"SecretBinary": data, "ClientRequestToken": str(uuid.uuid4())}
+        try:
+            x = self._call(self.connection.put_secret_value, SecretId=name, **payload)
+        except self.connection.exceptions.ResourceNotFoundException:
+            x = self._call(self.connection.create_secret, Name=name, **payload)
+        return x["VersionId"]
+
+    def _chunk_secrets(self) -> list:
+        """
+        Every companion secret ever written for this secret's chunks, including
+        those only older versions refer to
+        """
+        prefix = f"{self.secret}--chunk-"
+        names = []
+        kwargs = {}
+        while True:
+            resp = self._call(
+                self.connection.list_secrets,
+                Filters=[{"Key": "name", "Values": [prefix]}],
+                **kwargs,
+            )
+            names += [
+                x["Name"]
+                for x in resp.get("SecretList", [])
+                if x["Name"].startswith(prefix) and x["Name"][len(prefix) :].isdigit()
+            ]
+            if not resp.get("NextToken"):
+                return names
+            kwargs["NextToken"] = resp["NextToken"]
+
+    def _read_chunk(self, name, version) -> bytes:
+        x = self._hedged("get_secret_value", SecretId=name, VersionId=version)
+        return x["SecretBinary"]
+
+    def _update_if_unchanged(self, base_version) -> None:
+        """
+        Compare-and-swap write. The new version is put without the AWSCURRENT stage,
+        then AWSCURRENT is moved onto it from base_version; AWS rejects that move if
+        another writer has made a different version current in the meantime.
+        """
+        logging.debug(f"AWS _update_if_unchanged ({self.secret}, {base_version})")
+        if not base_version or self._exists is False:
+            return self.update()
+        token = str(uuid.uuid4())
+        payload = self._payload()
+        try:
+            self._call(
+                self.connection.put_secret_value,
+                SecretId=self.secret,
+                ClientRequestToken=token,
+                VersionStages=[PENDING_STAGE],
+                **payload,
+            )
+        except self.connection.exceptions.ResourceNotFoundException:
+            self._exists = False
+            return self.update()
+        # not idempotent: repeated after it landed, the move fails as base_version
+        # is no longer current, so a failure is checked against where it went
+        try:
+            self._call_write(
+                self.connection.update_secret_version_stage,
+                SecretId=self.secret,
+                VersionStage="AWSCURRENT",
+                MoveToVersionId=token,
+                RemoveFromVersionId=base_version,
+            )
+        except self.connection.exceptions.InvalidParameterException as e:
+            if not self._is_current(token):
+                raise WriteConflict(
+                    f"{self.secret} moved past version {base_version}: {e}"
                 )
-        self._version = secret["VersionId"]
+        except Exception as e:
+            if not retry.may_have_landed(e) or not self._is_current(token):
+                raise
+        self._version = self._loaded_version = token
+        self._invalidate_cache()
+        self._store_on_disk(latest=True)
+
+    def _is_current(self, version) -> bool:
+        resp = self._call(self.connection.describe_secret, SecretId=self.secret)
+        return "AWSCURRENT" in resp.get("VersionIdsToStages", {}).get(version, [])
 
     def delete(self) -> None:
         """
         Delete a secret from AWS SecretsManager.
         """
         logging.debug(f"AWS delete")
-        self.connection.delete_secret(SecretId=self.secret)
+        self._call(self.connection.delete_secret, SecretId=self.secret)
+        for name in self._chunk_secrets():
+            self._call(self.connection.delete_secret, SecretId=name)
+        self._chunks = []
+        self._exists = False
+        self._versions.clear()
+        self._invalidate_cache()
 
     @property
-    def _secret_exists(self) -> bool:
+    def _cache_scope(self) -> tuple:
+        return ("aws", self.connection.meta.region_name)
+
+    @staticmethod
+    def _payload_size(response) -> int:
+        return len(response.get("SecretString") or response.get("SecretBinary") or "")
+
+    def _fetch(self) -> dict:
+        if self._version:
+            return self._hedged(
+                "get_secret_value", SecretId=self.secret, VersionId=self._version
+            )
+        return self._hedged(
+            "get_secret_value", SecretId=self.secret, VersionStage="AWSCURRENT"
+        )
+
+    def _hedged(self, operation, **kwargs):
         """
-        Test if a secret resource exists
+        Call operation on the primary region and, once the hedge delay passes or
+        the primary fails, on the replicas as well. The first successful answer
+        wins and requests which haven't started are cancelled; ones already in
+        flight finish in the background and are ignored. A missing secret is
+        only believed from the primary, as a replica may simply lag behind.
         """
-        logging.debug(f"AWS _secret_exists")
+        connection = self.connection
+        if not self._replicas:
+            return self._call(getattr(connection, operation), **kwargs)
+        from concurrent.futures import FIRST_COMPLETED, wait
+
+        latency = _latencies[self.connection.meta.region_name]
+
+        def primary():
+            start = time.monotonic()
+            x = self._call(getattr(self.connection, operation), **kwargs)
+            latency.add(time.monotonic() - start)
+            return x
+
+        def replica(client):
+            scope = ("aws", client.meta.region_name)
+            return self._call_in(scope, getattr(client, operation), **kwargs)
+
+        delay = self._hedge_delay
+        if delay is None:
+            delay = latency.p95()
+        pending = {_pool().submit(primary): True}
+        hedged = False
+        error = None
         try:
-            self.connection.get_secret_value(SecretId=self.secret)
-            return True
-        except:
-            return False
+            while pending:
+                done, _ = wait(
+                    pending,
+                    timeout=None if hedged else delay,
+                    return_when=FIRST_COMPLETED,
+                )
+                for future in done:
+                    is_primary = pending.pop(future)
+                    try:
+                        return future.result()
+                    except Exception as e:
+                        if not is_primary:
+                            continue
+                        if retry.classify(e) == retry.NOT_FOUND:
+                            raise
+                        error = e
+                if not hedged:
+                    hedged = True
+                    logging.debug(f"AWS hedging {operation} ({self.secret})")
+                    for client in self._replicas:
+                        pending[_pool().submit(replica, client)] = False
+            raise error
+        finally:
+            for future in pending:
+                future.cancel()
 
     def _load_secrets(self) -> None:
         """
         Load upstream secret resource, replacing local secrets
         """
         logging.debug(f"AWS _load_secrets")
-        secrets = {}
-        if self.create_if_not_present and not self._secret_exists:
-            self._create_secret_resource()
+        latest = not cache.PayloadCache.pinned(self._version)
         try:
+            x = self._cached_fetch(
+                self._fetch, lambda x: x["VersionId"], Secrets._payload_size
+            )
+            self._exists = True
+        except self.connection.exceptions.ResourceNotFoundException:
+            self._secrets = LazySecrets()
             if self._version:
-                x = self.connection.get_secret_value(
-                    SecretId=self.secret, VersionId=self._version,
-                )
-            else:
-                x = self.connection.get_secret_value(SecretId=self.secret)
-        except:
-            self._encoded_secrets = {}
-            self._secrets = {}
+                # a missing pinned version says nothing about the resource itself
+                return
+            self._exists = False
+            if self.create_if_not_present:
+                self._create_secret_resource()
+            return
+        except Exception as e:
+            self._load_failed(e)
             return
-        kind = Secrets.unpack_response(x)
-        self._version = x["VersionId"]
-        if self.is_binary:
-            payload = x["SecretBinary"]
-            self._encoded_secrets = json.loads(payload)
-            for k, v in self._encoded_secrets.items():
-                secrets[k] = base64.b64decode(v).decode("ascii")
-            self._secrets = secrets
+        self._version = self._loaded_version = x["VersionId"]
+        if "SecretBinary" in x:
+            self._secrets = self._deserialize(x["SecretBinary"])
         else:
-            payload = x["SecretString"]
-            self._secrets = json.loads(payload)
+            self._secrets = LazySecrets.from_decoded(json.loads(x["SecretString"]))
+        self._store_on_disk(latest)
 
     def _create_secret_resource(self) -> None:
         """
@@ -139,39 +449,86 @@ class Secrets(SecretsBase):
         logging.debug(f"AWS _create_secret_resource")
         try:
             if self.is_binary:
-                self.connection.create_secret(
-                    Name=self.secret, SecretBinary="{}".encode("UTF-8")
+                x = self._call(
+                    self.connection.create_secret,
+                    Name=self.secret,
+                    SecretBinary="{}".encode("UTF-8"),
                 )
             else:
-                self.connection.create_secret(
-                    Name=self.secret, SecretString=str(dict())
+                x = self._call(
+                    self.connection.create_secret,
+                    Name=self.secret,
+                    SecretString=str(dict()),
                 )
         except Exception as e:
             logging.error(f"Failed to create secret resource: {e}")
             raise
+        self._exists = True
+        self._version = self._loaded_version = x.get("VersionId", self._version)
 
-    def _list_versions(self) -> list:
+    def _latest_version(self) -> str:
+        """
+        Return the AWSCURRENT version id from the secret's metadata, without fetching the payload
+        """
+        logging.debug(f"AWS _latest_version")
+        resp = self._call(self.connection.describe_secret, SecretId=self.secret)
+        for version, stages in resp.get("VersionIdsToStages", {}).items():
+            if "AWSCURRENT" in stages:
+                return version
+        return None
+
+    def _list_versions(self, enabled_only=False) -> list:
         logging.debug(f"AWS _list_versions")
+        return self._indexed_versions(enabled_only)
+
+    def _scan_versions(self, after=None) -> list:
+        """
+        Page through every version (AWS can't list from a given version onwards) and
+        return those created after version after, oldest to newest
+        """
+        logging.debug(f"AWS _scan_versions ({self.secret}, {after})")
+        versions = []
+        kwargs = {}
         try:
-            resp = self.connection.list_secret_version_ids(
-                SecretId=self.secret, IncludeDeprecated=True, MaxResults=100
-            )
-            x = [(x["VersionId"], x["CreatedDate"]) for x in resp["Versions"]]
-            x.sort(key=lambda _x: _x[1])  # sorted oldest to newest
-            return [k for k, v in x]
+            while True:
+                resp = self._call(
+                    self.connection.list_secret_version_ids,
+                    SecretId=self.secret,
+                    IncludeDeprecated=True,
+                    MaxResults=100,
+                    **kwargs,
+                )
+                versions += [
+                    (x["CreatedDate"], x["VersionId"]) for x in resp["Versions"]
+                ]
+                if not resp.get("NextToken"):
+                    break
+                kwargs["NextToken"] = resp["NextToken"]
         except Exception as e:
             logging.error(f"Failed to list versions: {e}")
             raise
+        versions.sort(key=lambda x: x[0])  # oldest to newest
+        ids = [v for _, v in versions]
+        if after in ids:
+            ids = ids[ids.index(after) + 1 :]
+        return [(v, True) for v in ids]
 
     @staticmethod
     def unpack_response(response):
+        """
+        Decode a get_secret_value response. Parses with simplejson, which callers
+        rely on for the type of decoding errors; it's only imported here so
+        loading a secret doesn't pay for it.
+        """
+        import simplejson
+
         if "SecretString" in response:
             secret = response["SecretString"]
-            secrets = json.loads(secret)
+            secrets = simplejson.loads(secret)
             return secrets
         else:
             payload = response["SecretBinary"]
-            binary_payload = json.loads(payload)
+            binary_payload = simplejson.loads(payload)
             secrets = {}
             for k, v in binary_payload.items():
                 secrets[k] = base64.b64decode(v).decode("UTF-8")
@@ -0,0 +1,152 @@
+import threading
+import time
+from collections import OrderedDict
+
+from cloudsecrets import metrics as _metrics
+
+
+class _Flight:
+    def __init__(self) -> None:
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class PayloadCache:
+    """
+    Process-local cache of upstream secret payloads.
+
+    Entries are keyed by (provider, scope, secret, version). A version of None or
+    "latest" follows upstream and expires after ttl seconds; any other version is
+    immutable upstream and never expires, though it can still be evicted. The
+    least recently used entries are evicted once max_entries or max_bytes is
+    exceeded.
+
+    Concurrent loads of the same key are single-flighted: one caller goes
+    upstream and the others wait for its result.
+    """
+
+    def __init__(
+        self, ttl=60, max_entries=1024, max_bytes=64 * 1024 * 1024, metrics=None
+    ) -> None:
+        self.ttl = ttl
+        self.metrics = metrics
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def pinned(version) -> bool:
+        return version not in (None, "latest")
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def size(self) -> int:
+        return self._bytes
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, size, expires = entry
+        if expires is not None and expires <= time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _remove(self, key) -> None:
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def put(self, key, value, size=0) -> None:
+        expires = None if self.pinned(key[-1]) else time.monotonic() + self.ttl
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (value, size, expires)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def get_or_load(self, key, loader, size=len):
+        """
+        Return the cached value for key, calling loader() on a miss.
+        size(value) is used to account the entry against max_bytes.
+        """
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is not None:
+                self.hits += 1
+            else:
+                flight = self._inflight.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._inflight[key] = _Flight()
+                    self.misses += 1
+                else:
+                    self.hits += 1
+        hook = self.metrics or _metrics.get_default()
+        if hook is not None:
+            hook.observe_cache("payload", entry is not None or not leader)
+        if entry is not None:
+            return entry[0]
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+        try:
+            flight.value = loader()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            flight.event.set()
+        self.put(key, flight.value, size(flight.value))
+        return flight.value
+
+    def invalidate(self, provider, scope, secret) -> None:
+        """
+        Drop the entries of a secret which follow upstream (after a write, for instance)
+        """
+        with self._lock:
+            for key in [
+                k
+                for k in self._entries
+                if k[:3] == (provider, scope, secret) and not self.pinned(k[3])
+            ]:
+                self._remove(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> PayloadCache:
+    """
+    Return the process-wide cache, creating it on first use
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = PayloadCache()
+        return _cache
@@ -15,7 +15,17 @@ A secret is a json dictionary of ascii:base64 key:value pairs.
 PROVIDERS = ["gcp", "aws"]
 
 
-def main():
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] in (["import"], ["export"]):
+        from cloudsecrets.cli import bulk
+
+        return bulk.main(argv)
+    if argv[:1] == ["serve"]:
+        from cloudsecrets.cli import serve
+
+        return serve.main(argv)
+
     parser = argparse.ArgumentParser(description="Mozilla-IT Secrets")
     parser.add_argument(
         "-E",
@@ -71,7 +81,7 @@ def main():
         help="if using the GCP secret manager you must specify the project you want to use",
         default=None,
     )
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     params = {}
 
@@ -113,7 +123,7 @@ def main():
 
     if args.decrypt:
         if args.key:
-            x = dict(s)[args.key]
+            x = s[args.key]
         else:
             x = dict(s)
         if type(x) != str:
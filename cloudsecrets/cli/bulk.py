@@ -0,0 +1,266 @@
+"""
+cloud-secrets import / export: move a whole secret to or from a JSON, dotenv or
+YAML file in one go, or many secrets at once with a manifest.
+"""
+
+import argparse
+import concurrent.futures
+import importlib
+import json
+import logging
+import os
+import re
+import sys
+
+PROVIDERS = ["gcp", "aws"]
+FORMATS = ["json", "dotenv", "yaml"]
+EXTENSIONS = {".json": "json", ".env": "dotenv", ".yaml": "yaml", ".yml": "yaml"}
+
+_PLAIN = re.compile(r"^[A-Za-z0-9_./:@%+,-]*$")
+_ESCAPES = {"n": "\n", "r": "\r", "t": "\t", '"': '"', "\\": "\\", "$": "$"}
+
+
+def guess_format(path, default="json") -> str:
+    if not path or path == "-":
+        return default
+    return EXTENSIONS.get(os.path.splitext(path)[1].lower(), default)
+
+
+def parse_dotenv(text) -> dict:
+    """
+    Parse KEY=VALUE lines. Values may be single quoted (literal) or double
+    quoted (with backslash escapes); blank lines, comments and a leading
+    "export " are ignored.
+    """
+    ret = {}
+    for n, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if line.startswith("export "):
+            line = line[len("export ") :].lstrip()
+        key, sep, val = line.partition("=")
+        if not sep:
+            raise ValueError(f"line {n}: expected KEY=VALUE")
+        val = val.strip()
+        if len(val) >= 2 and val[0] == val[-1] == "'":
+            val = val[1:-1]
+        elif len(val) >= 2 and val[0] == val[-1] == '"':
+            val = re.sub(
+                r"\\(.)", lambda m: _ESCAPES.get(m.group(1), m.group(0)), val[1:-1]
+            )
+        ret[key.strip()] = val
+    return ret
+
+
+def dump_dotenv(secrets) -> str:
+    lines = []
+    for k, v in secrets.items():
+        if not _PLAIN.match(v):
+            v = (
+                v.replace("\\", "\\\\")
+                .replace('"', '\\"')
+                .replace("$", "\\$")
+                .replace("\n", "\\n")
+                .replace("\r", "\\r")
+                .replace("\t", "\\t")
+            )
+            v = f'"{v}"'
+        lines.append(f"{k}={v}")
+    return "".join(f"{line}\n" for line in lines)
+
+
+def _yaml():
+    try:
+        import yaml
+    except ImportError:
+        raise Exception("YAML support needs PyYAML: pip install cloudsecrets[yaml]")
+    return yaml
+
+
+def loads(text, fmt) -> dict:
+    """
+    Parse a whole secret. Values which aren't strings are stored as JSON,
+    which is how decrypt prints them back.
+    """
+    if fmt == "dotenv":
+        data = parse_dotenv(text)
+    elif fmt == "yaml":
+        data = _yaml().safe_load(text) or {}
+    else:
+        data = json.loads(text or "{}")
+    if not isinstance(data, dict):
+        raise ValueError(f"expected a mapping of keys to values, got {type(data)}")
+    return {str(k): v if isinstance(v, str) else json.dumps(v) for k, v in data.items()}
+
+
+def dumps(secrets, fmt) -> str:
+    if fmt == "dotenv":
+        return dump_dotenv(secrets)
+    if fmt == "yaml":
+        return _yaml().safe_dump(secrets, default_flow_style=False)
+    return json.dumps(secrets, indent=2, sort_keys=True) + "\n"
+
+
+def read(path, fmt=None) -> dict:
+    fmt = fmt or guess_format(path)
+    if not path or path == "-":
+        return loads(sys.stdin.read(), fmt)
+    with open(os.path.expanduser(path)) as f:
+        return loads(f.read(), fmt)
+
+
+def write(secrets, path, fmt=None) -> None:
+    fmt = fmt or guess_format(path)
+    text = dumps(secrets, fmt)
+    if not path or path == "-":
+        sys.stdout.write(text)
+        return
+    path = os.path.expanduser(path)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write(text)
+
+
+def open_secret(provider, secret, **params):
+    try:
+        module = importlib.import_module(f".{provider}", "cloudsecrets")
+        Secrets = getattr(module, "Secrets")
+    except Exception:
+        raise Exception(
+            "Failed to import vendor library. Must provide a valid provider. Supported: GCP|AWS"
+        )
+    return Secrets(secret, **params)
+
+
+def import_secret(s, data, replace=False) -> None:
+    """
+    Apply data to s as a single upstream write. With replace, keys missing from
+    data are removed too.
+    """
+    with s.batch():
+        if replace:
+            s.unset_many([k for k in s.keys() if k not in data])
+        s.set_many(data)
+
+
+def export_secret(s) -> dict:
+    return dict(s.items())
+
+
+def run(entry, command, replace=False) -> None:
+    """
+    Import or export one manifest entry:
+    {"secret": ..., "provider": ..., "file": ..., "format": ..., "project": ..., "region": ...}
+    Any "options" are passed on to the Secrets constructor.
+    """
+    params = dict(entry.get("options", {}))
+    for k in ("project", "region"):
+        if entry.get(k):
+            params[k] = entry[k]
+    s = open_secret(
+        entry.get("provider", PROVIDERS[0]).lower(), entry["secret"], **params
+    )
+    if command == "import":
+        import_secret(s, read(entry["file"], entry.get("format")), replace)
+    else:
+        write(export_secret(s), entry["file"], entry.get("format"))
+
+
+def run_manifest(manifest, command, replace=False, max_workers=8) -> dict:
+    """
+    Run every entry of a manifest concurrently. Returns {secret: exception} for
+    the entries which failed.
+    """
+    errors = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            pool.submit(run, entry, command, replace): entry["secret"]
+            for entry in manifest
+        }
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                errors[futures[future]] = e
+    return errors
+
+
+def main(argv) -> int:
+    parser = argparse.ArgumentParser(
+        prog="cloud-secrets",
+        description="Import or export whole secrets (or a manifest of many)",
+    )
+    parser.add_argument("command", choices=["import", "export"])
+    parser.add_argument(
+        "-p",
+        "--provider",
+        help=f"What upstream provider to use (case insensitive)",
+        type=str.lower,
+        choices=PROVIDERS,
+        default=PROVIDERS[0],
+    )
+    parser.add_argument("-s", "--secret", help="which secret resource to work with")
+    parser.add_argument(
+        "-f",
+        "--file",
+        default="-",
+        help="file to read (import) or write (export); - for stdin/stdout",
+    )
+    parser.add_argument(
+        "--format",
+        choices=FORMATS,
+        default=None,
+        help="file format, by default guessed from the file extension (else json)",
+    )
+    parser.add_argument(
+        "--replace",
+        action="store_true",
+        help="import: remove keys which aren't in the file",
+    )
+    parser.add_argument(
+        "-m",
+        "--manifest",
+        help="JSON or YAML list of {secret, provider, file, format, project, region, options}",
+    )
+    parser.add_argument("--max-workers", type=int, default=8)
+    parser.add_argument(
+        "-g",
+        "--gcpproject",
+        help="if using the GCP secret manager you must specify the project you want to use",
+        default=None,
+    )
+    parser.add_argument("--region", help="AWS region", default=None)
+    args = parser.parse_args(argv)
+
+    if args.manifest:
+        with open(os.path.expanduser(args.manifest)) as f:
+            text = f.read()
+        if guess_format(args.manifest) == "yaml":
+            manifest = _yaml().safe_load(text)
+        else:
+            manifest = json.loads(text)
+        for entry in manifest:
+            entry.setdefault("provider", args.provider)
+            entry.setdefault("project", args.gcpproject)
+            entry.setdefault("region", args.region)
+        errors = run_manifest(manifest, args.command, args.replace, args.max_workers)
+        for secret, e in errors.items():
+            logging.error(f"{args.command} {secret} failed: {e}")
+        return 1 if errors else 0
+
+    if not args.secret:
+        parser.error("either -s/--secret or -m/--manifest is required")
+    run(
+        {
+            "secret": args.secret,
+            "provider": args.provider,
+            "file": args.file,
+            "format": args.format,
+            "project": args.gcpproject,
+            "region": args.region,
+        },
+        args.command,
+        args.replace,
+    )
+    return 0
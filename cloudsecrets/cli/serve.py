@@ -0,0 +1,72 @@
+"""
+cloud-secrets serve: run the node-local secrets agent (see cloudsecrets.agent)
+"""
+
+import argparse
+import logging
+import os
+import signal
+import threading
+
+from cloudsecrets import agent
+
+
+def main(argv) -> int:
+    parser = argparse.ArgumentParser(
+        prog="cloud-secrets serve",
+        description="Serve secrets to local processes over a Unix domain socket",
+    )
+    parser.add_argument("command", choices=["serve"])
+    parser.add_argument(
+        "--socket",
+        default=os.environ.get("CLOUDSECRETS_SOCKET", agent.DEFAULT_SOCKET),
+        help="path of the Unix domain socket to listen on",
+    )
+    parser.add_argument(
+        "--socket-mode",
+        type=lambda x: int(x, 8),
+        default=0o600,
+        help="permissions of the socket (octal)",
+    )
+    parser.add_argument(
+        "--polling-interval",
+        type=int,
+        default=60,
+        help="seconds between checks for new upstream versions",
+    )
+    parser.add_argument(
+        "--max-secrets",
+        type=int,
+        default=256,
+        help="most distinct secrets the agent will serve",
+    )
+    parser.add_argument(
+        "-g",
+        "--gcpproject",
+        help="default GCP project for clients which don't name one",
+        default=None,
+    )
+    parser.add_argument("--region", help="default AWS region", default=None)
+    args = parser.parse_args(argv)
+
+    defaults = {}
+    if args.gcpproject:
+        defaults["project"] = args.gcpproject
+    if args.region:
+        defaults["region"] = args.region
+    server = agent.Server(
+        args.socket, args.polling_interval, defaults, args.socket_mode, args.max_secrets
+    )
+
+    def stop(*_):
+        # shutdown() waits for serve_forever, so it can't run on the serving thread
+        threading.Thread(target=server.shutdown).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    logging.info(f"cloud-secrets agent listening on {args.socket}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+    return 0
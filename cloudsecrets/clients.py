@@ -0,0 +1,75 @@
+import os
+import threading
+
+
+class ClientRegistry:
+    """
+    Process-wide registry of provider clients, so Secrets instances share one
+    boto3 client / gRPC channel per (provider, region, credentials) instead of
+    opening their own.
+
+    Clients are not safe to carry across os.fork(), so the registry forgets
+    everything in a forked child and clients are re-created there on first use.
+    Secrets instances which got their client from the registry look it up again
+    when they find themselves in another process.
+    """
+
+    def __init__(self) -> None:
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def get(self, key, factory):
+        """
+        Return the client registered under key, calling factory() to create it if needed
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            client = self._clients.get(key)
+        if client is not None:
+            return client
+        # factory() may be slow (e.g. opening a gRPC channel), so it runs unlocked;
+        # if two threads race, the first client registered wins
+        client = factory()
+        with self._lock:
+            return self._clients.setdefault(key, client)
+
+    def register(self, key, client) -> None:
+        """
+        Inject a client to be used for key from now on
+        """
+        with self._lock:
+            self._clients[key] = client
+
+    def _reset(self) -> None:
+        self._clients = {}
+        self._pid = os.getpid()
+
+    def _after_fork(self) -> None:
+        # another thread may have held the lock when the process forked
+        self._lock = threading.Lock()
+        self._reset()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._reset()
+
+
+registry = ClientRegistry()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=lambda: registry._after_fork())
+
+
+def aws_key(region=None) -> tuple:
+    return (
+        "aws",
+        region or os.environ.get("AWS_REGION") or os.environ.get("AWS_DEFAULT_REGION"),
+        os.environ.get("AWS_PROFILE"),
+        os.environ.get("AWS_ACCESS_KEY_ID"),
+    )
+
+
+def gcp_key() -> tuple:
+    return ("gcp", os.environ.get("GOOGLE_APPLICATION_CREDENTIALS"))
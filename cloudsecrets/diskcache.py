@@ -0,0 +1,101 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:  # pragma: no cover
+    Fernet = None
+
+
+class DiskCache:
+    """
+    Encrypted on-disk cache of the last known state of each secret, shared by
+    every process on the host.
+
+    Entries live in a small sqlite database, keyed by (provider, scope, secret,
+    version), and are encrypted with Fernet. The key is taken from the key
+    argument or the CLOUDSECRETS_CACHE_KEY env var; generate one with
+    cryptography.fernet.Fernet.generate_key().
+
+    A pinned version is always served from disk. The latest version is served
+    as long as it is younger than max_age; after that it is validated against
+    the upstream version id with a metadata call, or (with background_refresh)
+    served immediately while the refresh happens in a background thread. If
+    upstream can't be reached the last known value is served regardless of age.
+
+    Requires the cryptography package (pip install cloudsecrets[disk-cache]).
+    """
+
+    def __init__(self, path, key=None, max_age=300, background_refresh=False) -> None:
+        if Fernet is None:
+            raise ImportError("DiskCache requires the cryptography package")
+        key = key or os.environ.get("CLOUDSECRETS_CACHE_KEY")
+        assert key, "DiskCache requires an encryption key"
+        self.path = os.path.expanduser(path)
+        self.max_age = max_age
+        self.background_refresh = background_refresh
+        self._fernet = Fernet(key)
+        self._lock = threading.Lock()
+        if not os.path.exists(self.path):
+            os.close(os.open(self.path, os.O_CREAT | os.O_WRONLY, 0o600))
+        self._execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "provider TEXT, scope TEXT, secret TEXT, version TEXT, "
+            "data BLOB, fetched_at REAL, "
+            "PRIMARY KEY (provider, scope, secret, version))"
+        )
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            db = sqlite3.connect(self.path, timeout=10)
+            try:
+                with db:
+                    return db.execute(sql, params).fetchone()
+            finally:
+                db.close()
+
+    @staticmethod
+    def _key(key) -> tuple:
+        provider, scope, secret, version = key
+        return (provider, str(scope), secret, version or "latest")
+
+    def get(self, key):
+        """
+        Return (state, age in seconds) for key, or None
+        """
+        row = self._execute(
+            "SELECT data, fetched_at FROM entries "
+            "WHERE provider=? AND scope=? AND secret=? AND version=?",
+            self._key(key),
+        )
+        if row is None:
+            return None
+        try:
+            state = json.loads(self._fernet.decrypt(row[0]))
+        except (InvalidToken, ValueError):
+            # written with another key, or corrupt
+            return None
+        return state, time.time() - row[1]
+
+    def put(self, key, state) -> None:
+        data = self._fernet.encrypt(json.dumps(state).encode("utf-8"))
+        self._execute(
+            "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+            self._key(key) + (data, time.time()),
+        )
+
+    def touch(self, key) -> None:
+        """
+        Mark an entry as validated against upstream just now
+        """
+        self._execute(
+            "UPDATE entries SET fetched_at=? "
+            "WHERE provider=? AND scope=? AND secret=? AND version=?",
+            (time.time(),) + self._key(key),
+        )
+
+    def clear(self) -> None:
+        self._execute("DELETE FROM entries")
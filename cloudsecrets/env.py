@@ -1,19 +1,139 @@
 from cloudsecrets import SecretsBase
-import base64
+from cloudsecrets.lazy import encode, decode
+from collections.abc import MutableMapping
 import json
 import os
-import logging
+
+_MISSING = object()
+
+
+class EnvironView(MutableMapping):
+    """
+    The variables of an environment which start with prefix, keyed with the prefix
+    stripped. Values are read from the environment on every access, nothing is
+    copied or encoded up front. Writes stay in a local overlay and never touch the
+    environment itself.
+
+    Implements the same store interface as LazySecrets, so SecretsBase can batch,
+    diff and roll back writes to it.
+    """
+
+    __slots__ = ("_source", "_prefix", "_overlay", "_original")
+
+    def __init__(self, source, prefix="") -> None:
+        self._source = source
+        self._prefix = prefix
+        self._overlay = {}
+        self._original = {}
+
+    def _raw(self, key):
+        val = self._overlay.get(key, _MISSING)
+        if val is _MISSING and key not in self._overlay:
+            val = self._source.get(self._prefix + key, _MISSING)
+        return val
+
+    def _remember(self, key) -> None:
+        if key not in self._original:
+            self._original[key] = self._raw(key)
+
+    def __getitem__(self, key) -> str:
+        val = self._raw(key)
+        if val is _MISSING:
+            raise KeyError(key)
+        return val
+
+    def __setitem__(self, key, val) -> None:
+        if self._raw(key) == val:
+            return
+        self._remember(key)
+        self._overlay[key] = val
+
+    def __delitem__(self, key) -> None:
+        if self._raw(key) is _MISSING:
+            raise KeyError(key)
+        self._remember(key)
+        self._overlay[key] = _MISSING
+
+    def __contains__(self, key) -> bool:
+        return self._raw(key) is not _MISSING
+
+    def __iter__(self) -> iter:
+        n = len(self._prefix)
+        for name in list(self._source):
+            if name.startswith(self._prefix) and name[n:] not in self._overlay:
+                yield name[n:]
+        for key, val in list(self._overlay.items()):
+            if val is not _MISSING:
+                yield key
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
+
+    @property
+    def encoded(self) -> dict:
+        return {k: encode(v) for k, v in self.items()}
+
+    def copy(self) -> "EnvironView":
+        store = EnvironView(self._source, self._prefix)
+        store._overlay = dict(self._overlay)
+        store._original = dict(self._original)
+        return store
+
+    def changed_keys(self) -> set:
+        return {k for k, v in self._original.items() if self._raw(k) != v}
+
+    def changes(self) -> dict:
+        return {k: encode(self[k]) if k in self else None for k in self.changed_keys()}
+
+    def apply(self, changes) -> None:
+        for key, encoded in changes.items():
+            if encoded is None:
+                self.pop(key, None)
+            else:
+                self[key] = decode(encoded)
+
+    def mark_clean(self) -> None:
+        self._original = {}
+
+    def revert(self) -> None:
+        for key, val in self._original.items():
+            self._overlay[key] = val
+        self._original = {}
+
+    def dumps(self) -> str:
+        return json.dumps(self.encoded)
 
 
 class Secrets(SecretsBase):
-    def __init__(self, secret=None, **kwargs) -> None:
+    """
+    Secrets from environment variables.
+
+    Only variables starting with prefix are included, with the prefix stripped:
+    >>> os.environ["APP_DB_PASSWORD"] = "hunter2"
+    >>> Secrets(prefix="APP_")["DB_PASSWORD"]
+    'hunter2'
+
+    Values are read from the live environment when accessed, so constructing one
+    costs nothing. With snapshot=True the matching variables are copied once at
+    construction (and on reload) instead. set() and unset() only change this
+    object, never the environment.
+    """
+
+    def __init__(self, secret=None, prefix="", snapshot=False, **kwargs) -> None:
         super().__init__(secret, **kwargs)
+        self.prefix = prefix
+        self.snapshot = snapshot
         self._version = "1"
         self._load_secrets()
 
     def _load_secrets(self) -> None:
-        for k, v in os.environ.items():
-            self.set(k, v)
+        source = os.environ
+        if self.snapshot:
+            source = {k: v for k, v in source.items() if k.startswith(self.prefix)}
+        self._secrets = EnvironView(source, self.prefix)
 
     def update(self) -> None:
         self._version = str(int(self._version) + 1)
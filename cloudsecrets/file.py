@@ -1,9 +1,16 @@
 from cloudsecrets import SecretsBase
+from cloudsecrets.lazy import LazySecrets
 import os
 import json
+import tempfile
 
 
 class Secrets(SecretsBase):
+    """
+    Secrets kept in a local JSON file of plain key:value pairs, so it can be
+    edited by hand. Values which aren't strings are read as their JSON.
+    """
+
     def __init__(self, filename, **kwargs) -> None:
         super().__init__("", **kwargs)
         self.filename = filename
@@ -12,21 +19,34 @@ class Secrets(SecretsBase):
         self._load_secrets()
 
     def _load_secrets(self) -> None:
+        """
+        Load the file in a single pass. Loading never writes back to the file.
+        """
         if not os.path.exists(self.filename) and self.create_if_not_present:
-            f = open(self.filename, "w")
-            f.write("{}")
-            f.close()
-        j_blob = open(self.filename).read()
-        d = json.loads(j_blob)
-        for k, v in d.items():
-            self.set(k, v)
+            self._write("{}")
+        with open(self.filename) as f:
+            self._secrets = LazySecrets.from_decoded(json.load(f))
+        self._secrets.mark_clean()
+
+    def _write(self, j_blob) -> None:
+        """
+        Replace the file atomically (temp file + rename) so readers never see a partial write
+        """
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".cloudsecrets-")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(j_blob)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.filename)
+        except BaseException:
+            os.unlink(tmp)
+            raise
 
     def update(self) -> None:
         """
         write secret state back to the file
         """
-        j_blob = json.dumps(self._encoded_secrets)
-        f = open(self.filename, "w")
-        f.write(j_blob)
-        f.close()
+        self._write(json.dumps(dict(self._secrets)))
         self._version = str(int(self._version) + 1)
@@ -1,12 +1,11 @@
-from google.cloud import secretmanager
-import base64
-import json
 import os
 import logging
 
-from cloudsecrets import SecretsBase
+from cloudsecrets import SecretsBase, WriteConflict, cache, clients
+from cloudsecrets.lazy import LazySecrets
 
-from google.api_core import exceptions
+# SecretVersion.State.ENABLED
+ENABLED = 1
 
 
 class Secrets(SecretsBase):
@@ -62,75 +61,235 @@ class Secrets(SecretsBase):
                 break
             self._project = os.environ.get(prj, None)
         assert self._project, "Project must be specified"
-        self.client = secretmanager.SecretManagerServiceClient()
+        self._client = kwargs.get("client", None)
+        # the pid the registry client was looked up in, None for an injected client
+        self._client_pid = None
+        if self._client is None:
+            self._client_pid = os.getpid()
+            self._client = Secrets._registry_client()
         self._init_secrets()
 
+    @staticmethod
+    def _registry_client():
+        from google.cloud import secretmanager
+
+        return clients.registry.get(
+            clients.gcp_key(), secretmanager.SecretManagerServiceClient
+        )
+
     @property
-    def _secret_exists(self) -> bool:
+    def client(self):
         """
-        Test if a secret resource exists
+        The SecretManagerServiceClient. One from the registry is looked up again in
+        a forked child, as the parent's gRPC channel can't be used there.
         """
-        logging.debug(f"GCP _secret_exists")
-        try:
-            self.client.get_secret(self.client.secret_path(self.project, self.secret))
-            return True
-        except exceptions.NotFound:
-            return False
-        except:
-            raise
+        if self._client_pid not in (None, os.getpid()):
+            self._client_pid = os.getpid()
+            self._client = Secrets._registry_client()
+        return self._client
 
-    def _list_versions(self) -> list:
+    def _list_versions(self, enabled_only=False) -> list:
         logging.debug(f"GCP _list_versions")
+        return self._indexed_versions(enabled_only)
+
+    def _scan_versions(self, after=None) -> list:
+        """
+        Return the versions numbered above after, oldest to newest. GCP lists
+        versions newest first, so paging stops once it reaches versions already seen.
+        """
+        logging.debug(f"GCP _scan_versions ({self.secret}, {after})")
+        after = int(after or 0)
         parent = self.client.secret_path(self._project, self.secret)
         ret = []
-        for x in self.client.list_secret_versions(parent):
-            ret += [int(x.name.split("/")[-1])]
-        return sorted(ret)
+        prev = None
+        for x in self._call(self.client.list_secret_versions, parent):
+            n = int(x.name.split("/")[-1])
+            if n > after:
+                ret.append((n, x.state == ENABLED))
+            elif ret or (prev is not None and n < prev):
+                break
+            prev = n
+        return [(str(n), enabled) for n, enabled in sorted(ret)]
+
+    @property
+    def _cache_scope(self) -> tuple:
+        return ("gcp", self._project)
+
+    def _latest_version(self) -> str:
+        """
+        Resolve the "latest" alias from version metadata, without fetching the payload
+        """
+        logging.debug(f"GCP _latest_version")
+        x = self._call(
+            self.client.get_secret_version,
+            f"projects/{self._project}/secrets/{self.secret}/versions/latest",
+        )
+        if x.state != ENABLED:
+            return self._newest_enabled()
+        return x.name.split("/")[-1]
+
+    def _newest_enabled(self) -> str:
+        """
+        "latest" names the newest version even when it's disabled, which a losing
+        compare_and_swap writer leaves it until another version is added. Readers
+        fall back to the newest enabled one.
+        """
+        return self._refresh_versions(full=True).ids(enabled_only=True)[-1]
+
+    def _access_latest(self, secret_path):
+        from google.api_core import exceptions
+
+        try:
+            return self._call(self.client.access_secret_version, secret_path)
+        except exceptions.FailedPrecondition:
+            if self._version:
+                raise
+        return self._call(
+            self.client.access_secret_version,
+            f"projects/{self._project}/secrets/{self.secret}/versions/{self._newest_enabled()}",
+        )
 
     def _load_secrets(self) -> None:
         """
         Load upstream secret resource, replacing local secrets
         """
+        from google.api_core import exceptions
+
         logging.debug(f"GCP _load_secrets")
         secret_path = f"projects/{self._project}/secrets/{self.secret}/versions/{self._version or 'latest'}"
-        secrets = {}
-        if self.create_if_not_present and not self._secret_exists:
-            self._create_secret_resource()
+        latest = not cache.PayloadCache.pinned(self._version)
         try:
-            x = self.client.access_secret_version(secret_path)
-        except:
-            self._encoded_secrets = {}
-            self._secrets = {}
+            x = self._cached_fetch(
+                lambda: self._access_latest(secret_path),
+                lambda x: x.name.split("/")[-1],
+                lambda x: len(x.payload.data),
+            )
+        except exceptions.NotFound:
+            # either the resource or (for a new resource) any version is missing
+            self._secrets = LazySecrets()
+            if self.create_if_not_present and not self._exists:
+                self._create_secret_resource()
             return
-        self._version = x.name.split("/")[-1]
-        payload = x.payload.data.decode("utf-8")
-        self._encoded_secrets = json.loads(payload)
-        for k, v in self._encoded_secrets.items():
-            secrets[k] = base64.b64decode(v).decode("ascii")
-        self._secrets = secrets
+        except Exception as e:
+            self._load_failed(e)
+            return
+        self._exists = True
+        self._version = self._loaded_version = x.name.split("/")[-1]
+        self._secrets = self._deserialize(x.payload.data)
+        self._store_on_disk(latest)
 
     def _create_secret_resource(self) -> None:
         """
         Create the secret resource which will hold versions of secrets. A secret resource on its own has no secret data.
         """
+        from google.api_core import exceptions
+
         logging.debug(f"GCP _create_secret_resource")
         try:
-            self.client.create_secret(
+            self._call(
+                self.client.create_secret,
                 self.client.project_path(self.project),
                 self.secret,
                 {"replication": {"automatic": {}}},
             )
+        except exceptions.AlreadyExists:
+            pass
         except Exception as e:
             logging.error("Failed to create secret resource: {}".format(e))
             raise
+        self._exists = True
 
     def update(self) -> None:
         """
         Commit the current state of self._secrets to a new secret version
         """
+        from google.api_core import exceptions
+
         logging.debug(f"GCP update")
-        j_blob = json.dumps(self._encoded_secrets).encode("UTF-8")
-        resp = self.client.add_secret_version(
-            self.client.secret_path(self.project, self.secret), {"data": j_blob}
+        parent = self.client.secret_path(self.project, self.secret)
+        if self._exists is False:
+            self._create_secret_resource()
+        j_blob = self._serialize()
+        try:
+            resp = self._call_write(
+                self.client.add_secret_version, parent, {"data": j_blob}
+            )
+        except exceptions.NotFound:
+            self._exists = False
+            self._create_secret_resource()
+            resp = self._call_write(
+                self.client.add_secret_version, parent, {"data": j_blob}
+            )
+        self._exists = True
+        self._version = self._loaded_version = resp.name.split("/")[-1]
+        self._invalidate_cache()
+        self._store_on_disk(latest=True)
+
+    def _write_chunk(self, name, data) -> str:
+        from google.api_core import exceptions
+
+        parent = self.client.secret_path(self.project, name)
+        try:
+            resp = self._call_write(
+                self.client.add_secret_version, parent, {"data": data}
+            )
+        except exceptions.NotFound:
+            try:
+                self._call(
+                    self.client.create_secret,
+                    self.client.project_path(self.project),
+                    name,
+                    {"replication": {"automatic": {}}},
+                )
+            except exceptions.AlreadyExists:
+                pass
+            resp = self._call_write(
+                self.client.add_secret_version, parent, {"data": data}
+            )
+        return resp.name.split("/")[-1]
+
+    def _read_chunk(self, name, version) -> bytes:
+        x = self._call(
+            self.client.access_secret_version,
+            f"projects/{self._project}/secrets/{name}/versions/{version}",
         )
-        self._version = resp.name.split("/")[-1]
+        return x.payload.data
+
+    def _update_if_unchanged(self, base_version) -> None:
+        """
+        Version-checked write. GCP numbers versions sequentially, so the write was
+        based on the latest state if it became version base_version + 1, or if every
+        version in between was disabled by a losing writer. Otherwise the new version
+        is disabled again and WriteConflict is raised.
+
+        GCP can't make the version create itself conditional, so this is a check
+        after the fact: the losing version is briefly visible, and stays the
+        "latest" alias until another version is added, so readers skip disabled
+        versions (_newest_enabled).
+        """
+        logging.debug(f"GCP _update_if_unchanged")
+        base = int(base_version or 0)
+        self.update()
+        written = int(self._version)
+        if written == base + 1:
+            return
+        # the states of versions in between may have changed since they were indexed
+        versions = self._refresh_versions(full=True).ids(enabled_only=True)
+        if not [v for v in versions if base < int(v) < written]:
+            return
+        self._call(
+            self.client.disable_secret_version,
+            f"projects/{self._project}/secrets/{self.secret}/versions/{self._version}",
+        )
+        self._versions.exclude(self._version)
+        self._invalidate_cache()
+        raise WriteConflict(
+            f"{self.secret} moved past version {base_version} (wrote {self._version})"
+        )
+
+    def _reload_for_merge(self) -> None:
+        """
+        Merge onto the newest version which wasn't disabled by a losing writer
+        """
+        self._version = self._list_versions(enabled_only=True)[-1]
+        self._load_secrets()
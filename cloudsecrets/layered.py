@@ -0,0 +1,226 @@
+import logging
+import threading
+from contextlib import contextmanager
+
+from cloudsecrets import SecretsBase
+from cloudsecrets.lazy import encode
+
+_MISSING = object()
+
+
+class MergedView(dict):
+    """
+    The merged values, as a plain dict of decoded values which also offers the
+    read side of the store interface. Nothing is ever staged in it: writes go
+    to the write layer.
+    """
+
+    @property
+    def encoded(self) -> dict:
+        return {k: encode(v) for k, v in self.items()}
+
+    def copy(self) -> "MergedView":
+        return MergedView(self)
+
+    def changed_keys(self) -> set:
+        return set()
+
+    def changes(self) -> dict:
+        return {}
+
+    def mark_clean(self) -> None:
+        pass
+
+    def revert(self) -> None:
+        pass
+
+
+class Secrets(SecretsBase):
+    """
+    Several Secrets stacked in priority order: each key is served by the first
+    layer which has it.
+
+    >>> s = Secrets(layers=[env.Secrets(prefix="APP_"), file.Secrets("local.json"), aws.Secrets("app")])
+    >>> s["DB_PASSWORD"]
+    'hunter2'
+
+    The merged values are kept in one dict, so a lookup costs the same however
+    many layers there are. When a layer moves to a new version (its own polling,
+    a write through this object, or refresh() after it was changed directly)
+    only the keys it holds are merged again. Environment layers reading the live
+    environment have no versions, so later changes to it aren't picked up.
+
+    set() and unset() go to write_layer (an index into layers or one of the
+    layers, by default the last one). A key set there is still shadowed by any
+    layer above it. With polling_interval, layers which don't poll themselves
+    are polled along with this object. Rolling back, deleting and disk caching
+    are done on the layers themselves.
+    """
+
+    def __init__(self, secret=None, layers=(), write_layer=-1, **kwargs) -> None:
+        super().__init__(secret, **kwargs)
+        assert layers, "At least one layer is needed"
+        assert not self._version, "Layers are always merged at their current version"
+        assert self._disk_cache is None, "Give the layers a disk_cache instead"
+        self.layers = list(layers)
+        if not isinstance(write_layer, int):
+            write_layer = self.layers.index(write_layer)
+        self._write_index = write_layer % len(self.layers)
+        self._lock = threading.RLock()
+        # per layer: the version last merged and the keys it held then
+        self._layer_versions = [None] * len(self.layers)
+        self._layer_keys = [set() for _ in self.layers]
+        for i, layer in enumerate(self.layers):
+            layer.on_change(self._layer_changed(i))
+        self._init_secrets()
+
+    @property
+    def write_layer(self) -> SecretsBase:
+        return self.layers[self._write_index]
+
+    def _merged_version(self) -> str:
+        return "/".join(str(v) for v in self._layer_versions)
+
+    def _load_secrets(self) -> None:
+        """
+        Merge every layer from scratch, lowest priority first
+        """
+        with self._lock:
+            merged = MergedView()
+            for i in reversed(range(len(self.layers))):
+                layer = self.layers[i]
+                self._layer_versions[i] = layer.version
+                values = dict(layer.items())
+                self._layer_keys[i] = set(values)
+                merged.update(values)
+            self._secrets = merged
+            self._version = self._loaded_version = self._merged_version()
+
+    def _lookup(self, key):
+        for layer in self.layers:
+            if key in layer:
+                return True, layer[key]
+        return False, None
+
+    def _remerge(self, keys) -> None:
+        """
+        Resolve keys against the layers again and update the merged view in place
+        """
+        with self._lock:
+            merged = self._secrets
+            before = {}
+            for key in keys:
+                found, val = self._lookup(key)
+                if found == (key in merged) and (not found or merged[key] == val):
+                    continue
+                before[key] = merged.get(key, _MISSING)
+                if found:
+                    merged[key] = val
+                else:
+                    del merged[key]
+            self._version = self._loaded_version = self._merged_version()
+            if before and self._change_callbacks:
+                self._notify_merged(before)
+
+    def _notify_merged(self, before) -> None:
+        """
+        Call the change callbacks with the merged views before and after
+        """
+        new = dict(self._secrets)
+        old = dict(new)
+        for key, val in before.items():
+            if val is _MISSING:
+                old.pop(key, None)
+            else:
+                old[key] = val
+        for callback in list(self._change_callbacks):
+            try:
+                callback(old, new, set(before))
+            except Exception as e:
+                logging.error(f"Secret change callback failed: {e}")
+
+    def _refresh_layer(self, i) -> None:
+        """
+        Layer i is at a new version: merge again every key it holds or held
+        """
+        layer = self.layers[i]
+        with self._lock:
+            keys = set(layer.keys())
+            stale = self._layer_keys[i] | keys
+            self._layer_keys[i] = keys
+            self._layer_versions[i] = layer.version
+            self._remerge(stale)
+
+    def _layer_changed(self, i):
+        def callback(old, new, changed_keys):
+            with self._lock:
+                layer = self.layers[i]
+                for key in changed_keys:
+                    if key in layer:
+                        self._layer_keys[i].add(key)
+                    else:
+                        self._layer_keys[i].discard(key)
+                self._layer_versions[i] = layer.version
+                self._remerge(changed_keys)
+
+        return callback
+
+    def refresh(self) -> None:
+        """
+        Merge again the layers whose version moved since they were last merged
+        """
+        for i, layer in enumerate(self.layers):
+            if layer.version != self._layer_versions[i]:
+                self._refresh_layer(i)
+
+    def _poll_secrets(self) -> None:
+        for layer in self.layers:
+            if layer._poll_job is None:
+                layer._poll_secrets()
+        self.refresh()
+
+    @contextmanager
+    def batch(self):
+        """
+        Batch writes to the write layer, merging them once the block exits
+        """
+        try:
+            with self.write_layer.batch():
+                yield self
+        finally:
+            if not self.write_layer._batching:
+                self._refresh_layer(self._write_index)
+
+    def _written(self, key) -> None:
+        """
+        key was just written to the write layer; merge it unless that's deferred to
+        the end of a batch
+        """
+        layer = self.write_layer
+        if layer._batching:
+            return
+        with self._lock:
+            if key in layer:
+                self._layer_keys[self._write_index].add(key)
+            else:
+                self._layer_keys[self._write_index].discard(key)
+            self._layer_versions[self._write_index] = layer.version
+            self._remerge([key])
+
+    def set(self, key, val) -> None:
+        self.write_layer.set(key, val)
+        self._written(key)
+
+    def unset(self, key) -> None:
+        self.write_layer.unset(key)
+        self._written(key)
+
+    def update(self) -> None:
+        self.write_layer.update()
+        self._refresh_layer(self._write_index)
+
+    def rollback(self, version="-1") -> None:
+        raise TypeError("roll back a layer, then call refresh()")
+
+    def delete(self) -> None:
+        raise TypeError("delete the secret through its layer")
@@ -0,0 +1,151 @@
+import base64
+import json
+from collections.abc import MutableMapping
+
+
+def encode(val) -> str:
+    return base64.b64encode(bytes(val, "utf-8")).decode("ascii")
+
+
+def decode(val) -> str:
+    return base64.b64decode(val).decode("utf-8")
+
+
+_MISSING = object()
+
+
+class LazySecrets(MutableMapping):
+    """
+    A secret map which keeps the base64-encoded upstream values and only decodes
+    a key the first time it is read. Decoded values are memoized, so memory holds
+    the encoded payload plus the keys that were actually used.
+
+    Writes go to both forms, so .encoded is always ready to be serialized.
+    dumps() keeps the JSON fragment of every key and only re-serializes the keys
+    written since, and the original value of every written key is remembered
+    until mark_clean(), so writes that change nothing can be detected.
+    """
+
+    __slots__ = ("_encoded", "_decoded", "_fragments", "_original")
+
+    def __init__(self, encoded=None) -> None:
+        self._encoded = {} if encoded is None else encoded
+        self._decoded = {}
+        self._fragments = None
+        self._original = {}
+
+    @classmethod
+    def from_decoded(cls, secrets) -> "LazySecrets":
+        store = cls()
+        for k, v in secrets.items():
+            if type(v) != str:
+                v = json.dumps(v)
+            store[k] = v
+        return store
+
+    @property
+    def encoded(self) -> dict:
+        return self._encoded
+
+    def __getitem__(self, key) -> str:
+        try:
+            return self._decoded[key]
+        except KeyError:
+            pass
+        val = self._decoded[key] = decode(self._encoded[key])
+        return val
+
+    def _remember(self, key) -> None:
+        if key not in self._original:
+            self._original[key] = self._encoded.get(key, _MISSING)
+
+    def __setitem__(self, key, val) -> None:
+        encoded = encode(val)
+        if self._encoded.get(key) == encoded:
+            return
+        self._remember(key)
+        self._encoded[key] = encoded
+        self._decoded[key] = val
+        if self._fragments is not None:
+            self._fragments[key] = None
+
+    def __delitem__(self, key) -> None:
+        if key not in self._encoded:
+            raise KeyError(key)
+        self._remember(key)
+        del self._encoded[key]
+        self._decoded.pop(key, None)
+        if self._fragments is not None:
+            del self._fragments[key]
+
+    def __contains__(self, key) -> bool:
+        return key in self._encoded
+
+    def __iter__(self) -> iter:
+        return iter(self._encoded)
+
+    def __len__(self) -> int:
+        return len(self._encoded)
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
+
+    def copy(self) -> "LazySecrets":
+        store = LazySecrets(dict(self._encoded))
+        store._decoded = dict(self._decoded)
+        store._original = dict(self._original)
+        if self._fragments is not None:
+            store._fragments = dict(self._fragments)
+        return store
+
+    def changed_keys(self) -> set:
+        """
+        Keys whose value differs from what it was at the last mark_clean()
+        """
+        return {
+            k for k, v in self._original.items() if self._encoded.get(k, _MISSING) != v
+        }
+
+    def changes(self) -> dict:
+        """
+        {key: encoded value, or None if deleted} for every changed key
+        """
+        return {k: self._encoded.get(k) for k in self.changed_keys()}
+
+    def apply(self, changes) -> None:
+        """
+        Replay changes() from another store on top of this one
+        """
+        for key, encoded in changes.items():
+            if encoded is None:
+                self.pop(key, None)
+            else:
+                self[key] = decode(encoded)
+
+    def mark_clean(self) -> None:
+        self._original = {}
+
+    def revert(self) -> None:
+        """
+        Undo every change since the last mark_clean()
+        """
+        for key, encoded in self._original.items():
+            if encoded is _MISSING:
+                self._encoded.pop(key, None)
+            else:
+                self._encoded[key] = encoded
+            self._decoded.pop(key, None)
+        self._original = {}
+        self._fragments = None
+
+    def dumps(self) -> str:
+        """
+        json.dumps(self.encoded), re-serializing only the keys written since the last call
+        """
+        fragments = self._fragments
+        if fragments is None:
+            fragments = self._fragments = dict.fromkeys(self._encoded)
+        for key, fragment in fragments.items():
+            if fragment is None:
+                fragments[key] = f"{json.dumps(key)}: {json.dumps(self._encoded[key])}"
+        return "{" + ", ".join(fragments.values()) + "}"
@@ -0,0 +1,146 @@
+class Metrics:
+    """
+    Instrumentation hook for cloudsecrets. Subclass it and override whatever you
+    need; every method is a no-op by default. Pass an instance as metrics= to a
+    Secrets (or PayloadCache) or install it for the whole process with
+    set_default(). With no hook installed the instrumentation is skipped
+    entirely.
+    """
+
+    def observe_call(self, provider, operation, seconds, error=None) -> None:
+        """
+        A provider call finished after seconds (retries included). error is
+        None on success, or the class of error from cloudsecrets.retry.classify.
+        """
+
+    def observe_payload(self, provider, secret, size) -> None:
+        """
+        A secret payload of size bytes was fetched
+        """
+
+    def observe_poll(self, provider, secret, lag) -> None:
+        """
+        A polling tick started lag seconds after it was due
+        """
+
+    def observe_cache(self, cache, hit) -> None:
+        """
+        A lookup in cache ("payload" or "disk") was a hit or a miss
+        """
+
+
+class PrometheusMetrics(Metrics):
+    """
+    Export to prometheus_client (which must be installed)
+    """
+
+    def __init__(self, registry=None, namespace="cloudsecrets") -> None:
+        import prometheus_client as prom
+
+        kwargs = {} if registry is None else {"registry": registry}
+        self.latency = prom.Histogram(
+            f"{namespace}_provider_call_seconds",
+            "Latency of provider calls, retries included",
+            ["provider", "operation"],
+            **kwargs,
+        )
+        self.calls = prom.Counter(
+            f"{namespace}_provider_calls_total",
+            "Provider calls by outcome",
+            ["provider", "operation", "outcome"],
+            **kwargs,
+        )
+        self.payload = prom.Histogram(
+            f"{namespace}_payload_bytes",
+            "Size of fetched secret payloads",
+            ["provider"],
+            buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576),
+            **kwargs,
+        )
+        self.poll_lag = prom.Histogram(
+            f"{namespace}_poll_lag_seconds",
+            "Delay between when a poll was due and when it ran",
+            ["provider"],
+            **kwargs,
+        )
+        self.cache = prom.Counter(
+            f"{namespace}_cache_lookups_total",
+            "Cache lookups by result",
+            ["cache", "result"],
+            **kwargs,
+        )
+
+    def observe_call(self, provider, operation, seconds, error=None) -> None:
+        self.latency.labels(provider, operation).observe(seconds)
+        self.calls.labels(provider, operation, error or "success").inc()
+
+    def observe_payload(self, provider, secret, size) -> None:
+        self.payload.labels(provider).observe(size)
+
+    def observe_poll(self, provider, secret, lag) -> None:
+        self.poll_lag.labels(provider).observe(lag)
+
+    def observe_cache(self, cache, hit) -> None:
+        self.cache.labels(cache, "hit" if hit else "miss").inc()
+
+
+class OpenTelemetryMetrics(Metrics):
+    """
+    Export through the OpenTelemetry metrics API (opentelemetry-api must be installed)
+    """
+
+    def __init__(self, meter=None) -> None:
+        from opentelemetry import metrics
+
+        meter = meter or metrics.get_meter("cloudsecrets")
+        self.latency = meter.create_histogram(
+            "cloudsecrets.provider.call.duration",
+            unit="s",
+            description="Latency of provider calls, retries included",
+        )
+        self.calls = meter.create_counter(
+            "cloudsecrets.provider.calls", description="Provider calls by outcome"
+        )
+        self.payload = meter.create_histogram(
+            "cloudsecrets.payload.size",
+            unit="By",
+            description="Size of fetched secret payloads",
+        )
+        self.poll_lag = meter.create_histogram(
+            "cloudsecrets.poll.lag",
+            unit="s",
+            description="Delay between when a poll was due and when it ran",
+        )
+        self.cache = meter.create_counter(
+            "cloudsecrets.cache.lookups", description="Cache lookups by result"
+        )
+
+    def observe_call(self, provider, operation, seconds, error=None) -> None:
+        attributes = {"provider": provider, "operation": operation}
+        self.latency.record(seconds, attributes)
+        self.calls.add(1, dict(attributes, outcome=error or "success"))
+
+    def observe_payload(self, provider, secret, size) -> None:
+        self.payload.record(size, {"provider": provider})
+
+    def observe_poll(self, provider, secret, lag) -> None:
+        self.poll_lag.record(lag, {"provider": provider})
+
+    def observe_cache(self, cache, hit) -> None:
+        self.cache.add(1, {"cache": cache, "result": "hit" if hit else "miss"})
+
+
+_default = None
+
+
+def set_default(metrics) -> None:
+    """
+    Install the default Metrics hook (None to disable). It is picked up by Secrets
+    created from now on and by every cache without a hook of its own.
+    """
+    global _default
+    _default = metrics
+
+
+def get_default():
+    return _default
@@ -0,0 +1,230 @@
+import logging
+import random
+import threading
+import time
+
+NOT_FOUND = "not_found"
+THROTTLED = "throttled"
+TRANSIENT = "transient"
+FATAL = "fatal"
+
+_CODES = {
+    # AWS error codes
+    "ResourceNotFoundException": NOT_FOUND,
+    "ThrottlingException": THROTTLED,
+    "Throttling": THROTTLED,
+    "TooManyRequestsException": THROTTLED,
+    "RequestLimitExceeded": THROTTLED,
+    "InternalServiceError": TRANSIENT,
+    "InternalFailure": TRANSIENT,
+    "ServiceUnavailable": TRANSIENT,
+    "RequestTimeout": TRANSIENT,
+    # google.api_core exception classes
+    "NotFound": NOT_FOUND,
+    "ResourceExhausted": THROTTLED,
+    "TooManyRequests": THROTTLED,
+    "InternalServerError": TRANSIENT,
+    "BadGateway": TRANSIENT,
+    "GatewayTimeout": TRANSIENT,
+    "DeadlineExceeded": TRANSIENT,
+    "Aborted": TRANSIENT,
+    # transport errors
+    "EndpointConnectionError": TRANSIENT,
+    "ConnectionClosedError": TRANSIENT,
+    "ConnectTimeoutError": TRANSIENT,
+    "ReadTimeoutError": TRANSIENT,
+    "ConnectionError": TRANSIENT,
+    "TimeoutError": TRANSIENT,
+}
+
+
+# transient errors raised before the request could reach the provider
+_UNSENT = {"EndpointConnectionError", "ConnectTimeoutError", "ServiceUnavailable"}
+
+
+class CircuitOpen(Exception):
+    """
+    Calls to a provider are failing fast until its circuit breaker closes again
+    """
+
+
+def classify(e) -> str:
+    """
+    Sort a provider exception into NOT_FOUND, THROTTLED, TRANSIENT or FATAL.
+    Works on names so neither boto3 nor google-cloud needs to be imported.
+    """
+    response = getattr(e, "response", None)
+    if isinstance(response, dict):
+        code = response.get("Error", {}).get("Code")
+        if code in _CODES:
+            return _CODES[code]
+    for cls in type(e).__mro__:
+        if cls.__name__ in _CODES:
+            return _CODES[cls.__name__]
+    return FATAL
+
+
+def may_have_landed(e) -> bool:
+    """
+    Whether a failed call may still have been carried out upstream (a timeout
+    or dropped connection after the request went out, a server error)
+    """
+    if classify(e) != TRANSIENT:
+        return False
+    response = getattr(e, "response", None)
+    if isinstance(response, dict):
+        if response.get("Error", {}).get("Code") in _UNSENT:
+            return False
+    return not any(cls.__name__ in _UNSENT for cls in type(e).__mro__)
+
+
+class TokenBucket:
+    """
+    Client-side rate limit: rate requests per second with bursts of up to burst
+    """
+
+    def __init__(self, rate, burst) -> None:
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.burst, self._tokens + (now - self._stamp) * self.rate
+                )
+                self._stamp = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive failed calls and fails fast for
+    reset_timeout seconds, after which a single trial call is let through.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def open(self) -> bool:
+        return self._opened_at is not None
+
+    def check(self) -> None:
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._trial:
+                raise CircuitOpen("provider calls are failing, circuit is open")
+            self._trial = True
+
+    def success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._trial = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+
+class RequestLayer:
+    """
+    Every provider call goes through here: a token bucket and a circuit breaker
+    per (provider, scope), and retries of throttled and transient errors with
+    exponential backoff and full jitter. Not-found and fatal errors are raised
+    straight away.
+    """
+
+    # requests per second, roughly the published per-region/project quotas
+    DEFAULT_RATES = {"aws": 5000, "gcp": 1500}
+
+    def __init__(self, max_attempts=5, base_delay=0.1, max_delay=5) -> None:
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._buckets = {}
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def configure(self, scope, rate=None, burst=None, breaker=None) -> None:
+        """
+        Override the rate limit and/or circuit breaker of a (provider, scope)
+        """
+        with self._lock:
+            if rate is not None:
+                self._buckets[scope] = TokenBucket(rate, burst or rate)
+            if breaker is not None:
+                self._breakers[scope] = breaker
+
+    def _bucket(self, scope) -> TokenBucket:
+        with self._lock:
+            if scope not in self._buckets:
+                rate = self.DEFAULT_RATES.get(scope[0], 1000)
+                self._buckets[scope] = TokenBucket(rate, rate)
+            return self._buckets[scope]
+
+    def breaker(self, scope) -> CircuitBreaker:
+        with self._lock:
+            if scope not in self._breakers:
+                self._breakers[scope] = CircuitBreaker()
+            return self._breakers[scope]
+
+    def call(self, scope, fn, *args, **kwargs):
+        return self._call(scope, fn, args, kwargs, True)
+
+    def call_write(self, scope, fn, *args, **kwargs):
+        """
+        call() for a write which isn't idempotent: it is only retried when it
+        certainly didn't land, so a retry can't create a duplicate
+        """
+        return self._call(scope, fn, args, kwargs, False)
+
+    def _call(self, scope, fn, args, kwargs, idempotent):
+        bucket = self._bucket(scope)
+        breaker = self.breaker(scope)
+        breaker.check()
+        for attempt in range(self.max_attempts):
+            bucket.acquire()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                kind = classify(e)
+                if kind in (NOT_FOUND, FATAL):
+                    breaker.success()
+                    raise
+                if attempt == self.max_attempts - 1 or (
+                    not idempotent and may_have_landed(e)
+                ):
+                    breaker.failure()
+                    raise
+                delay = random.uniform(
+                    0, min(self.max_delay, self.base_delay * 2**attempt)
+                )
+                logging.debug(
+                    f"{kind} error from {scope}, retrying in {delay:.2f}s: {e}"
+                )
+                time.sleep(delay)
+                continue
+            breaker.success()
+            return result
+
+
+requests = RequestLayer()
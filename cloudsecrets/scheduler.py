@@ -0,0 +1,178 @@
+import heapq
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+
+class _Job:
+    def __init__(self, owner, interval) -> None:
+        self.callback = weakref.WeakMethod(owner._poll_secrets)
+        self.interval = interval
+        self.cancelled = False
+        self.due = None
+
+
+_schedulers = weakref.WeakSet()
+
+
+class RefreshScheduler:
+    """
+    Process-wide scheduler which drives polling for every Secrets instance.
+
+    A single dispatcher thread keeps a heap of due times and hands polls to a
+    bounded worker pool, so the number of threads does not grow with the number
+    of polling secrets. Each reschedule is jittered by +/- jitter * interval so
+    instances created together don't poll the provider in lockstep.
+
+    Jobs only hold a weak reference to their Secrets instance; an instance that
+    is garbage collected simply drops out of the schedule.
+
+    In a child created by os.fork() the threads are rebuilt and every job still
+    live is scheduled again, so instances created before the fork keep polling.
+    """
+
+    def __init__(self, max_workers=4, jitter=0.1) -> None:
+        self.max_workers = max_workers
+        self.jitter = jitter
+        self._heap = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._executor = None
+        self._closed = False
+        # every job registered and not yet cancelled or collected
+        self._jobs = set()
+        _schedulers.add(self)
+
+    def _next_due(self, interval) -> float:
+        spread = interval * self.jitter
+        return time.monotonic() + interval + random.uniform(-spread, spread)
+
+    def register(self, owner, interval) -> _Job:
+        """
+        Start polling owner._poll_secrets every interval seconds
+        """
+        job = _Job(owner, interval)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Scheduler has been shut down")
+            if self._thread is None:
+                self._start()
+            self._jobs.add(job)
+            self._push(job)
+        return job
+
+    def unregister(self, job) -> None:
+        with self._cond:
+            job.cancelled = True
+            self._jobs.discard(job)
+            self._cond.notify()
+
+    def _start(self) -> None:
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix="cloudsecrets-poll",
+        )
+        self._thread = threading.Thread(
+            target=self._run, name="cloudsecrets-scheduler", daemon=True
+        )
+        self._thread.start()
+
+    def _after_fork(self) -> None:
+        """
+        Only the forking thread survives in a child: replace the lock (which
+        another thread may have held) and the threads, and reschedule live jobs
+        """
+        self._cond = threading.Condition()
+        self._heap = []
+        self._thread = None
+        self._executor = None
+        jobs = {j for j in self._jobs if not j.cancelled and j.callback() is not None}
+        self._jobs = jobs
+        if self._closed or not jobs:
+            return
+        with self._cond:
+            self._start()
+            for job in jobs:
+                self._push(job)
+
+    def _push(self, job) -> None:
+        job.due = self._next_due(job.interval)
+        heapq.heappush(self._heap, (job.due, next(self._counter), job))
+        self._cond.notify()
+
+    def _run(self) -> None:
+        with self._cond:
+            while not self._closed:
+                while self._heap and self._heap[0][2].cancelled:
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                due, _, job = self._heap[0]
+                delay = due - time.monotonic()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                heapq.heappop(self._heap)
+                self._executor.submit(self._poll, job)
+
+    def _poll(self, job) -> None:
+        callback = job.callback()
+        if callback is None:
+            with self._cond:
+                self._jobs.discard(job)
+            return
+        try:
+            callback.__self__._observe_poll(time.monotonic() - job.due)
+            callback()
+        except Exception as e:
+            logging.error(f"Failed to poll secret: {e}")
+        finally:
+            del callback
+            with self._cond:
+                if not job.cancelled and not self._closed:
+                    self._push(job)
+
+    def shutdown(self, wait=True) -> None:
+        """
+        Stop dispatching polls and release the worker threads
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            if wait and self._thread is not threading.current_thread():
+                self._thread.join()
+            self._executor.shutdown(wait=wait)
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def _after_fork() -> None:
+    global _scheduler_lock
+    _scheduler_lock = threading.Lock()
+    for scheduler in list(_schedulers):
+        scheduler._after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def get_scheduler() -> RefreshScheduler:
+    """
+    Return the process-wide scheduler, creating it on first use
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RefreshScheduler()
+        return _scheduler
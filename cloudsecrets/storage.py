@@ -0,0 +1,127 @@
+"""
+The opt-in storage format for secret payloads (compression= on a provider
+Secrets). A packed payload starts with a 6 byte header:
+
+    magic (b"\\x00CS"), format version, codec, flags
+
+followed by the compressed JSON of the base64-encoded values. A payload whose
+flags have CHUNKED set is a manifest instead: JSON naming the companion secrets
+(and their versions) whose payloads, concatenated, make up the packed payload.
+
+Legacy payloads are plain JSON, which can't start with a NUL byte, so readers
+tell the two apart by the magic alone.
+"""
+
+import hashlib
+import json
+import struct
+import zlib
+
+MAGIC = b"\x00CS"
+FORMAT_VERSION = 1
+NONE, ZLIB, ZSTD = 0, 1, 2
+CODECS = {"none": NONE, "zlib": ZLIB, "zstd": ZSTD}
+CHUNKED = 1
+# the payload limit of a secret version, on both AWS and GCP
+MAX_PAYLOAD = 65536
+
+_HEADER = struct.Struct(">3sBBB")
+
+
+def is_packed(blob) -> bool:
+    return bytes(blob[:3]) == MAGIC
+
+
+def _header(blob) -> tuple:
+    """
+    Return (codec, flags) of a packed payload
+    """
+    magic, version, codec, flags = _HEADER.unpack_from(blob)
+    if magic != MAGIC:
+        raise ValueError("not a packed secret payload")
+    if version > FORMAT_VERSION:
+        raise ValueError(f"unsupported secret payload format version {version}")
+    return codec, flags
+
+
+def is_chunked(blob) -> bool:
+    return bool(_header(blob)[1] & CHUNKED)
+
+
+def _compress(codec, data) -> bytes:
+    if codec == ZLIB:
+        return zlib.compress(data, 9)
+    if codec == ZSTD:
+        import zstandard
+
+        return zstandard.ZstdCompressor(level=19).compress(data)
+    return data
+
+
+def _decompress(codec, data) -> bytes:
+    if codec == ZLIB:
+        return zlib.decompress(data)
+    if codec == ZSTD:
+        import zstandard
+
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == NONE:
+        return data
+    raise ValueError(f"unsupported secret payload codec {codec}")
+
+
+def pack(data, compression="zlib") -> bytes:
+    """
+    Pack the JSON payload data (bytes) with the named compression
+    """
+    if compression not in CODECS:
+        raise ValueError(f"unsupported compression {compression!r}")
+    codec = CODECS[compression]
+    return _HEADER.pack(MAGIC, FORMAT_VERSION, codec, 0) + _compress(codec, data)
+
+
+def unpack(blob) -> bytes:
+    """
+    Return the JSON payload of a packed, unchunked payload
+    """
+    codec, flags = _header(blob)
+    if flags & CHUNKED:
+        raise ValueError("chunked payloads have to be joined first")
+    return _decompress(codec, bytes(blob[_HEADER.size :]))
+
+
+def split(blob, size) -> list:
+    return [blob[i : i + size] for i in range(0, len(blob), size)]
+
+
+def manifest(chunks, blob) -> bytes:
+    """
+    A chunked payload standing for blob, whose parts are stored in chunks, a
+    list of (secret, version) in order
+    """
+    body = {
+        "chunks": [list(c) for c in chunks],
+        "size": len(blob),
+        "sha256": hashlib.sha256(blob).hexdigest(),
+    }
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, NONE, CHUNKED)
+    return header + json.dumps(body).encode("utf-8")
+
+
+def chunks(blob) -> list:
+    """
+    The (secret, version) pairs listed by a chunked payload
+    """
+    body = json.loads(bytes(blob[_HEADER.size :]))
+    return [tuple(c) for c in body["chunks"]]
+
+
+def join(blob, parts) -> bytes:
+    """
+    Reassemble the packed payload of a chunked payload from its parts
+    """
+    body = json.loads(bytes(blob[_HEADER.size :]))
+    data = b"".join(bytes(p) for p in parts)
+    if len(data) != body["size"] or hashlib.sha256(data).hexdigest() != body["sha256"]:
+        raise ValueError("secret payload chunks don't match their manifest")
+    return data
@@ -0,0 +1,109 @@
+import threading
+
+
+class VersionIndex:
+    """
+    The versions of one secret, oldest to newest, as far as they have been listed.
+
+    Backends extend the index with only the versions newer than the newest one it
+    holds, so a secret with thousands of versions is paged through once. Versions
+    which can't be loaded (disabled or destroyed) are kept but can be filtered out.
+    Positions are kept in dicts, so stepping back from a known version is O(1).
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.RLock()
+        self._ids = []
+        self._enabled = []
+        self._pos = {}
+        self._enabled_pos = {}
+        self._excluded = set()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, version) -> bool:
+        return version in self._pos
+
+    @property
+    def newest(self):
+        return self._ids[-1] if self._ids else None
+
+    def extend(self, entries) -> None:
+        """
+        Append (version, enabled) pairs, oldest to newest. Versions already indexed
+        only have their enabled flag updated.
+        """
+        reindex = False
+        for version, enabled in entries:
+            version = str(version)
+            if version in self._pos:
+                if enabled == (version in self._excluded):
+                    reindex = True
+                    self._set_enabled(version, enabled)
+                continue
+            self._pos[version] = len(self._ids)
+            self._ids.append(version)
+            if enabled:
+                self._enabled_pos[version] = len(self._enabled)
+                self._enabled.append(version)
+            else:
+                self._excluded.add(version)
+        if reindex:
+            self._reindex()
+
+    def replace(self, entries) -> None:
+        """
+        Drop everything and index entries from scratch
+        """
+        self.clear()
+        self.extend(entries)
+
+    def exclude(self, version) -> None:
+        """
+        Mark a version as no longer loadable, e.g. after disabling it
+        """
+        version = str(version)
+        if version in self._pos and version not in self._excluded:
+            self._set_enabled(version, False)
+            self._reindex()
+
+    def clear(self) -> None:
+        self._ids, self._enabled = [], []
+        self._pos, self._enabled_pos = {}, {}
+        self._excluded = set()
+
+    def ids(self, enabled_only=False) -> list:
+        return list(self._enabled if enabled_only else self._ids)
+
+    def at(self, n, enabled_only=False) -> str:
+        """
+        The nth version, counting from the oldest
+        """
+        return (self._enabled if enabled_only else self._ids)[n]
+
+    def step(self, version, offset, enabled_only=False) -> str:
+        """
+        The version offset positions away from version (negative is older).
+        Raises KeyError if version isn't indexed and IndexError if the result
+        would fall outside the index.
+        """
+        ids, pos = (
+            (self._enabled, self._enabled_pos)
+            if enabled_only
+            else (self._ids, self._pos)
+        )
+        n = pos[str(version)] + offset
+        if not 0 <= n < len(ids):
+            raise IndexError(f"no version {offset} away from {version}")
+        return ids[n]
+
+    def _set_enabled(self, version, enabled) -> None:
+        if enabled:
+            self._excluded.discard(version)
+        else:
+            self._excluded.add(version)
+
+    def _reindex(self) -> None:
+        self._enabled = [v for v in self._ids if v not in self._excluded]
+        self._enabled_pos = {v: i for i, v in enumerate(self._enabled)}
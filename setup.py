@@ -9,10 +9,17 @@ setup(
     python_requires=">=3.4",
     author="Mozilla IT Service Engineering",
     author_email="afrank@mozilla.com",
-    packages=find_packages(),
+    packages=find_packages(exclude=["benchmarks", "benchmarks.*"]),
     entry_points={"console_scripts": ["cloud-secrets=cloudsecrets.cli:main",],},
     install_requires=["google-cloud-secret-manager", "boto3", "moto", "simplejson"],
-    extras_require={"test": ["coverage", "pytest", "nose", "simplejson"],},
+    extras_require={
+        "test": ["coverage", "pytest", "nose", "simplejson"],
+        "disk-cache": ["cryptography"],
+        "prometheus": ["prometheus_client"],
+        "opentelemetry": ["opentelemetry-api"],
+        "yaml": ["PyYAML"],
+        "zstd": ["zstandard"],
+    },
     project_urls={"Source": "https://github.com/mozilla-it/cloudsecrets",},
     test_suite="tests.unit",
 )
@@ -0,0 +1,150 @@
+import os
+import tempfile
+import threading
+import unittest
+
+from nose.tools import assert_raises
+
+from cloudsecrets import agent, clients
+from cloudsecrets.gcp import Secrets as GCPSecrets
+from tests.unit.test_gcp_library import InMemoryClient
+
+
+class TestAgentLibrary(unittest.TestCase):
+    def setUp(self):
+        clients.registry.clear()
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "agent.sock")
+        self.client = InMemoryClient()
+        self.defaults = {"client": self.client, "project": "fake-project"}
+        GCPSecrets("app", **self.defaults).set_many({"A": "1", "B": "2"})
+        self.client.calls.clear()
+        self.start()
+
+    def start(self):
+        self.server = agent.Server(
+            self.path, polling_interval=0, defaults=self.defaults
+        )
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, args=(0.05,), daemon=True
+        )
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def tearDown(self):
+        self.stop()
+        agent._connections.clear()
+        self.dir.cleanup()
+
+    def open(self, secret="app"):
+        return agent.Secrets(secret, provider="gcp", socket_path=self.path)
+
+    def test_upstream_fetched_once(self):
+        clients = [self.open() for _ in range(5)]
+        assert all(dict(s) == {"A": "1", "B": "2"} for s in clients)
+        assert clients[0].version == "1"
+        assert self.client.calls == {"access_secret_version": 1}
+
+    def test_write_and_poll(self):
+        a, b = self.open(), self.open()
+        a.set_many({"A": "changed", "C": "3"})
+        a.unset("B")
+        assert self.client.calls["add_secret_version"] == 2
+        assert dict(a) == {"A": "changed", "C": "3"}
+        assert a.version == "3"
+
+        b._poll_secrets()
+        assert dict(b) == {"A": "changed", "C": "3"}
+        assert dict(GCPSecrets("app", **self.defaults)) == dict(a)
+
+    def test_reconnects(self):
+        s = self.open()
+        s._connection.sock.close()
+        s._connection.sock = None
+        assert s._latest_version() == "1"
+
+    def test_handles_are_reopened_after_agent_restart(self):
+        GCPSecrets("other", **self.defaults).set("O", "other")
+        x, y = self.open("app"), self.open("other")
+        assert (x._handle, y._handle) == (b"0", b"1")
+
+        # the new agent hands out handles in another order
+        self.stop()
+        x._connection.close()
+        self.start()
+        self.server.open("gcp", "other", {})
+        x._load_secrets()
+        assert x._handle == b"1"
+        y._load_secrets()
+        assert y._handle == b"0"
+        assert dict(x) == {"A": "1", "B": "2"}
+        assert dict(y) == {"O": "other"}
+
+    def test_errors(self):
+        with assert_raises(agent.AgentError):
+            agent.Secrets("app", provider="file", socket_path=self.path)
+        with assert_raises(agent.AgentError):
+            agent._connection(self.path).request(agent.VERSION, b"42", b"[]")
+
+        # a handle is only served to the secret it was opened for
+        s = self.open()
+        other = agent._identity("gcp", "other", {})
+        with assert_raises(agent.AgentError):
+            s._connection.request(agent.SNAPSHOT, s._handle, other)
+
+    def test_refuses_to_replace_a_live_agent(self):
+        with assert_raises(agent.AgentError):
+            agent.Server(self.path, polling_interval=0, defaults=self.defaults)
+        assert self.open().get("A") == "1"
+
+        # a socket file nobody listens on is taken over
+        stale = os.path.join(self.dir.name, "stale.sock")
+        dead = agent.Server(stale, polling_interval=0)
+        dead.socket.close()
+        agent.Server(stale, polling_interval=0).server_close()
+
+        # anything else is left alone
+        regular = os.path.join(self.dir.name, "secrets.json")
+        with open(regular, "w") as f:
+            f.write("{}")
+        with assert_raises(agent.AgentError):
+            agent.Server(regular, polling_interval=0)
+        assert os.path.exists(regular)
+
+    def test_options_and_secrets_are_limited(self):
+        with assert_raises(agent.AgentError):
+            agent.Secrets(
+                "app",
+                provider="gcp",
+                options={"client": "x"},
+                socket_path=self.path,
+            )
+        self.server.max_secrets = 2
+        self.open("app")
+        self.open("other")
+        with assert_raises(agent.AgentError):
+            self.open("third")
+        with assert_raises(agent.AgentError):
+            self.open().delete()
+
+    @unittest.skipUnless(hasattr(os, "fork"), "requires os.fork")
+    def test_fork_gets_its_own_connection(self):
+        s = self.open()
+        parent_sock = s._connection.sock
+        r, w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                ok = (
+                    s._latest_version() == "1" and s._connection.sock is not parent_sock
+                )
+                os.write(w, b"1" if ok else b"0")
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        assert os.read(r, 1) == b"1"
+        assert s._connection.sock is parent_sock
+        assert s._latest_version() == "1"
@@ -0,0 +1,57 @@
+import asyncio
+import unittest
+
+import boto3
+from moto import mock_secretsmanager
+
+from cloudsecrets.aio import Secrets
+
+
+class TestAioLibrary(unittest.TestCase):
+    @mock_secretsmanager
+    def test_open_set_refresh(self):
+        async def run():
+            connection = boto3.client("secretsmanager", region_name="us-east-1")
+            s = await Secrets.open(
+                "aws", "aio-secret", connection=connection, is_binary=True
+            )
+            await s.set("A", "1")
+            assert s["A"] == "1"
+
+            other = await Secrets.open(
+                "aws", "aio-secret", connection=connection, is_binary=True
+            )
+            changes = []
+            other.on_change(lambda old, new, keys: changes.append(keys))
+            await s.set_many({"A": "2", "B": "3"})
+            await other.refresh()
+            assert dict(other) == {"A": "2", "B": "3"}
+            assert changes == [{"A", "B"}]
+            await s.close()
+            await other.close()
+
+        asyncio.run(run())
+
+    @mock_secretsmanager
+    def test_polling_task(self):
+        async def run():
+            connection = boto3.client("secretsmanager", region_name="us-east-1")
+            writer = await Secrets.open(
+                "aws", "aio-polled", connection=connection, is_binary=True
+            )
+            async with await Secrets.open(
+                "aws",
+                "aio-polled",
+                polling_interval=0.02,
+                connection=connection,
+                is_binary=True,
+            ) as reader:
+                await writer.set("A", "1")
+                for _ in range(50):
+                    if reader.get("A") == "1":
+                        break
+                    await asyncio.sleep(0.02)
+                assert reader.get("A") == "1"
+            assert reader._poll_task is None
+
+        asyncio.run(run())
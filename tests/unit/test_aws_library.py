@@ -1,12 +1,20 @@
+import base64
+import collections
+import contextlib
 import json
+import os
+import time
 import unittest
+import unittest.mock as mock
 
 import boto3
 import simplejson
 from nose.tools import assert_raises
 from six import b
 
+from cloudsecrets import clients
 from cloudsecrets.aws import Secrets
+from cloudsecrets.cache import PayloadCache
 
 
 class TestAWSLibrary(unittest.TestCase):
@@ -20,6 +28,22 @@ class TestAWSLibrary(unittest.TestCase):
         self.secret_value = "SECRET"
         self.connection = boto3.client("secretsmanager", region_name="us-east-1")
 
+    @contextlib.contextmanager
+    def counting_calls(self):
+        """
+        Count the upstream calls made through self.connection, by operation
+        """
+        calls = collections.Counter()
+
+        def count(model, **kwargs):
+            calls[model.name] += 1
+
+        self.connection.meta.events.register("before-call", count)
+        try:
+            yield calls
+        finally:
+            self.connection.meta.events.unregister("before-call", count)
+
     @mock_secretsmanager
     def test_create_secret(self):
         secrets = Secrets(self.secret_name, connection=self.connection, is_binary=True)
@@ -33,6 +57,234 @@ class TestAWSLibrary(unittest.TestCase):
         secrets.unset(self.secret_key)
         assert dict(secrets).get(self.secret_key) is None
 
+    @mock_secretsmanager
+    def test_batch_creates_one_version(self):
+        secrets = Secrets(self.secret_name, connection=self.connection, is_binary=True)
+        before = len(secrets._list_versions())
+        secrets.set_many({"A": "1", "B": "2", "C": "3"})
+        assert len(secrets._list_versions()) == before + 1
+        secrets = Secrets(self.secret_name, connection=self.connection, is_binary=True)
+        assert dict(secrets) == {"A": "1", "B": "2", "C": "3"}
+
+    @mock_secretsmanager
+    def test_upstream_call_counts(self):
+        with self.counting_calls() as calls:
+            # a missing secret: one failed fetch, one create
+            secrets = Secrets(
+                "counted-secret", connection=self.connection, is_binary=True
+            )
+            assert calls == {"GetSecretValue": 1, "CreateSecret": 1}
+
+            # a write is a single put, no existence probe
+            calls.clear()
+            secrets.set(self.secret_key, self.secret_value)
+            assert calls == {"PutSecretValue": 1}
+
+            # a cold load of an existing secret is a single fetch
+            calls.clear()
+            secrets = Secrets(
+                "counted-secret", connection=self.connection, is_binary=True
+            )
+            assert calls == {"GetSecretValue": 1}
+            assert dict(secrets).get(self.secret_key) == self.secret_value
+
+            calls.clear()
+            secrets.set(self.secret_key, "OTHER")
+            assert calls == {"PutSecretValue": 1}
+
+    @mock_secretsmanager
+    def test_poll_skips_unchanged_payload(self):
+        changes = []
+        secrets = Secrets("polled-secret", connection=self.connection, is_binary=True)
+        secrets.set("A", "1")
+        secrets.on_change(lambda old, new, keys: changes.append(keys))
+        with self.counting_calls() as calls:
+            secrets._poll_secrets()
+            assert calls == {"DescribeSecret": 1}
+            assert changes == []
+
+            other = Secrets("polled-secret", connection=self.connection, is_binary=True)
+            other.set_many({"A": "2", "B": "3"})
+            calls.clear()
+            secrets._poll_secrets()
+            assert calls == {"DescribeSecret": 1, "GetSecretValue": 1}
+            assert dict(secrets) == {"A": "2", "B": "3"}
+            assert changes == [{"A", "B"}]
+
+    @mock_secretsmanager
+    def test_shared_payload_cache(self):
+        cache = PayloadCache()
+
+        def open_secret():
+            return Secrets(
+                "cached-secret", connection=self.connection, cache=cache, is_binary=True
+            )
+
+        writer = open_secret()
+        writer.set("A", "1")
+        with self.counting_calls() as calls:
+            readers = [open_secret() for _ in range(10)]
+            assert calls == {"GetSecretValue": 1}
+            assert all(dict(r) == {"A": "1"} for r in readers)
+            assert cache.hits == 9
+
+            # a write invalidates the cached latest payload
+            writer.set("A", "2")
+            assert dict(open_secret()) == {"A": "2"}
+            assert calls["GetSecretValue"] == 2
+
+    @mock_secretsmanager
+    def test_shared_client(self):
+        from cloudsecrets import clients
+
+        clients.registry.clear()
+        a = Secrets("shared-a", region="us-east-1", is_binary=True)
+        b = Secrets("shared-b", region="us-east-1", is_binary=True)
+        c = Secrets("shared-a", region="us-west-2", is_binary=True)
+        assert a.connection is b.connection
+        assert a.connection is not c.connection
+        clients.registry.clear()
+
+    @mock_secretsmanager
+    def test_noop_writes_are_skipped(self):
+        secrets = Secrets("noop-secret", connection=self.connection, is_binary=True)
+        secrets.set_many({"A": "1", "B": "2"})
+        version = secrets.version
+        with self.counting_calls() as calls:
+            secrets.set("A", "1")
+            secrets.unset("MISSING")
+            with secrets.batch():
+                secrets.set("B", "changed")
+                secrets.set("B", "2")
+            assert calls == {}
+            assert secrets.version == version
+
+    @mock_secretsmanager
+    def test_compare_and_swap_merges_concurrent_writers(self):
+        def open_secret():
+            return Secrets(
+                "cas-secret",
+                connection=self.connection,
+                is_binary=True,
+                compare_and_swap=True,
+            )
+
+        open_secret().set("BASE", "0")
+        a = open_secret()
+        b = open_secret()
+        a.set("A", "1")
+        with self.counting_calls() as calls:
+            # b is still based on the version before a's write
+            b.set("B", "2")
+        assert calls["UpdateSecretVersionStage"] == 2
+        assert dict(b) == {"BASE": "0", "A": "1", "B": "2"}
+        assert dict(open_secret()) == {"BASE": "0", "A": "1", "B": "2"}
+
+        # the happy path costs no reload
+        with self.counting_calls() as calls:
+            b.set("C", "3")
+        assert calls == {"PutSecretValue": 1, "UpdateSecretVersionStage": 1}
+
+    @mock_secretsmanager
+    def test_throttling_is_retried_not_swallowed(self):
+        from botocore.exceptions import ClientError
+        from cloudsecrets import retry
+
+        throttled = ClientError(
+            {"Error": {"Code": "ThrottlingException", "Message": "slow down"}},
+            "GetSecretValue",
+        )
+        Secrets("throttled-secret", connection=self.connection, is_binary=True).set(
+            "A", "1"
+        )
+        get_secret_value = self.connection.get_secret_value
+        with mock.patch.object(retry, "requests", retry.RequestLayer(base_delay=0)):
+            responses = [throttled, throttled]
+
+            def flaky(**kwargs):
+                if responses:
+                    raise responses.pop(0)
+                return get_secret_value(**kwargs)
+
+            with mock.patch.object(
+                self.connection, "get_secret_value", side_effect=flaky
+            ):
+                secrets = Secrets(
+                    "throttled-secret", connection=self.connection, is_binary=True
+                )
+            assert dict(secrets) == {"A": "1"}
+
+            # throttled past every retry: the last good value is kept
+            with mock.patch.object(
+                self.connection, "get_secret_value", side_effect=throttled
+            ):
+                secrets._version = None
+                secrets._load_secrets()
+            assert dict(secrets) == {"A": "1"}
+
+            # and with nothing loaded yet it raises instead of returning {}
+            with mock.patch.object(
+                self.connection, "get_secret_value", side_effect=throttled
+            ):
+                with assert_raises(ClientError):
+                    Secrets("throttled-secret", connection=self.connection)
+
+    @mock_secretsmanager
+    def test_retried_write_reuses_its_token(self):
+        from botocore.exceptions import ClientError
+
+        secrets = Secrets(self.secret_name, connection=self.connection, is_binary=True)
+        before = len(secrets._list_versions())
+        put = self.connection.put_secret_value
+        tokens = []
+
+        def landed_then_failed(**kwargs):
+            tokens.append(kwargs["ClientRequestToken"])
+            x = put(**kwargs)
+            if len(tokens) == 1:
+                error = {"Error": {"Code": "InternalServiceError", "Message": "x"}}
+                raise ClientError(error, "PutSecretValue")
+            return x
+
+        with mock.patch.object(self.connection, "put_secret_value", landed_then_failed):
+            secrets.set("A", "1")
+        assert len(tokens) == 2 and tokens[0] == tokens[1]
+        assert len(secrets._refresh_versions(full=True)) == before + 1
+
+    @mock_secretsmanager
+    def test_landed_stage_move_is_not_repeated(self):
+        from botocore.exceptions import ClientError
+
+        def open_secret():
+            return Secrets(
+                "moved-secret",
+                connection=self.connection,
+                is_binary=True,
+                compare_and_swap=True,
+            )
+
+        open_secret().set("BASE", "0")
+        secrets = open_secret()
+        before = len(secrets._list_versions())
+        move = self.connection.update_secret_version_stage
+        moves = []
+
+        def landed_then_failed(**kwargs):
+            moves.append(kwargs)
+            x = move(**kwargs)
+            if len(moves) == 1:
+                error = {"Error": {"Code": "InternalServiceError", "Message": "x"}}
+                raise ClientError(error, "UpdateSecretVersionStage")
+            return x
+
+        with mock.patch.object(
+            self.connection, "update_secret_version_stage", landed_then_failed
+        ):
+            secrets.set("A", "1")
+        assert len(moves) == 1
+        assert len(secrets._refresh_versions(full=True)) == before + 1
+        assert dict(open_secret()) == {"BASE": "0", "A": "1"}
+
     @mock_secretsmanager
     def test_delete_secret(self):
         self.connection.create_secret(Name="test-secret", SecretBinary=b("{}"))
@@ -52,6 +304,13 @@ class TestAWSLibrary(unittest.TestCase):
         with assert_raises(simplejson.errors.JSONDecodeError):
             Secrets.unpack_response(secret_response)
 
+    def test_unpack_response_raises_simplejson_errors(self):
+        # the same contract without going through moto, which rejects an empty SecretString
+        with assert_raises(simplejson.errors.JSONDecodeError):
+            Secrets.unpack_response({"SecretString": ""})
+        with assert_raises(simplejson.errors.JSONDecodeError):
+            Secrets.unpack_response({"SecretBinary": b"not json"})
+
     @mock_secretsmanager
     def test_unpack_response_secret_string_empty_dictionary(self):
         secret_id = "test-secret"
@@ -92,3 +351,226 @@ class TestAWSLibrary(unittest.TestCase):
             "super-secret", connection=self.connection, create_if_not_present=True
         )
         assert secrets.secrets == dict()
+
+    @mock_secretsmanager
+    def test_load_many(self):
+        from cloudsecrets import load_many
+
+        names = [f"many-{i}" for i in range(30)]
+        for name in names:
+            Secrets(name, connection=self.connection, is_binary=True).set("K", name)
+
+        def batch_get_secret_value(SecretIdList):
+            # not implemented by moto, so build it from single fetches
+            resp = {"SecretValues": [], "Errors": []}
+            for n in SecretIdList:
+                try:
+                    x = self.connection.get_secret_value(SecretId=n)
+                    resp["SecretValues"].append(x)
+                except self.connection.exceptions.ResourceNotFoundException:
+                    resp["Errors"].append({"SecretId": n})
+            return resp
+
+        with self.counting_calls() as calls:
+            with mock.patch.object(
+                self.connection, "batch_get_secret_value", batch_get_secret_value
+            ):
+                result = load_many(
+                    "aws",
+                    names + ["many-missing"],
+                    connection=self.connection,
+                    is_binary=True,
+                    create_if_not_present=False,
+                    timeout=30,
+                )
+        assert sorted(result) == sorted(names + ["many-missing"])
+        assert result.errors == {}
+        assert all(result[n].get("K") == n for n in names)
+        # 31 fetches inside the two batches plus the miss falling back to a single fetch
+        assert calls == {"GetSecretValue": 32}
+        assert result["many-0"]._cache is None
+
+    @mock_secretsmanager
+    def test_load_many_collects_errors(self):
+        from cloudsecrets import load_many
+
+        with mock.patch.object(
+            Secrets, "_load_secrets", side_effect=RuntimeError("boom")
+        ):
+            result = load_many("aws", ["a", "b"], connection=self.connection)
+        assert len(result) == 0
+        assert set(result.errors) == {"a", "b"}
+
+    @mock_secretsmanager
+    def test_load_many_bounds_prefetch_by_deadline(self):
+        from cloudsecrets import load_many
+
+        def batch_get_secret_value(SecretIdList):
+            time.sleep(2)
+            return {"SecretValues": [], "Errors": []}
+
+        start = time.monotonic()
+        with mock.patch.object(
+            self.connection, "batch_get_secret_value", batch_get_secret_value
+        ):
+            result = load_many(
+                "aws", ["a", "b"], connection=self.connection, timeout=0.3
+            )
+        assert time.monotonic() - start < 1.5
+        assert set(result.errors) == {"a", "b"}
+
+    @mock_secretsmanager
+    def test_prefetch_uses_primary_of_regions(self):
+        clients.registry.clear()
+        kwargs, _ = Secrets._prefetch(["a"], regions=["us-west-2", "us-east-1"])
+        assert kwargs["region"] == "us-west-2"
+        assert kwargs["connection"].meta.region_name == "us-west-2"
+
+    @mock_secretsmanager
+    def test_version_listing_follows_pagination(self):
+        secrets = Secrets(self.secret_name, connection=self.connection, is_binary=True)
+        for i in range(110):
+            self.connection.put_secret_value(
+                SecretId=self.secret_name,
+                SecretBinary=b(json.dumps({"N": base64.b64encode(b(str(i))).decode()})),
+            )
+        versions = secrets._list_versions()
+        assert len(versions) == 111
+        assert len(set(versions)) == 111
+
+        with self.counting_calls() as calls:
+            secrets.rollback(versions[-1])
+            secrets.rollback(-2)
+        assert secrets.version == versions[-3]
+        assert "ListSecretVersionIds" not in calls
+
+    def _regional(self):
+        """
+        The same secret created independently in two regions, with values telling them apart
+        """
+        clients.registry.clear()
+        for region in ("us-east-1", "us-west-2"):
+            Secrets(self.secret_name, region=region, is_binary=True).set(
+                "WHERE", region
+            )
+        return boto3.client("secretsmanager", region_name="us-east-1")
+
+    @mock_secretsmanager
+    def test_hedged_read_uses_replica_when_primary_is_slow(self):
+        primary = self._regional()
+        primary.meta.events.register("before-call", lambda **kw: time.sleep(0.5))
+        start = time.monotonic()
+        secrets = Secrets(
+            self.secret_name,
+            connection=primary,
+            regions=["us-east-1", "us-west-2"],
+            hedge_delay=0.02,
+            is_binary=True,
+        )
+        assert secrets["WHERE"] == "us-west-2"
+        assert time.monotonic() - start < 0.5
+
+    @mock_secretsmanager
+    def test_hedged_read_prefers_a_fast_primary(self):
+        primary = self._regional()
+        secrets = Secrets(
+            self.secret_name,
+            connection=primary,
+            regions=["us-east-1", "us-west-2"],
+            hedge_delay=5,
+            is_binary=True,
+        )
+        assert secrets["WHERE"] == "us-east-1"
+        # writes only go to the primary
+        secrets.set("NEW", "value")
+        replica = Secrets(self.secret_name, region="us-west-2", is_binary=True)
+        assert "NEW" not in replica
+
+    @mock_secretsmanager
+    def test_hedged_read_falls_back_when_primary_fails(self):
+        primary = self._regional()
+        failing = mock.Mock(wraps=primary)
+        failing.meta = primary.meta
+        failing.exceptions = primary.exceptions
+        failing.get_secret_value.side_effect = RuntimeError("region down")
+        secrets = Secrets(
+            self.secret_name,
+            connection=failing,
+            regions=["us-east-1", "us-west-2"],
+            hedge_delay=5,
+            is_binary=True,
+        )
+        assert secrets["WHERE"] == "us-west-2"
+
+    @mock_secretsmanager
+    def test_compressed_and_chunked_payloads(self):
+        values = {f"KEY{i}": os.urandom(512).hex() for i in range(20)}
+        secrets = Secrets(
+            self.secret_name,
+            connection=self.connection,
+            compression="zlib",
+            max_payload=4096,
+        )
+        secrets.set_many(values)
+        assert len(secrets._chunks) > 1
+        resp = self.connection.get_secret_value(SecretId=self.secret_name)
+        assert resp["SecretBinary"].startswith(b"\x00CS")
+        assert len(resp["SecretBinary"]) < 4096
+
+        # readers detect the format whatever they were configured with
+        legacy = Secrets(self.secret_name, connection=self.connection, is_binary=True)
+        assert dict(legacy) == values
+        assert legacy._chunks == secrets._chunks
+
+        # small enough again: no chunks, and an older version still reads back
+        version = secrets.version
+        secrets.unset_many(list(values)[1:])
+        assert secrets._chunks == []
+        reread = Secrets(self.secret_name, connection=self.connection, version=version)
+        assert dict(reread) == values
+
+        # deletes the chunks older versions refer to, not only the current ones
+        assert reread._chunks
+        secrets.delete()
+        for i in range(len(reread._chunks)):
+            chunk = self.connection.describe_secret(
+                SecretId=f"{self.secret_name}--chunk-{i}"
+            )
+            assert "DeletedDate" in chunk
+
+    @mock_secretsmanager
+    def test_compressed_reader_reads_legacy_payloads(self):
+        Secrets(self.secret_name, connection=self.connection, is_binary=True).set(
+            "A", "1"
+        )
+        secrets = Secrets(
+            self.secret_name, connection=self.connection, compression="zlib"
+        )
+        assert dict(secrets) == {"A": "1"}
+        secrets.set("B", "2")
+        resp = self.connection.get_secret_value(SecretId=self.secret_name)
+        assert resp["SecretBinary"].startswith(b"\x00CS")
+
+    @unittest.skipUnless(hasattr(os, "fork"), "requires os.fork")
+    @mock_secretsmanager
+    def test_registry_client_is_replaced_after_fork(self):
+        clients.registry.clear()
+        secrets = Secrets(self.secret_name, region="us-east-1", is_binary=True)
+        injected = Secrets(self.secret_name, connection=self.connection, is_binary=True)
+        parent = secrets.connection
+        r, w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                ok = (
+                    secrets.connection is not parent
+                    and secrets.connection
+                    is clients.registry.get(clients.aws_key("us-east-1"), None)
+                    and injected.connection is self.connection
+                )
+                os.write(w, b"1" if ok else b"0")
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        assert os.read(r, 1) == b"1"
+        assert secrets.connection is parent
@@ -0,0 +1,106 @@
+import threading
+import timeit
+import unittest
+import unittest.mock as mock
+
+from cloudsecrets import SecretsBase
+from cloudsecrets.lazy import LazySecrets
+
+
+class UpstreamSecrets(SecretsBase):
+    """
+    A backend whose upstream always has a newer version than the one loaded
+    """
+
+    def __init__(self) -> None:
+        super().__init__("fake-secret")
+        self.written = []
+        self.upstream = {}
+        self._version = "1"
+
+    def _latest_version(self) -> str:
+        return str(int(self._version) + 1)
+
+    def _load_secrets(self) -> None:
+        self._secrets = LazySecrets.from_decoded(self.upstream)
+
+    def update(self) -> None:
+        self.written.append(dict(self._secrets))
+        self._version = str(int(self._version) + 1)
+
+
+class TestBaseLibrary(unittest.TestCase):
+    def _secrets(self, n):
+        s = SecretsBase("fake-secret")
+        s.set_many({f"KEY{i}": f"VALUE{i}" for i in range(n)})
+        return s
+
+    def test_mapping_protocol(self):
+        s = self._secrets(3)
+        assert s["KEY1"] == "VALUE1"
+        assert "KEY2" in s
+        assert "MISSING" not in s
+        assert len(s) == 3
+        assert list(s.keys()) == ["KEY0", "KEY1", "KEY2"]
+        assert list(s.values()) == ["VALUE0", "VALUE1", "VALUE2"]
+        assert dict(s.items()) == dict(s)
+        assert s.get("MISSING") is None
+        assert s.get("MISSING", "default") == "default"
+        with self.assertRaises(KeyError):
+            s["MISSING"]
+
+    def test_lookup_cost_is_flat(self):
+        small = self._secrets(10)
+        large = self._secrets(10000)
+        small_t = min(timeit.repeat(lambda: small.get("KEY5"), number=10000, repeat=5))
+        large_t = min(timeit.repeat(lambda: large.get("KEY5"), number=10000, repeat=5))
+        # a copy of the map per lookup would make this ~1000x slower
+        assert large_t < small_t * 10
+
+    def test_poll_keeps_staged_changes(self):
+        s = UpstreamSecrets()
+        with s.batch():
+            s.set("A", "1")
+            # a poll tick from the scheduler landing inside the batch
+            s._poll_secrets()
+            assert s["A"] == "1"
+        assert s.written == [{"A": "1"}]
+
+        s._stage_set("B", "2")
+        s._poll_secrets()
+        assert s["B"] == "2"
+        s._commit()
+        assert s.written[-1] == {"A": "1", "B": "2"}
+
+        # with nothing pending the tick reloads as usual
+        s.upstream = {"C": "3"}
+        s._poll_secrets()
+        assert dict(s) == {"C": "3"}
+
+    def test_batch_does_not_take_other_threads_writes(self):
+        s = UpstreamSecrets()
+        writer = threading.Thread(target=s.set, args=("B", "2"))
+        with self.assertRaises(RuntimeError):
+            with s.batch():
+                s.set("A", "1")
+                writer.start()
+                writer.join(0.1)
+                # waits for the batch instead of joining it
+                assert writer.is_alive()
+                raise RuntimeError("boom")
+        writer.join()
+        assert dict(s) == {"B": "2"}
+        assert s.written == [{"B": "2"}]
+
+    def test_failed_write_does_not_stop_polling(self):
+        s = UpstreamSecrets()
+        s.set("A", "1")
+        with mock.patch.object(s, "update", side_effect=RuntimeError("boom")):
+            with self.assertRaises(RuntimeError):
+                s.set("B", "2")
+        assert dict(s) == {"A": "1"}
+        assert not s._secrets.changed_keys()
+
+        s.upstream = {"A": "rotated"}
+        s._poll_secrets()
+        assert dict(s) == {"A": "rotated"}
@@ -0,0 +1,70 @@
+import threading
+import time
+import unittest
+
+from cloudsecrets.cache import PayloadCache
+
+
+class TestCacheLibrary(unittest.TestCase):
+    def test_hits_and_misses(self):
+        cache = PayloadCache()
+        loads = []
+        loader = lambda: loads.append(1) or "payload"
+        assert cache.get_or_load(("aws", "r", "s", "v1"), loader) == "payload"
+        assert cache.get_or_load(("aws", "r", "s", "v1"), loader) == "payload"
+        assert len(loads) == 1
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    def test_latest_expires_pinned_does_not(self):
+        cache = PayloadCache(ttl=0.01)
+        cache.put(("aws", "r", "s", None), "latest", 6)
+        cache.put(("aws", "r", "s", "v1"), "pinned", 6)
+        time.sleep(0.02)
+        assert cache.get_or_load(("aws", "r", "s", None), lambda: "fresh") == "fresh"
+        assert cache.get_or_load(("aws", "r", "s", "v1"), lambda: "fresh") == "pinned"
+
+    def test_lru_eviction(self):
+        cache = PayloadCache(max_entries=2, max_bytes=10)
+        cache.put(("p", None, "a", "1"), "a", 4)
+        cache.put(("p", None, "b", "1"), "b", 4)
+        cache.get_or_load(("p", None, "a", "1"), lambda: "miss")
+        cache.put(("p", None, "c", "1"), "c", 4)
+        assert len(cache) == 2
+        assert cache.get_or_load(("p", None, "b", "1"), lambda: "miss") == "miss"
+        cache.put(("p", None, "d", "1"), "d", 8)
+        assert cache.size <= 10
+
+    def test_invalidate(self):
+        cache = PayloadCache()
+        cache.put(("p", None, "s", None), "latest")
+        cache.put(("p", None, "s", "1"), "pinned")
+        cache.invalidate("p", None, "s")
+        assert len(cache) == 1
+
+    def test_single_flight(self):
+        cache = PayloadCache()
+        calls = []
+        release = threading.Event()
+
+        def loader():
+            calls.append(1)
+            release.wait()
+            return "payload"
+
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(
+                    cache.get_or_load(("p", None, "s", None), loader)
+                )
+            )
+            for _ in range(8)
+        ]
+        for t in threads:
+            t.start()
+        time.sleep(0.05)
+        release.set()
+        for t in threads:
+            t.join()
+        assert len(calls) == 1
+        assert results == ["payload"] * 8
@@ -0,0 +1,92 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+import unittest.mock as mock
+
+from google.cloud import secretmanager
+
+from cloudsecrets import clients
+from cloudsecrets.cli import bulk, main
+from cloudsecrets.gcp import Secrets
+from tests.unit.test_gcp_library import InMemoryClient
+
+SECRETS = {"PLAIN": "value", "QUOTED": 'say "hi" $HOME\nnext line', "EMPTY": ""}
+
+
+class TestCLILibrary(unittest.TestCase):
+    def setUp(self):
+        clients.registry.clear()
+        os.environ["PROJECT"] = "not-a-real-project"
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.dir.name, name)
+
+    def test_formats_round_trip(self):
+        for fmt in ("json", "dotenv", "yaml"):
+            if fmt == "yaml":
+                try:
+                    import yaml  # noqa: F401
+                except ImportError:
+                    continue
+            assert bulk.loads(bulk.dumps(SECRETS, fmt), fmt) == SECRETS
+
+    def test_parse_dotenv(self):
+        text = "# comment\n\nexport A=1\nB='lit\\n'\nC=\"x\\ty\"\n"
+        assert bulk.parse_dotenv(text) == {"A": "1", "B": "lit\\n", "C": "x\ty"}
+        assert bulk.loads('{"N": 1, "O": {"a": true}}', "json") == {
+            "N": "1",
+            "O": '{"a": true}',
+        }
+
+    @mock.patch.object(secretmanager, "SecretManagerServiceClient")
+    def test_import_is_one_write(self, fake_client):
+        client = fake_client.return_value = InMemoryClient()
+        with open(self.path("app.env"), "w") as f:
+            f.write(bulk.dump_dotenv(SECRETS))
+        Secrets("app").set("STALE", "x")
+
+        client.calls.clear()
+        assert main(["import", "-s", "app", "-f", self.path("app.env")]) == 0
+        assert client.calls["add_secret_version"] == 1
+        assert dict(Secrets("app")) == dict(SECRETS, STALE="x")
+
+        main(["import", "-s", "app", "-f", self.path("app.env"), "--replace"])
+        assert dict(Secrets("app")) == SECRETS
+
+        # importing the same file again changes nothing, so nothing is written
+        client.calls.clear()
+        main(["import", "-s", "app", "-f", self.path("app.env"), "--replace"])
+        assert "add_secret_version" not in client.calls
+
+    @mock.patch.object(secretmanager, "SecretManagerServiceClient")
+    def test_export_to_stdout(self, fake_client):
+        fake_client.return_value = InMemoryClient()
+        Secrets("app").set_many(SECRETS)
+        with mock.patch("sys.stdout", new_callable=io.StringIO) as out:
+            main(["export", "-s", "app"])
+        assert json.loads(out.getvalue()) == SECRETS
+
+    @mock.patch.object(secretmanager, "SecretManagerServiceClient")
+    def test_manifest(self, fake_client):
+        fake_client.return_value = InMemoryClient()
+        Secrets("one").set("A", "1")
+        Secrets("two").set("B", "2")
+        manifest = [
+            {"secret": "one", "file": self.path("one.json")},
+            {"secret": "two", "file": self.path("two.env")},
+            {"secret": "three", "file": self.path("missing.json")},
+        ]
+        with open(self.path("manifest.json"), "w") as f:
+            json.dump(manifest[:2], f)
+        assert main(["export", "-m", self.path("manifest.json")]) == 0
+        assert bulk.read(self.path("one.json")) == {"A": "1"}
+        assert bulk.read(self.path("two.env")) == {"B": "2"}
+
+        errors = bulk.run_manifest(manifest, "import")
+        assert list(errors) == ["three"]
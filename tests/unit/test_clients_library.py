@@ -0,0 +1,69 @@
+import os
+import signal
+import threading
+import time
+import unittest
+
+from cloudsecrets.clients import ClientRegistry
+
+
+class TestClientsLibrary(unittest.TestCase):
+    def test_reuse(self):
+        registry = ClientRegistry()
+        a = registry.get(("aws", "us-east-1"), object)
+        assert registry.get(("aws", "us-east-1"), object) is a
+        assert registry.get(("aws", "us-west-2"), object) is not a
+
+    def test_register(self):
+        registry = ClientRegistry()
+        client = object()
+        registry.register(("gcp", None), client)
+        assert registry.get(("gcp", None), object) is client
+
+    def test_recreated_after_fork(self):
+        registry = ClientRegistry()
+        a = registry.get(("aws", "us-east-1"), object)
+        # what a forked child looks like: a registry created by another pid
+        registry._pid = -1
+        assert registry.get(("aws", "us-east-1"), object) is not a
+
+    @unittest.skipUnless(hasattr(os, "fork"), "requires os.fork")
+    def test_fork(self):
+        from cloudsecrets.clients import registry
+
+        a = registry.get(("test", "fork"), object)
+        r, w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.write(
+                w, b"1" if registry.get(("test", "fork"), object) is not a else b"0"
+            )
+            os._exit(0)
+        os.waitpid(pid, 0)
+        assert os.read(r, 1) == b"1"
+        assert registry.get(("test", "fork"), object) is a
+
+    @unittest.skipUnless(hasattr(os, "fork"), "requires os.fork")
+    def test_fork_while_creating_a_client(self):
+        from cloudsecrets.clients import registry
+
+        started = threading.Event()
+
+        def slow_factory():
+            started.set()
+            time.sleep(0.5)
+            return object()
+
+        thread = threading.Thread(
+            target=registry.get, args=(("test", "slow"), slow_factory)
+        )
+        thread.start()
+        started.wait()
+        pid = os.fork()
+        if pid == 0:
+            signal.alarm(2)
+            registry.get(("test", "slow"), object)
+            os._exit(0)
+        _, status = os.waitpid(pid, 0)
+        thread.join()
+        assert os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0
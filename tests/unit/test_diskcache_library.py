@@ -0,0 +1,100 @@
+import collections
+import os
+import tempfile
+import time
+import unittest
+import unittest.mock as mock
+
+import boto3
+from moto import mock_secretsmanager
+
+from cloudsecrets.aws import Secrets
+
+try:
+    from cryptography.fernet import Fernet
+    from cloudsecrets.diskcache import DiskCache
+except ImportError:
+    Fernet = None
+
+
+@unittest.skipIf(Fernet is None, "requires cryptography")
+class TestDiskCacheLibrary(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "cache.db")
+        self.key = Fernet.generate_key()
+        self.calls = collections.Counter()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def _count(self, model, **kwargs):
+        self.calls[model.name] += 1
+
+    def _open(self, connection, **kwargs):
+        return Secrets(
+            "disk-secret",
+            connection=connection,
+            is_binary=True,
+            disk_cache=DiskCache(self.path, key=self.key, **kwargs),
+        )
+
+    def test_encrypted_round_trip(self):
+        cache = DiskCache(self.path, key=self.key)
+        cache.put(("aws", "us-east-1", "s", None), {"A": "SECRET"})
+        state, age = cache.get(("aws", "us-east-1", "s", "latest"))
+        assert state == {"A": "SECRET"}
+        assert age < 5
+        assert b"SECRET" not in open(self.path, "rb").read()
+        other = DiskCache(self.path, key=Fernet.generate_key())
+        assert other.get(("aws", "us-east-1", "s", None)) is None
+        assert os.stat(self.path).st_mode & 0o077 == 0
+
+    @mock_secretsmanager
+    def test_fresh_entry_served_without_upstream(self):
+        connection = boto3.client("secretsmanager", region_name="us-east-1")
+        self._open(connection).set("A", "1")
+        connection.meta.events.register("before-call", self._count)
+        s = self._open(connection)
+        assert dict(s) == {"A": "1"}
+        assert self.calls == {}
+
+    @mock_secretsmanager
+    def test_stale_entry_validated_with_metadata_call(self):
+        connection = boto3.client("secretsmanager", region_name="us-east-1")
+        self._open(connection).set("A", "1")
+        connection.meta.events.register("before-call", self._count)
+        s = self._open(connection, max_age=0)
+        assert dict(s) == {"A": "1"}
+        assert self.calls == {"DescribeSecret": 1}
+
+    @mock_secretsmanager
+    def test_stale_if_error(self):
+        connection = boto3.client("secretsmanager", region_name="us-east-1")
+        self._open(connection).set("A", "1")
+        with mock.patch.object(
+            connection, "describe_secret", side_effect=RuntimeError("outage")
+        ):
+            s = self._open(connection, max_age=0)
+        assert dict(s) == {"A": "1"}
+        s = Secrets("disk-secret", connection=connection, is_binary=True)
+        s._disk_cache = DiskCache(self.path, key=self.key)
+        s._version = None
+        with mock.patch.object(
+            connection, "get_secret_value", side_effect=RuntimeError("outage")
+        ):
+            s._load_secrets()
+        assert dict(s) == {"A": "1"}
+
+    @mock_secretsmanager
+    def test_background_refresh(self):
+        connection = boto3.client("secretsmanager", region_name="us-east-1")
+        self._open(connection).set("A", "1")
+        Secrets("disk-secret", connection=connection, is_binary=True).set("A", "2")
+        s = self._open(connection, max_age=0, background_refresh=True)
+        assert dict(s) == {"A": "1"}
+        for _ in range(50):
+            if s.get("A") == "2":
+                break
+            time.sleep(0.02)
+        assert s.get("A") == "2"
@@ -16,3 +16,55 @@ class TestEnvLibrary(unittest.TestCase):
         assert "FAKE" not in dict(s)
         s.update()
         assert s.version == str(int(ver) + 3)
+
+    def test_batch_single_update(self):
+        s = Secrets("")
+        ver = s.version
+        with s.batch():
+            s.set("FAKE", "SECRET")
+            s.set("FAKE2", "SECRET2")
+            s.unset("FAKE")
+        assert s.version == str(int(ver) + 1)
+        assert "FAKE" not in dict(s)
+        assert dict(s).get("FAKE2") == "SECRET2"
+        s.set_many({"A": "1", "B": "2"})
+        s.unset_many(["A", "B"])
+        assert s.version == str(int(ver) + 3)
+
+    def test_batch_rollback_on_failed_update(self):
+        s = Secrets("")
+        ver = s.version
+        s.set("FAKE", "SECRET")
+        with mock.patch.object(s, "update", side_effect=RuntimeError("boom")):
+            with self.assertRaises(RuntimeError):
+                s.set_many({"FAKE": "OTHER", "NEW": "VALUE"})
+        assert dict(s).get("FAKE") == "SECRET"
+        assert "NEW" not in dict(s)
+        assert s.version == str(int(ver) + 1)
+
+    @mock.patch.dict(os.environ, {"APP_DB_PASSWORD": "hunter2", "APP_USER": "app"})
+    def test_prefix_is_stripped(self):
+        s = Secrets(prefix="APP_")
+        assert dict(s) == {"DB_PASSWORD": "hunter2", "USER": "app"}
+        assert s.version == "1"
+
+    @mock.patch.dict(os.environ, {"APP_A": "1"})
+    def test_reads_live_environment(self):
+        s = Secrets(prefix="APP_")
+        assert s._secrets._source is os.environ
+        os.environ["APP_A"] = "2"
+        os.environ["APP_B"] = "3"
+        assert dict(s) == {"A": "2", "B": "3"}
+
+        s.set("C", "4")
+        s.unset("A")
+        assert dict(s) == {"B": "3", "C": "4"}
+        assert "APP_C" not in os.environ and os.environ["APP_A"] == "2"
+
+    @mock.patch.dict(os.environ, {"APP_A": "1"})
+    def test_snapshot(self):
+        s = Secrets(prefix="APP_", snapshot=True)
+        os.environ["APP_A"] = "2"
+        assert dict(s) == {"A": "1"}
+        s._load_secrets()
+        assert dict(s) == {"A": "2"}
@@ -1,3 +1,6 @@
+import json
+import tempfile
+import time
 import unittest
 import unittest.mock as mock
 import os
@@ -46,3 +49,45 @@ class TestFileLibrary(unittest.TestCase):
         assert "FAKE" not in dict(s)
         s.update()
         assert s.version == "4"
+
+    def test_reload_round_trip(self):
+        with tempfile.TemporaryDirectory() as d:
+            filename = os.path.join(d, "secrets.json")
+            s = Secrets(filename)
+            s.set_many({"FAKE": "SECRET", "OTHER": "VALUE"})
+            s = Secrets(filename)
+            assert dict(s) == {"FAKE": "SECRET", "OTHER": "VALUE"}
+            assert s.version == "1"
+            assert os.listdir(d) == ["secrets.json"]
+
+    def test_reads_plain_values(self):
+        with tempfile.TemporaryDirectory() as d:
+            filename = os.path.join(d, "local.json")
+            with open(filename, "w") as f:
+                json.dump({"DB_PASSWORD": "hunter2", "PORT": 5432}, f)
+            s = Secrets(filename)
+            assert dict(s) == {"DB_PASSWORD": "hunter2", "PORT": "5432"}
+            s.set("NEW", "value")
+            with open(filename) as f:
+                assert json.load(f) == {
+                    "DB_PASSWORD": "hunter2",
+                    "PORT": "5432",
+                    "NEW": "value",
+                }
+
+    def test_bulk_load_does_not_write(self):
+        n = 10000
+        with tempfile.TemporaryDirectory() as d:
+            filename = os.path.join(d, "secrets.json")
+            with open(filename, "w") as f:
+                json.dump({f"KEY{i}": f"VALUE{i}" for i in range(n)}, f)
+            with mock.patch.object(Secrets, "update") as update:
+                start = time.perf_counter()
+                s = Secrets(filename)
+                elapsed = time.perf_counter() - start
+            update.assert_not_called()
+            assert len(s) == n
+            assert s["KEY42"] == "VALUE42"
+            assert s.version == "1"
+            # a write per key used to make this take many seconds
+            assert elapsed < 2
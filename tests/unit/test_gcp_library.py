@@ -1,8 +1,12 @@
+import collections
+import types
 import unittest
 import unittest.mock as mock
 import os
 
+from google.api_core import exceptions
 from google.cloud import secretmanager
+from cloudsecrets import clients
 from cloudsecrets.gcp import Secrets
 
 
@@ -14,7 +18,7 @@ class FakeClient:
     def __init__(self):
         pass
 
-    def project_path(self):
+    def project_path(self, *args):
         return "projects/fake-project"
 
     def secret_path(self, *args):
@@ -24,18 +28,115 @@ class FakeClient:
     def get_secret(*args):
         pass
 
-    def create_secret(self):
+    def create_secret(self, *args):
         pass
 
     @staticmethod
     def add_secret_version(*args):
         return FakeSecret
 
-    def access_secret_version(self):
-        pass
+    def access_secret_version(self, *args):
+        raise exceptions.NotFound("fake-secret has no versions")
+
+
+class FakeVersion:
+    def __init__(self, name, data=b"", state=1):
+        self.name = name
+        self.payload = types.SimpleNamespace(data=data)
+        self.state = state
+
+
+class InMemoryClient:
+    """
+    A stateful stand-in for SecretManagerServiceClient which counts upstream calls
+    """
+
+    def __init__(self):
+        self.secrets = {}
+        self.disabled = set()
+        self.calls = collections.Counter()
+
+    def project_path(self, project):
+        return f"projects/{project}"
+
+    def secret_path(self, project, secret):
+        return f"projects/{project}/secrets/{secret}"
+
+    def _secret(self, name):
+        if name not in self.secrets:
+            raise exceptions.NotFound(name)
+        return self.secrets[name]
+
+    def get_secret(self, name):
+        self.calls["get_secret"] += 1
+        self._secret(name)
+        return FakeVersion(name)
+
+    def create_secret(self, parent, secret_id, body):
+        self.calls["create_secret"] += 1
+        name = f"{parent}/secrets/{secret_id}"
+        if name in self.secrets:
+            raise exceptions.AlreadyExists(name)
+        self.secrets[name] = []
+
+    def add_secret_version(self, parent, payload):
+        self.calls["add_secret_version"] += 1
+        versions = self._secret(parent)
+        versions.append(payload["data"])
+        return FakeVersion(f"{parent}/versions/{len(versions)}")
+
+    def access_secret_version(self, name):
+        self.calls["access_secret_version"] += 1
+        parent, _, version = name.rpartition("/versions/")
+        versions = self._secret(parent)
+        if version == "latest":
+            version = len(versions)
+        if not versions or not 0 < int(version) <= len(versions):
+            raise exceptions.NotFound(name)
+        if f"{parent}/versions/{version}" in self.disabled:
+            raise exceptions.FailedPrecondition(name)
+        return FakeVersion(f"{parent}/versions/{version}", versions[int(version) - 1])
+
+    def disable_secret_version(self, name):
+        self.calls["disable_secret_version"] += 1
+        self.disabled.add(name)
+
+    def get_secret_version(self, name):
+        self.calls["get_secret_version"] += 1
+        parent, _, version = name.rpartition("/versions/")
+        versions = self._secret(parent)
+        if version == "latest":
+            version = len(versions)
+        if not versions or not 0 < int(version) <= len(versions):
+            raise exceptions.NotFound(name)
+        name = f"{parent}/versions/{version}"
+        return FakeVersion(name, state=2 if name in self.disabled else 1)
+
+    def list_secret_versions(self, parent):
+        self.calls["list_secret_versions"] += 1
+        versions = self._secret(parent)
+        # newest first, like the real API
+        names = [f"{parent}/versions/{i}" for i in range(len(versions), 0, -1)]
+        for n in names:
+            self.calls["list_secret_versions.item"] += 1
+            yield FakeVersion(n, state=2 if n in self.disabled else 1)
 
 
 class TestGCPLibrary(unittest.TestCase):
+    def setUp(self):
+        clients.registry.clear()
+
+    @mock.patch.object(secretmanager, "SecretManagerServiceClient")
+    def test_shared_client(self, fake_client):
+        os.environ["PROJECT"] = "not-a-real-project"
+        fake_client.side_effect = InMemoryClient
+        a = Secrets("fake-secret")
+        b = Secrets("other-secret")
+        assert a.client is b.client
+        assert fake_client.call_count == 1
+        injected = InMemoryClient()
+        assert Secrets("fake-secret", client=injected).client is injected
+
     @mock.patch.object(secretmanager, "SecretManagerServiceClient")
     def test_create_secret_version(self, fake_client):
         os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "not-a-real-path"
@@ -49,3 +150,145 @@ class TestGCPLibrary(unittest.TestCase):
         assert "FAKE" not in dict(s)
         s.update()
         assert s.version == "1"
+
+    @mock.patch.object(secretmanager, "SecretManagerServiceClient")
+    def test_upstream_call_counts(self, fake_client):
+        os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "not-a-real-path"
+        os.environ["PROJECT"] = "not-a-real-project"
+        client = InMemoryClient()
+        fake_client.return_value = client
+
+        # a missing secret: one failed fetch, one create
+        s = Secrets("fake-secret", create_if_not_present=True)
+        assert client.calls == {"access_secret_version": 1, "create_secret": 1}
+
+        # a write is a single add_secret_version, no existence probe
+        client.calls.clear()
+        s.set("FAKE", "SECRET")
+        assert client.calls == {"add_secret_version": 1}
+
+        # a cold load of an existing secret is a single fetch
+        client.calls.clear()
+        s = Secrets("fake-secret")
+        assert client.calls == {"access_secret_version": 1}
+        assert dict(s) == {"FAKE": "SECRET"}
+
+        client.calls.clear()
+        s.set("FAKE2", "SECRET2")
+        assert client.calls == {"add_secret_version": 1}
+
+    @mock.patch.object(secretmanager, "SecretManagerServiceClient")
+    def test_poll_skips_unchanged_payload(self, fake_client):
+        os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "not-a-real-path"
+        os.environ["PROJECT"] = "not-a-real-project"
+        client = InMemoryClient()
+        fake_client.return_value = client
+        changes = []
+
+        s = Secrets("fake-secret")
+        s.set("A", "1")
+        s.on_change(lambda old, new, keys: changes.append(keys))
+        client.calls.clear()
+        s._poll_secrets()
+        assert client.calls == {"get_secret_version": 1}
+
+        Secrets("fake-secret").set_many({"A": "2", "B": "3"})
+        client.calls.clear()
+        s._poll_secrets()
+        assert client.calls == {"get_secret_version": 1, "access_secret_version": 1}
+        assert dict(s) == {"A": "2", "B": "3"}
+        assert changes == [{"A", "B"}]
+
+    @mock.patch.object(secretmanager, "SecretManagerServiceClient")
+    def test_compare_and_swap_merges_concurrent_writers(self, fake_client):
+        os.environ["PROJECT"] = "not-a-real-project"
+        client = InMemoryClient()
+        fake_client.return_value = client
+
+        Secrets("fake-secret").set("BASE", "0")
+        a = Secrets("fake-secret", compare_and_swap=True)
+        b = Secrets("fake-secret", compare_and_swap=True)
+        a.set("A", "1")
+        client.calls.clear()
+        b.set("B", "2")
+        assert client.calls["disable_secret_version"] == 1
+        assert client.calls["add_secret_version"] == 2
+        assert dict(b) == {"BASE": "0", "A": "1", "B": "2"}
+        assert dict(Secrets("fake-secret")) == {"BASE": "0", "A": "1", "B": "2"}
+
+    @mock.patch.object(secretmanager, "SecretManagerServiceClient")
+    def test_readers_skip_version_disabled_by_losing_writer(self, fake_client):
+        from cloudsecrets import WriteConflict
+
+        os.environ["PROJECT"] = "not-a-real-project"
+        client = InMemoryClient()
+        fake_client.return_value = client
+
+        Secrets("fake-secret").set("BASE", "0")
+        reader = Secrets("fake-secret")
+        a = Secrets("fake-secret", compare_and_swap=True)
+        b = Secrets("fake-secret", compare_and_swap=True, max_conflict_retries=0)
+        a.set("A", "1")
+        with self.assertRaises(WriteConflict):
+            b.set("B", "2")
+
+        # "latest" is the disabled version 3 until another one is added
+        assert dict(Secrets("fake-secret")) == {"BASE": "0", "A": "1"}
+        reader._poll_secrets()
+        assert reader.version == "2"
+        assert dict(reader) == {"BASE": "0", "A": "1"}
+
+    @mock.patch.object(secretmanager, "SecretManagerServiceClient")
+    def test_rollback_uses_version_index(self, fake_client):
+        os.environ["PROJECT"] = "not-a-real-project"
+        client = InMemoryClient()
+        fake_client.return_value = client
+
+        s = Secrets("fake-secret")
+        for i in range(5):
+            s.set("N", str(i))
+        client.disabled.add(
+            "projects/not-a-real-project/secrets/fake-secret/versions/4"
+        )
+        s.rollback(-1)
+        assert s.version == "3"
+        assert dict(s) == {"N": "2"}
+
+        client.calls.clear()
+        s.rollback(-1)
+        assert s.version == "2"
+        assert "list_secret_versions" not in client.calls
+
+        # a later listing only pages until it reaches indexed versions
+        s.set("N", "new")
+        client.calls.clear()
+        s.rollback(-1)
+        assert s.version == "5"
+        assert client.calls["list_secret_versions.item"] == 2
+
+    @mock.patch.object(secretmanager, "SecretManagerServiceClient")
+    def test_chunked_payloads_are_read_in_parallel(self, fake_client):
+        os.environ["PROJECT"] = "not-a-real-project"
+        client = InMemoryClient()
+        fake_client.return_value = client
+        values = {f"KEY{i}": os.urandom(512).hex() for i in range(8)}
+
+        s = Secrets("fake-secret", compression="zlib", max_payload=1024)
+        s.set_many(values)
+        chunks = len(s._chunks)
+        assert chunks > 1
+        assert all(len(v[-1]) <= 1024 for v in client.secrets.values())
+
+        client.calls.clear()
+        with mock.patch(
+            "concurrent.futures.ThreadPoolExecutor.map", autospec=True
+        ) as pool_map:
+            pool_map.side_effect = lambda pool, fn, items: map(fn, items)
+            assert dict(Secrets("fake-secret")) == values
+        pool_map.assert_called_once()
+        assert client.calls == {"access_secret_version": chunks + 1}
+
+        # each version pins the chunk versions it was written with
+        s.set("KEY0", "small")
+        s.rollback(-1)
+        assert dict(s) == values
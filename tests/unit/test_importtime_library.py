@@ -0,0 +1,104 @@
+import os
+import subprocess
+import sys
+import textwrap
+import unittest
+
+# cumulative microseconds the cloudsecrets modules themselves may take to import
+IMPORT_BUDGET_US = 100000
+SDK_MODULES = (
+    "boto3",
+    "botocore",
+    "google.cloud.secretmanager",
+    "google.api_core",
+    "simplejson",
+)
+
+FAKE_AWS = """
+import types
+from cloudsecrets import clients
+
+class FakeClient:
+    exceptions = types.SimpleNamespace(
+        ResourceNotFoundException=type("ResourceNotFoundException", (Exception,), {}),
+    )
+    meta = types.SimpleNamespace(region_name="us-east-1")
+
+    def get_secret_value(self, **kwargs):
+        return {"VersionId": "1", "SecretString": '{"KEY": "VALUE"}'}
+
+clients.registry.register(clients.aws_key("us-east-1"), FakeClient())
+"""
+
+
+def importtime(code, *args) -> tuple:
+    """
+    Run code under -X importtime and return (stdout, [(depth, module, cumulative us)])
+    """
+    env = dict(os.environ, AWS_DEFAULT_REGION="us-east-1")
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", textwrap.dedent(code), *args],
+        capture_output=True,
+        text=True,
+        env=env,
+    )
+    assert proc.returncode == 0, proc.stderr[-2000:]
+    modules = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit():
+            depth = len(name) - len(name.lstrip())
+            modules.append((depth, name.strip(), int(cumulative)))
+    return proc.stdout, modules
+
+
+def cloudsecrets_cost(modules) -> int:
+    """
+    Cumulative import time of the outermost cloudsecrets modules. importtime
+    lists a module after everything it imported, so walk it backwards.
+    """
+    total = 0
+    ancestors = []
+    for depth, name, cumulative in reversed(modules):
+        while ancestors and ancestors[-1][0] >= depth:
+            ancestors.pop()
+        ours = name.split(".")[0] == "cloudsecrets"
+        if ours and not any(a[1] for a in ancestors):
+            total += cumulative
+        ancestors.append((depth, ours))
+    return total
+
+
+class TestImportTimeLibrary(unittest.TestCase):
+    def assert_lean(self, modules):
+        loaded = [m for _, m, _ in modules if m.startswith(SDK_MODULES)]
+        assert not loaded, f"provider SDKs imported: {loaded}"
+        assert cloudsecrets_cost(modules) < IMPORT_BUDGET_US
+
+    def test_cli_help(self):
+        _, modules = importtime("""
+            from cloudsecrets.cli import main
+            try:
+                main(["--help"])
+            except SystemExit:
+                pass
+            """)
+        self.assert_lean(modules)
+
+    def test_cli_decrypt(self):
+        out, modules = importtime(FAKE_AWS + """
+from cloudsecrets.cli import main
+main(["-D", "-p", "aws", "-s", "app", "-k", "KEY"])
+""")
+        assert out.strip() == "VALUE"
+        self.assert_lean(modules)
+
+    def test_aws_client_skips_boto3(self):
+        _, modules = importtime(
+            "from cloudsecrets.aws import _new_client; _new_client('us-east-1')"
+        )
+        loaded = {m for _, m, _ in modules}
+        assert "botocore.session" in loaded
+        assert not [m for m in loaded if m.startswith(("boto3", "google"))]
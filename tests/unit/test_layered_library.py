@@ -0,0 +1,132 @@
+import json
+import os
+import tempfile
+import unittest
+import unittest.mock as mock
+
+from cloudsecrets import env, file
+from cloudsecrets.lazy import decode
+from cloudsecrets.layered import Secrets
+
+
+class TestLayeredLibrary(unittest.TestCase):
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+        self.write_file({"A": "file", "B": "file"})
+        self.addCleanup(os.unlink, self.filename)
+
+    def write_file(self, values):
+        with open(self.filename, "w") as f:
+            json.dump(values, f)
+
+    def layers(self):
+        top = env.Secrets(prefix="APP_", snapshot=True)
+        middle = file.Secrets(self.filename)
+        bottom = env.Secrets(prefix="NOPE_", snapshot=True)
+        bottom.set_many({"A": "bottom", "C": "bottom"})
+        return top, middle, bottom
+
+    @mock.patch.dict(os.environ, {"APP_A": "env"})
+    def test_first_layer_wins(self):
+        s = Secrets(layers=self.layers())
+        assert dict(s) == {"A": "env", "B": "file", "C": "bottom"}
+        assert s["A"] == "env"
+        assert "C" in s
+        assert s.version == "1/1/2"
+
+    @mock.patch.dict(os.environ, {"APP_A": "env"})
+    def test_writes_go_to_write_layer(self):
+        top, middle, bottom = self.layers()
+        s = Secrets(layers=[top, middle, bottom], write_layer=middle)
+        assert s.write_layer is middle
+
+        s.set("D", "new")
+        assert s["D"] == "new"
+        with open(self.filename) as f:
+            assert json.load(f)["D"] == "new"
+        assert "D" not in top and "D" not in bottom
+
+        # shadowed by the env layer above
+        s.set("A", "file2")
+        assert s["A"] == "env"
+
+        # unset uncovers the layer below
+        s.unset("B")
+        s.unset("C")
+        assert "B" not in s
+        assert s["C"] == "bottom"
+        assert s.version == f"1/{middle.version}/2"
+
+    def test_batch_merges_once(self):
+        top, middle, bottom = self.layers()
+        s = Secrets(layers=[top, middle, bottom], write_layer=1)
+        with mock.patch.object(s, "_remerge", wraps=s._remerge) as remerge:
+            with s.batch():
+                s.set("A", "1")
+                s.set("E", "2")
+                s.unset("B")
+                assert "E" not in s
+        assert remerge.call_count == 1
+        assert middle.version == "2"
+        assert dict(s) == {"A": "1", "C": "bottom", "E": "2"}
+
+        with mock.patch.object(middle, "update", side_effect=RuntimeError("boom")):
+            with self.assertRaises(RuntimeError):
+                s.set_many({"A": "x", "F": "y"})
+        assert dict(s) == {"A": "1", "C": "bottom", "E": "2"}
+
+    def test_layer_change_is_merged_incrementally(self):
+        top, middle, bottom = self.layers()
+        s = Secrets(layers=[top, middle, bottom])
+        seen = []
+        s.on_change(lambda old, new, keys: seen.append((old, new, keys)))
+
+        # a layer polled on its own reports only the keys which changed
+        old = middle.secrets
+        self.write_file({"A": "file2", "B": "file"})
+        middle._version = "2"
+        middle._load_secrets()
+        with mock.patch.object(s, "_lookup", wraps=s._lookup) as lookup:
+            middle._notify_change(old, middle.secrets)
+        assert lookup.call_count == 1
+        assert s["A"] == "file2"
+        assert seen == [
+            (
+                {"A": "file", "B": "file", "C": "bottom"},
+                {"A": "file2", "B": "file", "C": "bottom"},
+                {"A"},
+            )
+        ]
+
+        # a layer changed directly is picked up by refresh()
+        bottom.unset("C")
+        assert "C" in s
+        s.refresh()
+        assert "C" not in s
+        assert s.version == f"1/2/{bottom.version}"
+
+    def test_poll_refreshes_layers(self):
+        top, middle, bottom = self.layers()
+        s = Secrets(layers=[top, middle, bottom])
+        self.write_file({"B": "polled"})
+        with mock.patch.object(
+            middle, "_latest_version", return_value="5"
+        ), mock.patch.object(bottom, "_poll_secrets") as untouched:
+            bottom._poll_job = object()
+            s._poll_secrets()
+        untouched.assert_not_called()
+        assert dict(s) == {"A": "bottom", "B": "polled", "C": "bottom"}
+        assert s.version == "1/5/2"
+
+    def test_store_interface(self):
+        s = Secrets(layers=self.layers())
+        encoded = s._encoded_secrets
+        assert {k: decode(v) for k, v in encoded.items()} == dict(s)
+        assert not s.secrets.changed_keys()
+        with self.assertRaises(TypeError):
+            s.rollback()
+        with self.assertRaises(TypeError):
+            s.delete()
+        with self.assertRaises(AssertionError):
+            Secrets(layers=self.layers(), disk_cache=object())
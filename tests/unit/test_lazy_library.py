@@ -0,0 +1,90 @@
+import base64
+import json
+import time
+import tracemalloc
+import unittest
+
+from cloudsecrets.lazy import LazySecrets
+
+
+class TestLazyLibrary(unittest.TestCase):
+    def test_decodes_on_first_access(self):
+        s = LazySecrets({"A": base64.b64encode(b"1").decode()})
+        assert s._decoded == {}
+        assert s["A"] == "1"
+        assert s._decoded == {"A": "1"}
+        s["B"] = "2"
+        assert s.encoded["B"] == base64.b64encode(b"2").decode()
+        del s["A"]
+        assert dict(s) == {"B": "2"}
+
+    def test_copy_is_independent(self):
+        s = LazySecrets.from_decoded({"A": "1", "B": {"json": True}})
+        assert s["B"] == '{"json": true}'
+        c = s.copy()
+        c["A"] = "changed"
+        assert s["A"] == "1"
+
+    def test_eager_vs_lazy_benchmark(self):
+        blob = base64.b64encode(b"x" * 256 * 1024).decode()
+        payload = json.dumps({f"CERT{i}": blob for i in range(40)})
+
+        def eager():
+            encoded = json.loads(payload)
+            return encoded, {
+                k: base64.b64decode(v).decode("utf-8") for k, v in encoded.items()
+            }
+
+        def lazy():
+            s = LazySecrets(json.loads(payload))
+            s["CERT0"]
+            return s
+
+        results = {}
+        for name, load in (("eager", eager), ("lazy", lazy)):
+            tracemalloc.start()
+            start = time.perf_counter()
+            kept = load()
+            elapsed = time.perf_counter() - start
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            results[name] = (elapsed, current)
+            del kept
+        # eager holds the encoded and the decoded form of every key
+        assert results["lazy"][1] < results["eager"][1] * 0.7
+        assert results["lazy"][0] < results["eager"][0]
+
+    def test_incremental_dumps(self):
+        s = LazySecrets.from_decoded({f"K{i}": str(i) for i in range(5)})
+        assert s.dumps() == json.dumps(s.encoded)
+        s["K2"] = "changed"
+        del s["K0"]
+        s["K0"] = "re-added"
+        s["NEW"] = "value"
+        assert s.dumps() == json.dumps(s.encoded)
+        assert json.loads(s.dumps()) == s.encoded
+
+    def test_changed_keys(self):
+        s = LazySecrets.from_decoded({"A": "1", "B": "2"})
+        s.mark_clean()
+        s["A"] = "1"
+        assert s.changed_keys() == set()
+        s["A"] = "changed"
+        s["A"] = "1"
+        del s["B"]
+        s["C"] = "3"
+        assert s.changed_keys() == {"B", "C"}
+        s.mark_clean()
+        assert s.changed_keys() == set()
+
+    def test_revert(self):
+        s = LazySecrets.from_decoded({"A": "1", "B": "2"})
+        s.mark_clean()
+        s.dumps()
+        s["A"] = "changed"
+        del s["B"]
+        s["C"] = "3"
+        s.revert()
+        assert dict(s) == {"A": "1", "B": "2"}
+        assert s.changed_keys() == set()
+        assert json.loads(s.dumps()) == s.encoded
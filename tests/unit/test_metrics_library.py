@@ -0,0 +1,96 @@
+import unittest
+
+import boto3
+
+from cloudsecrets import metrics
+from cloudsecrets.aws import Secrets
+from cloudsecrets.cache import PayloadCache
+
+
+class Recorder(metrics.Metrics):
+    def __init__(self) -> None:
+        self.calls = []
+        self.payloads = []
+        self.cache = []
+
+    def observe_call(self, provider, operation, seconds, error=None) -> None:
+        self.calls.append((provider, operation, error))
+
+    def observe_payload(self, provider, secret, size) -> None:
+        self.payloads.append((provider, secret, size))
+
+    def observe_cache(self, cache, hit) -> None:
+        self.cache.append((cache, hit))
+
+
+class TestMetricsLibrary(unittest.TestCase):
+    from moto import mock_secretsmanager
+
+    @mock_secretsmanager
+    def test_provider_calls_and_payloads(self):
+        connection = boto3.client("secretsmanager", region_name="us-east-1")
+        recorder = Recorder()
+        secrets = Secrets(
+            "METRICS", connection=connection, is_binary=True, metrics=recorder
+        )
+        assert ("aws", "get_secret_value", "not_found") in recorder.calls
+        assert ("aws", "create_secret", None) in recorder.calls
+        secrets.set("KEY", "VALUE")
+        Secrets("METRICS", connection=connection, is_binary=True, metrics=recorder)
+        assert recorder.payloads[-1][:2] == ("aws", "METRICS")
+        assert recorder.payloads[-1][2] > 0
+
+    @mock_secretsmanager
+    def test_no_hook_no_instrumentation(self):
+        connection = boto3.client("secretsmanager", region_name="us-east-1")
+        secrets = Secrets("METRICS", connection=connection, is_binary=True)
+        assert secrets._metrics is None
+
+    def test_cache_hits_and_misses(self):
+        recorder = Recorder()
+        cache = PayloadCache(metrics=recorder)
+        cache.get_or_load(("p", None, "s", "1"), lambda: "payload")
+        cache.get_or_load(("p", None, "s", "1"), lambda: "payload")
+        assert recorder.cache == [("payload", False), ("payload", True)]
+
+    def test_default_hook(self):
+        recorder = Recorder()
+        metrics.set_default(recorder)
+        try:
+            PayloadCache().get_or_load(("p", None, "s", "1"), lambda: "payload")
+        finally:
+            metrics.set_default(None)
+        assert recorder.cache == [("payload", False)]
+
+    def test_opentelemetry(self):
+        try:
+            import opentelemetry.metrics  # noqa: F401
+        except ImportError:
+            raise unittest.SkipTest("opentelemetry-api not installed")
+        hook = metrics.OpenTelemetryMetrics()
+        hook.observe_call("aws", "get_secret_value", 0.01)
+        hook.observe_call("aws", "get_secret_value", 0.01, "throttled")
+        hook.observe_payload("aws", "s", 42)
+        hook.observe_poll("aws", "s", 0.5)
+        hook.observe_cache("payload", True)
+
+    def test_prometheus(self):
+        try:
+            import prometheus_client
+        except ImportError:
+            raise unittest.SkipTest("prometheus_client not installed")
+        registry = prometheus_client.CollectorRegistry()
+        hook = metrics.PrometheusMetrics(registry=registry)
+        hook.observe_call("aws", "get_secret_value", 0.01, "throttled")
+        hook.observe_cache("disk", False)
+        assert (
+            registry.get_sample_value(
+                "cloudsecrets_provider_calls_total",
+                {
+                    "provider": "aws",
+                    "operation": "get_secret_value",
+                    "outcome": "throttled",
+                },
+            )
+            == 1
+        )
@@ -0,0 +1,98 @@
+import time
+import unittest
+
+from botocore.exceptions import ClientError
+from google.api_core import exceptions
+
+from cloudsecrets import retry
+from cloudsecrets.retry import CircuitBreaker, CircuitOpen, RequestLayer, TokenBucket
+
+
+def client_error(code):
+    return ClientError({"Error": {"Code": code, "Message": code}}, "GetSecretValue")
+
+
+class Flaky:
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+class TestRetryLibrary(unittest.TestCase):
+    def test_classify(self):
+        assert (
+            retry.classify(client_error("ResourceNotFoundException")) == retry.NOT_FOUND
+        )
+        assert retry.classify(client_error("ThrottlingException")) == retry.THROTTLED
+        assert retry.classify(client_error("InternalServiceError")) == retry.TRANSIENT
+        assert retry.classify(client_error("AccessDeniedException")) == retry.FATAL
+        assert retry.classify(exceptions.NotFound("x")) == retry.NOT_FOUND
+        assert retry.classify(exceptions.ResourceExhausted("x")) == retry.THROTTLED
+        assert retry.classify(exceptions.ServiceUnavailable("x")) == retry.TRANSIENT
+        assert retry.classify(ValueError("x")) == retry.FATAL
+
+    def test_retries_throttling(self):
+        layer = RequestLayer(base_delay=0)
+        fn = Flaky(
+            client_error("ThrottlingException"), exceptions.ServiceUnavailable("x")
+        )
+        assert layer.call(("aws", "us-east-1"), fn) == "ok"
+        assert fn.calls == 3
+
+    def test_does_not_retry_not_found_or_fatal(self):
+        layer = RequestLayer(base_delay=0)
+        for error in (client_error("ResourceNotFoundException"), ValueError("x")):
+            fn = Flaky(error)
+            with self.assertRaises(type(error)):
+                layer.call(("aws", "us-east-1"), fn)
+            assert fn.calls == 1
+
+    def test_gives_up(self):
+        layer = RequestLayer(max_attempts=3, base_delay=0)
+        fn = Flaky(*[client_error("ThrottlingException")] * 5)
+        with self.assertRaises(ClientError):
+            layer.call(("aws", "us-east-1"), fn)
+        assert fn.calls == 3
+
+    def test_circuit_breaker(self):
+        layer = RequestLayer(max_attempts=1, base_delay=0)
+        scope = ("gcp", "project")
+        layer.configure(
+            scope, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+        )
+        for _ in range(2):
+            with self.assertRaises(exceptions.ServiceUnavailable):
+                layer.call(scope, Flaky(exceptions.ServiceUnavailable("x")))
+        fn = Flaky()
+        with self.assertRaises(CircuitOpen):
+            layer.call(scope, fn)
+        assert fn.calls == 0
+        time.sleep(0.06)
+        assert layer.call(scope, fn) == "ok"
+        assert not layer.breaker(scope).open
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=100, burst=5)
+        start = time.monotonic()
+        for _ in range(15):
+            bucket.acquire()
+        # 5 from the burst, then 10 at 100/s
+        assert time.monotonic() - start >= 0.09
+
+    def test_writes_are_not_retried_once_they_may_have_landed(self):
+        layer = RequestLayer(base_delay=0)
+        fn = Flaky(exceptions.DeadlineExceeded("x"))
+        with self.assertRaises(exceptions.DeadlineExceeded):
+            layer.call_write(("gcp", "project"), fn)
+        assert fn.calls == 1
+        fn = Flaky(
+            client_error("ThrottlingException"), exceptions.ServiceUnavailable("x")
+        )
+        assert layer.call_write(("gcp", "project"), fn) == "ok"
+        assert fn.calls == 3
@@ -0,0 +1,77 @@
+import gc
+import os
+import threading
+import time
+import unittest
+
+from cloudsecrets import SecretsBase
+from cloudsecrets.scheduler import RefreshScheduler
+
+
+class CountingSecrets(SecretsBase):
+    def __init__(self, secret, **kwargs) -> None:
+        super().__init__(secret, **kwargs)
+        self.polls = 0
+        self._init_secrets()
+
+    def _poll_secrets(self):
+        self.polls += 1
+        super()._poll_secrets()
+
+
+class TestSchedulerLibrary(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = RefreshScheduler(max_workers=2, jitter=0.1)
+
+    def tearDown(self):
+        self.scheduler.shutdown()
+
+    def test_shared_threads(self):
+        before = threading.active_count()
+        secrets = [
+            CountingSecrets(f"s{i}", polling_interval=0.02, scheduler=self.scheduler)
+            for i in range(20)
+        ]
+        time.sleep(0.3)
+        # one dispatcher plus at most max_workers pollers, regardless of instance count
+        assert threading.active_count() - before <= 3
+        assert all(s.polls > 1 for s in secrets)
+        for s in secrets:
+            s.close()
+
+    def test_close_stops_polling(self):
+        with CountingSecrets("s", polling_interval=0.02, scheduler=self.scheduler) as s:
+            time.sleep(0.1)
+        time.sleep(0.05)
+        polls = s.polls
+        time.sleep(0.1)
+        assert s.polls == polls
+
+    def test_collected_instances_are_dropped(self):
+        s = CountingSecrets("s", polling_interval=0.02, scheduler=self.scheduler)
+        job = s._poll_job
+        del s
+        gc.collect()
+        assert job.callback() is None
+        time.sleep(0.1)
+        assert not self.scheduler._heap
+
+    @unittest.skipUnless(hasattr(os, "fork"), "requires os.fork")
+    def test_polls_after_fork(self):
+        before = CountingSecrets("s", polling_interval=0.02, scheduler=self.scheduler)
+        r, w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                polls = before.polls
+                after = CountingSecrets(
+                    "t", polling_interval=0.02, scheduler=self.scheduler
+                )
+                time.sleep(0.3)
+                ok = before.polls > polls and after.polls > 1
+                os.write(w, b"1" if ok else b"0")
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        assert os.read(r, 1) == b"1"
+        before.close()
@@ -0,0 +1,58 @@
+import unittest
+
+from nose.tools import assert_raises
+
+from cloudsecrets import storage
+from cloudsecrets.lazy import LazySecrets
+
+
+class TestStorageLibrary(unittest.TestCase):
+    def payload(self):
+        return LazySecrets.from_decoded({"A": "x" * 1000, "B": "y"}).dumps().encode()
+
+    def test_pack_round_trip(self):
+        data = self.payload()
+        for compression in ("none", "zlib"):
+            blob = storage.pack(data, compression)
+            assert storage.is_packed(blob)
+            assert not storage.is_chunked(blob)
+            assert storage.unpack(blob) == data
+        assert len(storage.pack(data, "zlib")) < len(data) / 4
+
+    def test_zstd(self):
+        try:
+            import zstandard  # noqa: F401
+        except ImportError:
+            raise unittest.SkipTest("zstandard not installed")
+        data = self.payload()
+        assert storage.unpack(storage.pack(data, "zstd")) == data
+
+    def test_legacy_payloads_are_not_packed(self):
+        assert not storage.is_packed(b"{}")
+        assert not storage.is_packed(self.payload())
+        assert not storage.is_packed(b"")
+
+    def test_unknown_versions_and_codecs_are_rejected(self):
+        blob = storage.pack(self.payload())
+        with assert_raises(ValueError):
+            storage.unpack(blob[:3] + bytes([storage.FORMAT_VERSION + 1]) + blob[4:])
+        with assert_raises(ValueError):
+            storage.unpack(blob[:4] + bytes([99]) + blob[5:])
+        with assert_raises(ValueError):
+            storage.pack(self.payload(), "lz4")
+
+    def test_chunks(self):
+        blob = storage.pack(self.payload(), "none")
+        parts = storage.split(blob, 100)
+        assert len(parts) == len(blob) // 100 + 1
+        refs = [(f"s--chunk-{i}", str(i + 1)) for i in range(len(parts))]
+        manifest = storage.manifest(refs, blob)
+        assert storage.is_packed(manifest) and storage.is_chunked(manifest)
+        assert storage.chunks(manifest) == refs
+        assert storage.join(manifest, parts) == blob
+        with assert_raises(ValueError):
+            storage.unpack(manifest)
+        with assert_raises(ValueError):
+            storage.join(manifest, parts[:-1])
+        with assert_raises(ValueError):
+            storage.join(manifest, [b"X" * len(parts[0])] + parts[1:])
@@ -0,0 +1,38 @@
+import unittest
+
+from nose.tools import assert_raises
+
+from cloudsecrets.versions import VersionIndex
+
+
+class TestVersionsLibrary(unittest.TestCase):
+    def test_extend_and_step(self):
+        index = VersionIndex()
+        index.extend([("a", True), ("b", False), ("c", True)])
+        index.extend([("c", True), ("d", True)])
+        assert index.ids() == ["a", "b", "c", "d"]
+        assert index.ids(enabled_only=True) == ["a", "c", "d"]
+        assert index.newest == "d"
+        assert index.step("d", -1) == "c"
+        assert index.step("c", -1, enabled_only=True) == "a"
+        assert index.at(1, enabled_only=True) == "c"
+        with assert_raises(IndexError):
+            index.step("a", -1)
+        with assert_raises(KeyError):
+            index.step("z", -1)
+
+    def test_exclude_and_reenable(self):
+        index = VersionIndex()
+        index.extend([("1", True), ("2", True), ("3", True)])
+        index.exclude("2")
+        assert index.step("3", -1, enabled_only=True) == "1"
+        index.extend([("2", True)])
+        assert index.step("3", -1, enabled_only=True) == "2"
+
+    def test_replace(self):
+        index = VersionIndex()
+        index.extend([("1", True), ("2", True)])
+        index.replace([("2", False), ("3", True)])
+        assert index.ids() == ["2", "3"]
+        assert "1" not in index
+        assert index.ids(enabled_only=True) == ["3"]